@@ -0,0 +1,234 @@
+"""
+Approximate answers for the analytics endpoints (`approx=true`).
+
+Exact mode runs count(distinct ...) over customers, products or orders,
+and sums every order item (or rollup row). On large data those scans
+dominate latency. Approximate mode avoids both:
+
+- Distinct customers and orders come from merging the per-day HyperLogLog
+  sketches in `rollup_daily_sketches` (see app.sketches). That reads a few
+  bytes per day and group.
+- Sums and averages are estimated from a random sample of roughly
+  APPROX_SAMPLE_ROWS rows of `rollup_daily_sales`, scaled up by the
+  sampling fraction. Each rollup row already carries its brand, country
+  and age band, so the sample needs no joins. On Postgres the sample is
+  TABLESAMPLE SYSTEM, which reads only the sampled pages. Elsewhere it's a
+  hash of the row id. A rollup smaller than the sample is read whole, and
+  then the sums are exact.
+- Per-product and per-day rollups are already small, so product counts
+  and daily revenue still come from them, exactly.
+
+Each approximate value comes with `error_bounds`: the half-width of its
+95% confidence interval, keyed by field. A rollup row is a cluster of
+items, so sums use the cluster-sample variance and averages the ratio
+estimator's. Both treat the sample as row-level. Postgres samples whole
+pages, which amounts to the same thing as long as a group's rows aren't
+clustered on a few pages. The rollup is stored in refresh order (by
+day), not by brand or country. A group too rare to appear in the sample
+reports zero revenue.
+
+These answers are read from the rollup tables even with USE_ROLLUPS=false,
+since the ETL maintains them either way.
+"""
+import math
+from collections import defaultdict
+from datetime import date
+from typing import Dict, List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Float, bindparam, func, literal, select, tablesample, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app import sketches, timeseries
+from app.config import settings
+from app.database import fetch_all
+from app.models import DailySalesRollup, DailySketchRollup, DailyTotalsRollup, ProductSalesRollup
+from app.schemas import AgeDistribution, CountryRevenue, RevenueByBrand, RevenueOverTime
+
+# Fixed seed, so repeated requests sample the same rows
+SAMPLE_SEED = 42
+# Multiplicative hash for sampling by row id where TABLESAMPLE isn't available
+_ID_HASH = 2654435761
+_HASH_RANGE = 1 << 32
+
+
+async def sample_fraction(db: AsyncSession) -> float:
+    """Fraction of rollup_daily_sales to sample for about APPROX_SAMPLE_ROWS rows"""
+    if db.bind.dialect.name == "postgresql":
+        # The planner's row estimate: free, and close enough to size a sample
+        rows = (await db.execute(text(
+            "SELECT reltuples FROM pg_class WHERE oid = 'rollup_daily_sales'::regclass"
+        ))).scalar()
+    else:
+        rows = (await db.execute(select(func.count()).select_from(DailySalesRollup))).scalar()
+    if not rows or rows <= settings.approx_sample_rows:
+        return 1.0
+    return settings.approx_sample_rows / rows
+
+
+def _sampled_sales(fraction: float, dialect: str):
+    """Sales rollup entity to select from, and filters that draw the sample from it"""
+    if fraction >= 1.0:
+        return DailySalesRollup, []
+    if dialect == "postgresql":
+        sampled = tablesample(
+            DailySalesRollup.__table__, func.system(bindparam("sample_percent", fraction * 100, type_=Float)),
+            name="sampled_sales", seed=literal(SAMPLE_SEED)
+        )
+        return aliased(DailySalesRollup, sampled), []
+    return DailySalesRollup, [(DailySalesRollup.id * _ID_HASH) % _HASH_RANGE < int(fraction * _HASH_RANGE)]
+
+
+def _sample_sums(sales):
+    """Per-group sums over sampled rollup rows: revenue (y), priced items (x) and their squares and product"""
+    y, x = func.coalesce(sales.revenue, 0.0), sales.priced_complete_count
+    return (
+        func.sum(y).label("y"),
+        func.sum(y * y).label("yy"),
+        func.sum(x).label("x"),
+        func.sum(x * x).label("xx"),
+        func.sum(x * y).label("xy")
+    )
+
+
+def scaled_sum(y: float, yy: float, fraction: float) -> Tuple[float, float]:
+    """Estimate of a population sum from sampled clusters' totals, with its 95% bound"""
+    variance = (1 - fraction) / (fraction * fraction) * (yy or 0)
+    return (y or 0) / fraction, sketches.Z_95 * math.sqrt(max(variance, 0.0))
+
+
+def ratio(y: float, yy: float, x: float, xx: float, xy: float, fraction: float) -> Tuple[float, float]:
+    """Ratio estimate of sum(y) / sum(x) from sampled clusters, with its 95% bound"""
+    if not x:
+        return 0.0, 0.0
+    r = y / x
+    residuals = max(yy - 2 * r * xy + r * r * xx, 0.0)
+    return r, sketches.Z_95 * math.sqrt((1 - fraction) * residuals) / x
+
+
+def _count(registers) -> Tuple[int, float]:
+    count = sketches.estimate(registers)
+    return int(round(count)), sketches.error_bound(count)
+
+
+async def _customer_counts(db: AsyncSession, dimension: str) -> Dict[str, Tuple[int, float]]:
+    """Distinct customers with a completed item per country or age band, from the daily sketches"""
+    rows = await fetch_all(db, select(DailySketchRollup.value, DailySketchRollup.customers).where(
+        DailySketchRollup.dimension == dimension, DailySketchRollup.value.isnot(None)
+    ))
+    merged = await run_in_threadpool(sketches.merge, rows)
+    return {value: _count(registers) for value, registers in merged.items()}
+
+
+async def _sample(db: AsyncSession, *dimensions, where=()):
+    """Sampled revenue sums per group of sales rollup columns, and the sampling fraction"""
+    fraction = await sample_fraction(db)
+    sales, filters = _sampled_sales(fraction, db.bind.dialect.name)
+    columns = [getattr(sales, dimension) for dimension in dimensions]
+    statement = select(*columns, *_sample_sums(sales)).where(
+        *filters, *(condition(sales) for condition in where)
+    ).group_by(*columns)
+    return await fetch_all(db, statement), fraction
+
+
+def _sample_totals(rows, key: str) -> Dict[str, List[float]]:
+    """Add up sampled sums per value of one column"""
+    totals = defaultdict(lambda: [0.0] * 5)
+    for row in rows:
+        group = totals[getattr(row, key)]
+        for i, value in enumerate((row.y, row.yy, row.x, row.xx, row.xy)):
+            group[i] += value or 0
+    return totals
+
+
+async def revenue_by_brand(db: AsyncSession, limit: int) -> List[RevenueByBrand]:
+    # Like the exact breakdown, only items whose product exists
+    sampled, fraction = await _sample(db, "brand", where=[lambda sales: sales.has_product])
+    # Products per brand is a small exact rollup; no need to estimate it
+    products = await fetch_all(db, select(
+        ProductSalesRollup.brand, func.count(ProductSalesRollup.product_id)
+    ).where(ProductSalesRollup.complete_count > 0).group_by(ProductSalesRollup.brand))
+
+    revenue = {row.brand: scaled_sum(row.y, row.yy, fraction) for row in sampled}
+    ranked = sorted(
+        ((brand, product_count, revenue.get(brand, (0.0, 0.0))) for brand, product_count in products),
+        key=lambda item: item[2][0], reverse=True
+    )
+    return [
+        RevenueByBrand(
+            brand=brand or "Unknown",
+            revenue=float(estimate),
+            product_count=int(product_count),
+            error_bounds={"revenue": bound}
+        )
+        for brand, product_count, (estimate, bound) in ranked[:max(limit, 0)]
+    ]
+
+
+async def age_distribution(db: AsyncSession) -> List[AgeDistribution]:
+    customers = await _customer_counts(db, "age_band")
+    rows, fraction = await _sample(db, "age_band")
+    sums = _sample_totals(rows, "age_band")
+    results = []
+    for band in sorted(customers, key=lambda band: (band != "Under 18", band)):
+        count, count_bound = customers[band]
+        mean, mean_bound = ratio(*sums.get(band, [0.0] * 5), fraction)
+        results.append(AgeDistribution(
+            age_range=band,
+            customer_count=count,
+            avg_order_value=float(mean),
+            error_bounds={"customer_count": count_bound, "avg_order_value": mean_bound}
+        ))
+    return results
+
+
+async def revenue_by_country(db: AsyncSession, limit: int) -> List[CountryRevenue]:
+    customers = await _customer_counts(db, "country")
+    rows, fraction = await _sample(db, "country")
+    revenue = {country: scaled_sum(y, yy, fraction) for country, (y, yy, *_) in _sample_totals(rows, "country").items()}
+    ranked = sorted(customers, key=lambda country: revenue.get(country, (0.0, 0.0))[0], reverse=True)
+    return [
+        CountryRevenue(
+            country=country,
+            revenue=float(revenue.get(country, (0.0, 0.0))[0]),
+            customer_count=customers[country][0],
+            error_bounds={"revenue": revenue.get(country, (0.0, 0.0))[1], "customer_count": customers[country][1]}
+        )
+        for country in ranked[:max(limit, 0)]
+    ]
+
+
+async def revenue_over_time(
+    db: AsyncSession,
+    start: date,
+    end: date,
+    granularity: str,
+    fill: bool
+) -> List[RevenueOverTime]:
+    """Revenue per bucket from the daily totals, and distinct orders per bucket from merged daily sketches"""
+    totals = await fetch_all(db, select(DailyTotalsRollup.day, DailyTotalsRollup.revenue).where(
+        DailyTotalsRollup.day.between(start, end)
+    ))
+    daily_sketches = await fetch_all(db, select(DailySketchRollup.day, DailySketchRollup.orders).where(
+        DailySketchRollup.dimension == "all", DailySketchRollup.day.between(start, end)
+    ))
+
+    revenue = defaultdict(float)
+    for day, day_revenue in totals:
+        revenue[timeseries.first_bucket(timeseries.as_date(day), granularity)] += day_revenue or 0
+    merged = await run_in_threadpool(sketches.merge, (
+        (timeseries.first_bucket(timeseries.as_date(day), granularity), blob) for day, blob in daily_sketches
+    ))
+    orders = {bucket: _count(registers) for bucket, registers in merged.items()}
+
+    buckets = timeseries.buckets(start, end, granularity) if fill else sorted(revenue.keys() | orders.keys())
+    return [
+        RevenueOverTime(
+            date=bucket.isoformat(),
+            revenue=float(revenue.get(bucket, 0.0)),
+            order_count=orders.get(bucket, (0, 0.0))[0],
+            error_bounds={"order_count": orders.get(bucket, (0, 0.0))[1]}
+        )
+        for bucket in buckets
+    ]
@@ -0,0 +1,175 @@
+"""
+Response cache for the analytics endpoints.
+
+Analytics data only changes when the ETL (or a rollup refresh) runs, so
+responses are cached per route + query string and tagged with the data
+generation they were computed from. Writers bump the counter in the
+`data_generation` table; each worker polls it at most every
+`DATA_GENERATION_POLL_SECONDS` and drops entries from older generations.
+Responses carry a content-hash ETag so browsers can revalidate with
+If-None-Match and get a 304 straight from memory.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update, insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.config import settings
+from app.database import engine
+from app.models import DataGeneration
+
+logger = logging.getLogger(__name__)
+
+CACHED_PREFIX = "/analytics/"
+# Streamed exports would have to be buffered whole to be cached
+UNCACHED_PREFIX = "/analytics/export/"
+
+# Per-route TTLs in seconds; anything not listed uses RESPONSE_CACHE_TTL_SECONDS.
+# The time series default to ranges ending today, so they expire sooner.
+ROUTE_TTLS: Dict[str, float] = {
+    "/analytics/revenue-over-time": 60,
+    "/analytics/timeseries": 60,
+}
+
+
+def bump_generation(conn: Connection):
+    """Mark analytics data as changed (call inside the writer's transaction)"""
+    result = conn.execute(
+        update(DataGeneration).where(DataGeneration.id == 1).values(generation=DataGeneration.generation + 1)
+    )
+    if result.rowcount == 0:
+        conn.execute(insert(DataGeneration).values(id=1, generation=1))
+
+
+_generation_lock = threading.Lock()
+_generation = 0
+_generation_checked_at = float("-inf")
+
+
+def current_generation() -> int:
+    """Latest known data generation, re-read from the database at most once per poll interval"""
+    global _generation, _generation_checked_at
+    with _generation_lock:
+        now = time.monotonic()
+        if now - _generation_checked_at < settings.data_generation_poll_seconds:
+            return _generation
+        try:
+            with engine.connect() as conn:
+                value = conn.execute(
+                    select(DataGeneration.generation).where(DataGeneration.id == 1)
+                ).scalar()
+            _generation = value or 0
+        except SQLAlchemyError as e:
+            # Keep serving the last known generation; TTLs still bound staleness
+            logger.warning("Could not read data generation: %s", e)
+        _generation_checked_at = now
+        return _generation
+
+
+class CachedResponse(NamedTuple):
+    generation: int
+    expires_at: float
+    etag: str
+    body: bytes
+    media_type: Optional[str]
+
+
+class ResponseCache:
+    """Bounded LRU cache with per-entry expiry and generation tagging"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str], generation: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.generation != generation or entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple[str, str], entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache(settings.response_cache_max_entries)
+
+
+def _cache_key(request: Request) -> Tuple[str, str]:
+    # Sort parameters so ?limit=10&days=7 and ?days=7&limit=10 share an entry
+    return request.url.path, "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+def _respond(request: Request, entry: CachedResponse, cache_status: str) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "X-Cache": cache_status}
+    if _etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+
+class AnalyticsCacheMiddleware(BaseHTTPMiddleware):
+    """Serve GET /analytics/* from the response cache, answering If-None-Match with 304"""
+
+    async def dispatch(self, request: Request, call_next):
+        if (
+            not settings.response_cache_enabled
+            or request.method != "GET"
+            or not request.url.path.startswith(CACHED_PREFIX)
+            or request.url.path.startswith(UNCACHED_PREFIX)
+        ):
+            return await call_next(request)
+
+        key = _cache_key(request)
+        generation = await run_in_threadpool(current_generation)
+        entry = response_cache.get(key, generation)
+        if entry is not None:
+            return _respond(request, entry, "HIT")
+
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        ttl = ROUTE_TTLS.get(request.url.path, settings.response_cache_ttl_seconds)
+        entry = CachedResponse(
+            generation=generation,
+            expires_at=time.monotonic() + ttl,
+            etag='"' + hashlib.sha1(body).hexdigest() + '"',
+            body=body,
+            media_type=response.headers.get("content-type"),
+        )
+        response_cache.put(key, entry)
+        return _respond(request, entry, "MISS")
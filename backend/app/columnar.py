@@ -0,0 +1,356 @@
+"""
+Columnar analytics backend: Parquet snapshots of fct_order_items, queried in-process with DuckDB.
+
+`export_snapshot()` writes the denormalized fct_order_items shape (the same
+columns as warehouse/models/core/fct_order_items.sql, plus `has_product`)
+to Parquet under `<ANALYTICS_SNAPSHOT_DIR>/fct_order_items/<version>/`,
+partitioned by month (`item_month=YYYY-MM`), then publishes it by
+atomically replacing the `CURRENT` pointer and bumping the data
+generation so cached responses are dropped. The ETL exports after every
+load when ANALYTICS_BACKEND=duckdb; run `python -m app.columnar` after a
+dbt run or any other out-of-band change.
+
+With ANALYTICS_BACKEND=duckdb the /analytics/* routes get their breakdown
+rows from `product_breakdown()`, `customer_breakdown()` and
+`revenue_over_time()` here instead of the database, so dashboard reads
+never reach Postgres. Each worker re-reads `CURRENT` at most every
+DATA_GENERATION_POLL_SECONDS and re-points its DuckDB view at the new
+version; the previous version is kept on disk so queries already running
+against it can finish.
+
+duckdb and pyarrow are optional: pip install -e ".[columnar]".
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import case, func, literal_column, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+
+from app import facts
+from app.config import settings
+from app.models import Order, OrderItem, Product, User
+from app.rollups import age_band
+
+logger = logging.getLogger(__name__)
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    duckdb = pa = pc = pacsv = pq = None
+
+SNAPSHOT_NAME = "fct_order_items"
+POINTER_FILE = "CURRENT"
+PARTITION_COLUMN = "item_month"
+# Published versions kept on disk: the live one and the one before it
+KEEP_VERSIONS = 2
+# Rough CSV size of a fct_order_items row, to turn SNAPSHOT_CHUNK_ROWS into a COPY read block size
+CSV_BYTES_PER_ROW = 200
+
+
+def _require_columnar():
+    if duckdb is None:
+        raise RuntimeError('The duckdb analytics backend needs duckdb and pyarrow: pip install -e ".[columnar]"')
+
+
+def snapshot_root() -> Path:
+    return Path(settings.analytics_snapshot_dir) / SNAPSHOT_NAME
+
+
+def current_version() -> Optional[str]:
+    """Version named by the CURRENT pointer, if a snapshot has been published"""
+    try:
+        return (snapshot_root() / POINTER_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# Export ------------------------------------------------------------------------
+
+
+def fct_order_items_select():
+    """The dbt fct_order_items model: the table itself with FCT_ORDER_ITEMS_TABLE, else over the raw tables"""
+    if facts.enabled():
+        return facts.fct_order_items_select()
+    is_returned = (OrderItem.status == "Returned") | OrderItem.returned_at.isnot(None)
+    return select(
+        OrderItem.id.label("order_item_id"),
+        OrderItem.order_id,
+        OrderItem.user_id,
+        OrderItem.product_id,
+        Order.status.label("order_status"),
+        Order.created_at.label("order_created_at"),
+        Order.shipped_at,
+        Order.delivered_at,
+        Order.returned_at.label("order_returned_at"),
+        Product.brand,
+        Product.category,
+        Product.department,
+        Product.retail_price,
+        Product.cost,
+        User.age.label("customer_age"),
+        User.gender.label("customer_gender"),
+        User.country.label("customer_country"),
+        OrderItem.sale_price,
+        OrderItem.discount,
+        OrderItem.status.label("item_status"),
+        OrderItem.created_at.label("item_created_at"),
+        OrderItem.returned_at.label("item_returned_at"),
+        case((is_returned, True), else_=False).label("is_returned"),
+        (OrderItem.sale_price - OrderItem.discount).label("net_revenue"),
+        (OrderItem.discount / func.nullif(OrderItem.sale_price, 0)).label("discount_pct"),
+        Product.id.isnot(None).label("has_product"),
+    ).select_from(
+        OrderItem
+    ).outerjoin(
+        Order, OrderItem.order_id == Order.id
+    ).outerjoin(
+        Product, OrderItem.product_id == Product.id
+    ).outerjoin(
+        User, OrderItem.user_id == User.id
+    ).order_by(
+        # Chunks then cover consecutive months, so each partition gets few files
+        OrderItem.created_at
+    )
+
+
+TIMESTAMP_COLUMNS = [
+    "order_created_at", "shipped_at", "delivered_at", "order_returned_at", "item_created_at", "item_returned_at",
+]
+
+
+def arrow_schema():
+    """Arrow schema of fct_order_items_select(), for snapshots and exports"""
+    # Fixed types, so chunks where a column happens to be all NULL still match
+    types = {
+        "order_item_id": pa.int64(), "order_id": pa.int64(), "user_id": pa.int64(), "product_id": pa.int64(),
+        "order_status": pa.string(), "brand": pa.string(), "category": pa.string(), "department": pa.string(),
+        "retail_price": pa.float64(), "cost": pa.float64(), "customer_age": pa.int32(),
+        "customer_gender": pa.string(), "customer_country": pa.string(), "sale_price": pa.float64(),
+        "discount": pa.float64(), "item_status": pa.string(), "is_returned": pa.bool_(),
+        "net_revenue": pa.float64(), "discount_pct": pa.float64(), "has_product": pa.bool_(),
+        **{column: pa.timestamp("us", tz="UTC") for column in TIMESTAMP_COLUMNS},
+    }
+    return pa.schema([(column.name, types[column.name]) for column in fct_order_items_select().selected_columns])
+
+
+def _copy_chunks(conn, schema, chunk_rows: int):
+    """Postgres: COPY the query out as CSV (spooled to a temp file) and parse it in blocks with Arrow"""
+    conn.exec_driver_sql("SET LOCAL TimeZone = 'UTC'")
+    compiled = fct_order_items_select().compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+    with tempfile.TemporaryFile() as spool:
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY ({compiled}) TO STDOUT WITH (FORMAT csv, HEADER)", spool)
+        spool.seek(0)
+        reader = pacsv.open_csv(
+            spool,
+            read_options=pacsv.ReadOptions(block_size=chunk_rows * CSV_BYTES_PER_ROW),
+            convert_options=pacsv.ConvertOptions(
+                column_types=schema, true_values=["t"], false_values=["f"], strings_can_be_null=True
+            ),
+        )
+        for batch in reader:
+            yield pa.Table.from_batches([batch])
+
+
+def _pandas_chunks(conn, schema, chunk_rows: int):
+    """Any other database: stream the query through pandas"""
+    streaming = conn.execution_options(stream_results=True)
+    for df in pd.read_sql(fct_order_items_select(), streaming, chunksize=chunk_rows):
+        for column in TIMESTAMP_COLUMNS:
+            df[column] = pd.to_datetime(df[column], utc=True, format="mixed")
+        yield pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def _with_month(table: "pa.Table") -> "pa.Table":
+    month = pc.fill_null(pc.strftime(table["item_created_at"], format="%Y-%m"), "unknown")
+    return table.append_column(PARTITION_COLUMN, month)
+
+
+def _session_timezone(conn) -> str:
+    """Zone the database uses for date(timestamptz), so DuckDB buckets days the same way"""
+    if conn.dialect.name == "postgresql":
+        return conn.execute(text("SHOW TimeZone")).scalar()
+    return "UTC"
+
+
+def export_snapshot(bind: Engine, chunk_rows: int = None) -> Path:
+    """Write fct_order_items to a new Parquet version and publish it"""
+    from app.cache import bump_generation
+
+    _require_columnar()
+    chunk_rows = chunk_rows or settings.snapshot_chunk_rows
+    root = snapshot_root()
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    version_dir = root / version
+    version_dir.mkdir(parents=True)
+    schema = arrow_schema()
+    started = time.perf_counter()
+
+    rows = 0
+    with bind.begin() as conn:
+        tz = _session_timezone(conn)
+        chunks = _copy_chunks if conn.dialect.name == "postgresql" else _pandas_chunks
+        for n, table in enumerate(chunks(conn, schema, chunk_rows)):
+            pq.write_to_dataset(
+                _with_month(table), version_dir, partition_cols=[PARTITION_COLUMN],
+                basename_template=f"part-{n:05d}-{{i}}.parquet",
+            )
+            rows += table.num_rows
+    if rows == 0:
+        # Keep the dataset readable (with its schema) when there's nothing to export
+        empty_dir = version_dir / f"{PARTITION_COLUMN}=unknown"
+        empty_dir.mkdir()
+        pq.write_table(schema.empty_table(), empty_dir / "part-00000-0.parquet")
+
+    with open(version_dir / "meta.json", "w") as f:
+        json.dump({"version": version, "rows": rows, "timezone": tz}, f, indent=2)
+    tmp_path = root / f"{POINTER_FILE}.tmp"
+    tmp_path.write_text(version)
+    os.replace(tmp_path, root / POINTER_FILE)
+    _prune(root, keep=version)
+
+    # Cached /analytics responses were computed from the previous snapshot
+    with bind.begin() as conn:
+        bump_generation(conn)
+    logger.info("Exported %s order items to %s in %.1fs", f"{rows:,}", version_dir, time.perf_counter() - started)
+    return version_dir
+
+
+def _prune(root: Path, keep: str):
+    versions = sorted(path for path in root.iterdir() if path.is_dir())
+    for path in versions[:-KEEP_VERSIONS]:
+        if path.name != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# Queries -----------------------------------------------------------------------
+
+_AGE_RANGE_SQL = str(age_band(literal_column("customer_age")).compile(
+    dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+))
+
+# Same row shapes as the SQL breakdowns in app.routers.analytics, so the same folds apply
+PRODUCT_BREAKDOWN_SQL = """
+    SELECT has_product, category, department, brand,
+        count(*) AS total_items,
+        count(*) FILTER (WHERE item_status = 'Returned') AS returned_items,
+        count(*) FILTER (WHERE is_returned) AS returned_or_flagged,
+        count(*) FILTER (WHERE item_status = 'Complete') AS complete_items,
+        sum(sale_price) FILTER (WHERE item_status = 'Complete') AS revenue,
+        count(DISTINCT product_id) FILTER (WHERE item_status = 'Complete' AND has_product) AS product_count
+    FROM fct_order_items
+    GROUP BY ALL
+    ORDER BY ALL
+"""
+
+CUSTOMER_BREAKDOWN_SQL = f"""
+    SELECT {_AGE_RANGE_SQL} AS age_range, customer_country AS country,
+        count(DISTINCT user_id) AS customer_count,
+        count(sale_price) AS priced_items,
+        sum(sale_price) AS revenue
+    FROM fct_order_items
+    WHERE item_status = 'Complete'
+    GROUP BY ALL
+    ORDER BY ALL
+"""
+
+# The item_month bound only lets DuckDB skip partitions; it's a day early to allow for the timezone
+REVENUE_OVER_TIME_SQL = """
+    SELECT CAST(item_created_at AS DATE) AS date, sum(sale_price) AS revenue, count(DISTINCT order_id) AS order_count
+    FROM fct_order_items
+    WHERE item_status = 'Complete' AND item_created_at >= ? AND item_month >= ?
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+class ColumnarStore:
+    """DuckDB view over the live snapshot; re-pointed when a new version is published"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._version: Optional[str] = None
+        self._checked_at = float("-inf")
+
+    def _connection(self):
+        now = time.monotonic()
+        if now - self._checked_at >= settings.data_generation_poll_seconds:
+            with self._lock:
+                if now - self._checked_at >= settings.data_generation_poll_seconds:
+                    version = current_version()
+                    if version is not None and version != self._version:
+                        self._open(version)
+                    self._checked_at = now
+        return self._conn
+
+    def _open(self, version: str):
+        _require_columnar()
+        version_dir = snapshot_root() / version
+        with open(version_dir / "meta.json") as f:
+            meta = json.load(f)
+        conn = duckdb.connect()
+        conn.execute(f"SET GLOBAL TimeZone = '{meta['timezone']}'")
+        conn.execute(
+            f"CREATE VIEW fct_order_items AS SELECT * FROM read_parquet('{version_dir}/*/*.parquet', "
+            f"hive_partitioning = true, hive_types = {{'{PARTITION_COLUMN}': VARCHAR}})"
+        )
+        # Connections still serving queries on the old view close when those finish
+        self._conn, self._version = conn, version
+        logger.info("Serving analytics from snapshot %s (%s order items)", version, f"{meta['rows']:,}")
+
+    def query(self, sql: str, params: list = ()) -> Optional[list]:
+        """Rows as named tuples, or None when no snapshot has been published yet"""
+        conn = self._connection()
+        if conn is None:
+            return None
+        # A DuckDB connection runs one query at a time; cursors are independent connections to the same data
+        cursor = conn.cursor()
+        try:
+            result = cursor.execute(sql, params)
+            Row = namedtuple("Row", [column[0] for column in result.description])
+            return [Row(*row) for row in result.fetchall()]
+        finally:
+            cursor.close()
+
+
+store = ColumnarStore()
+
+
+def product_breakdown() -> Optional[list]:
+    return store.query(PRODUCT_BREAKDOWN_SQL)
+
+
+def customer_breakdown() -> Optional[list]:
+    return store.query(CUSTOMER_BREAKDOWN_SQL)
+
+
+def revenue_over_time(start_date: datetime) -> Optional[List[tuple]]:
+    month_floor = (start_date - pd.Timedelta(days=1)).strftime("%Y-%m")
+    return store.query(REVENUE_OVER_TIME_SQL, [start_date, month_floor])
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Export fct_order_items to a Parquet snapshot for the duckdb backend")
+    parser.add_argument("--chunk-rows", type=int, default=None, help="rows read and written per chunk")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    export_snapshot(engine, chunk_rows=args.chunk_rows)
@@ -0,0 +1,275 @@
+"""
+Slice-and-dice queries over order items for GET /analytics/query.
+
+A query names dimensions to group by, measures to compute, value filters
+per dimension and an optional creation date range. The planner compiles
+it into one SELECT:
+
+- With rollups on, additive measures (revenue, item and returned counts,
+  return rate) are summed from `rollup_daily_sales`. That table is already
+  grouped by every dimension, so each filter becomes a WHERE on it.
+- Distinct customers don't add up across rollup rows. When the query only
+  groups and filters by country and age band, they are counted from
+  `rollup_customer_sales` and joined onto the sales groups. Anything
+  else (customer counts by product attribute or date, or USE_ROLLUPS=false)
+  scans order items, joining products and users only when the query needs
+  them. With FCT_ORDER_ITEMS_TABLE set, those queries read the dbt fact
+  table instead, which has the product and customer columns already
+  joined on (see app.facts).
+
+Statements are built once per query shape: the dimensions, measures,
+which filters are set and the ordering. Filter values, dates and the limit
+are bound parameters, so a repeated shape reuses the cached statement and
+SQLAlchemy's compiled SQL for it, and only its parameters are new.
+"""
+import functools
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Float, and_, bindparam, case, cast, func, select, true
+
+from app import facts
+from app.config import settings
+from app.models import CustomerSalesRollup, DailySalesRollup, OrderItem, Product, User
+from app.rollups import age_band
+from app.schemas import CubeQuery
+
+# Dimensions that can also filter (day filters by the start/end range instead)
+FILTER_DIMENSIONS = ("category", "department", "brand", "country", "age_band")
+PRODUCT_DIMENSIONS = {"category", "department", "brand"}
+CUSTOMER_DIMENSIONS = {"country", "age_band"}
+COUNT_MEASURES = {"item_count", "returned_count", "customer_count"}
+
+
+class QueryShape(NamedTuple):
+    """Everything about a query except its parameter values"""
+    dimensions: Tuple[str, ...]
+    measures: Tuple[str, ...]
+    filters: Tuple[str, ...]
+    has_start: bool
+    has_end: bool
+    order_by: str
+    descending: bool
+    source: str
+    dialect: str
+
+
+class Plan(NamedTuple):
+    source: str
+    statement: object
+    params: dict
+
+
+def _ratio(numerator, denominator):
+    return cast(numerator, Float) / func.nullif(denominator, 0)
+
+
+# Rollup statements ------------------------------------------------------------
+
+
+def _rollup_columns(dimension: str):
+    return DailySalesRollup.day if dimension == "day" else getattr(DailySalesRollup, dimension)
+
+
+def _rollup_select(shape: QueryShape):
+    is_customer_query = "customer_count" in shape.measures
+    dimensions = [_rollup_columns(d).label(d) for d in shape.dimensions]
+    filters = [_rollup_columns(d).in_(bindparam(d, expanding=True)) for d in shape.filters]
+    if shape.has_start:
+        filters.append(DailySalesRollup.day >= bindparam("start"))
+    if shape.has_end:
+        filters.append(DailySalesRollup.day <= bindparam("end"))
+
+    returned = func.sum(DailySalesRollup.returned_count)
+    items = func.sum(DailySalesRollup.item_count)
+    measures = {
+        "revenue": func.coalesce(func.sum(DailySalesRollup.revenue), 0.0),
+        "item_count": func.coalesce(items, 0),
+        "returned_count": func.coalesce(returned, 0),
+        "return_rate": _ratio(returned, items),
+    }
+    sales_columns = [*dimensions, *(measures[m].label(m) for m in shape.measures if m != "customer_count")]
+    sales = select(*sales_columns).where(*filters).group_by(*dimensions)
+    if not is_customer_query:
+        return sales
+
+    # Each customer has one (country, age band), so customer counts per group come from the customer rollup
+    customer_filters = [getattr(CustomerSalesRollup, d).in_(bindparam(d, expanding=True)) for d in shape.filters]
+    customer_dimensions = [getattr(CustomerSalesRollup, d).label(d) for d in shape.dimensions]
+    customers = select(
+        *customer_dimensions,
+        func.count(CustomerSalesRollup.user_id).label("customer_count")
+    ).where(
+        CustomerSalesRollup.complete_count > 0, *customer_filters
+    ).group_by(*customer_dimensions)
+    if not sales_columns:
+        # customer_count alone, ungrouped: there are no sales columns to join it onto
+        return customers
+    sales, customers = sales.subquery(), customers.subquery()
+    return select(
+        *(sales.c[d] for d in shape.dimensions),
+        *(
+            func.coalesce(customers.c.customer_count, 0).label(m) if m == "customer_count" else sales.c[m]
+            for m in shape.measures
+        )
+    ).select_from(sales).outerjoin(
+        customers,
+        and_(true(), *(sales.c[d].is_not_distinct_from(customers.c[d]) for d in shape.dimensions))
+    )
+
+
+# Raw statements ---------------------------------------------------------------
+
+
+def _raw_columns(dimension: str):
+    if dimension == "day":
+        return func.date(OrderItem.created_at)
+    if dimension == "age_band":
+        return age_band(User.age)
+    if dimension == "country":
+        return User.country
+    return getattr(Product, dimension)
+
+
+def _raw_select(shape: QueryShape):
+    is_complete = OrderItem.status == "Complete"
+    is_returned = OrderItem.status == "Returned"
+    dimensions = [_raw_columns(d).label(d) for d in shape.dimensions]
+    filters = [_raw_columns(d).in_(bindparam(d, expanding=True)) for d in shape.filters]
+    # Compare created_at against midnights so its index can be used
+    if shape.has_start:
+        filters.append(OrderItem.created_at >= bindparam("start"))
+    if shape.has_end:
+        filters.append(OrderItem.created_at < bindparam("end"))
+
+    returned = func.sum(case((is_returned, 1), else_=0))
+    items = func.count(OrderItem.id)
+    measures = {
+        "revenue": func.coalesce(func.sum(case((is_complete, OrderItem.sale_price))), 0.0),
+        "item_count": items,
+        "returned_count": func.coalesce(returned, 0),
+        "return_rate": _ratio(returned, items),
+        "customer_count": func.count(func.distinct(case((is_complete, User.id)))),
+    }
+    statement = select(
+        *dimensions, *(measures[m].label(m) for m in shape.measures)
+    ).select_from(OrderItem).where(*filters).group_by(*dimensions)
+
+    used = set(shape.dimensions) | set(shape.filters)
+    if used & PRODUCT_DIMENSIONS:
+        statement = statement.outerjoin(Product, OrderItem.product_id == Product.id)
+    if used & CUSTOMER_DIMENSIONS or "customer_count" in shape.measures:
+        statement = statement.outerjoin(User, OrderItem.user_id == User.id)
+    return statement
+
+
+# Fact table statements --------------------------------------------------------
+
+
+def _fact_columns(dimension: str):
+    if dimension == "day":
+        return func.date(facts.fct.item_created_at)
+    if dimension == "age_band":
+        return age_band(facts.fct.customer_age)
+    if dimension == "country":
+        return facts.fct.customer_country
+    return facts.fct[dimension]
+
+
+def _fact_select(shape: QueryShape):
+    """The raw statement over fct_order_items: same filters and measures, no joins"""
+    fct = facts.fct
+    is_complete = fct.item_status == "Complete"
+    dimensions = [_fact_columns(d).label(d) for d in shape.dimensions]
+    filters = [_fact_columns(d).in_(bindparam(d, expanding=True)) for d in shape.filters]
+    if shape.has_start:
+        filters.append(fct.item_created_at >= bindparam("start"))
+    if shape.has_end:
+        filters.append(fct.item_created_at < bindparam("end"))
+
+    returned = func.sum(case((fct.item_status == "Returned", 1), else_=0))
+    items = func.count(fct.order_item_id)
+    measures = {
+        "revenue": func.coalesce(func.sum(case((is_complete, fct.sale_price))), 0.0),
+        "item_count": items,
+        "returned_count": func.coalesce(returned, 0),
+        "return_rate": _ratio(returned, items),
+        "customer_count": func.count(func.distinct(case((is_complete, fct.user_id)))),
+    }
+    return select(
+        *dimensions, *(measures[m].label(m) for m in shape.measures)
+    ).select_from(facts.fct_order_items).where(*filters).group_by(*dimensions)
+
+
+# Planning ---------------------------------------------------------------------
+
+
+def choose_source(query: CubeQuery) -> str:
+    """Answer from the rollup tables when they give exact results, else from the fact table or raw order items"""
+    unrolled = "fact" if facts.enabled() else "raw"
+    if not settings.use_rollups:
+        return unrolled
+    if "customer_count" in query.measures:
+        used = set(query.dimensions) | {d for d in FILTER_DIMENSIONS if getattr(query, d)}
+        if not used <= CUSTOMER_DIMENSIONS or query.start is not None or query.end is not None:
+            return unrolled
+    return "rollup"
+
+
+@functools.lru_cache(maxsize=settings.cube_statement_cache_size)
+def compile_query(shape: QueryShape):
+    """Build the SELECT for a query shape, with filter values, dates and the limit as bound parameters"""
+    builders = {"rollup": _rollup_select, "fact": _fact_select, "raw": _raw_select}
+    statement = builders[shape.source](shape)
+    order = statement.selected_columns[shape.order_by]
+    # Dimensions break ties so results come back in a stable order
+    ties = [statement.selected_columns[d] for d in shape.dimensions if d != shape.order_by]
+    return statement.order_by(
+        order.desc().nulls_last() if shape.descending else order.asc().nulls_last(), *ties
+    ).limit(bindparam("limit"))
+
+
+def plan(query: CubeQuery, dialect: str) -> Plan:
+    """The statement and parameters answering a query"""
+    source = choose_source(query)
+    filters = tuple(d for d in FILTER_DIMENSIONS if getattr(query, d))
+    shape = QueryShape(
+        dimensions=tuple(query.dimensions),
+        measures=tuple(query.measures),
+        filters=filters,
+        has_start=query.start is not None,
+        has_end=query.end is not None,
+        order_by=query.order_by or query.measures[0],
+        descending=query.descending,
+        source=source,
+        dialect=dialect,
+    )
+    params = {d: list(getattr(query, d)) for d in filters}
+    params["limit"] = query.limit
+    if source == "rollup":
+        params.update(start=query.start, end=query.end)
+    else:
+        if query.start is not None:
+            params["start"] = datetime.combine(query.start, time.min)
+        if query.end is not None:
+            params["end"] = datetime.combine(query.end + timedelta(days=1), time.min)
+    return Plan(source, compile_query(shape), {k: v for k, v in params.items() if v is not None})
+
+
+def _value(name: str, value):
+    if value is None:
+        return None
+    if name == "day":
+        # SQLite returns DATE expressions as 'YYYY-MM-DD' strings
+        return value.isoformat() if isinstance(value, date) else str(value)
+    if name in COUNT_MEASURES:
+        return int(value)
+    if name in ("revenue", "return_rate"):
+        return float(value)
+    return value
+
+
+def to_records(query: CubeQuery, rows) -> List[Dict[str, object]]:
+    """Result rows as {dimension/measure: value} dicts"""
+    names = list(query.dimensions) + list(query.measures)
+    return [{name: _value(name, value) for name, value in zip(names, row)} for row in rows]
@@ -1,11 +1,65 @@
+import asyncio
+import itertools
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.metrics import timed_checkout
 
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+# Async drivers for the sync URLs DATABASE_URL may use
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def to_async_url(url: str) -> str:
+    """Swap a sync database URL's driver for its asyncio counterpart"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()}")
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+def engine_options(url: str, statement_timeout_ms: int = 0) -> dict:
+    """create_engine keyword arguments for the configured pool and timeouts"""
+    parsed = make_url(url)
+    options = {"pool_pre_ping": True, "pool_recycle": settings.db_pool_recycle_seconds}
+    if parsed.get_backend_name() == "sqlite":
+        # In-memory SQLite uses a single-connection pool with no size to configure
+        if parsed.database in (None, "", ":memory:"):
+            return options
+        return {**options, "pool_size": settings.db_pool_size, "max_overflow": settings.db_max_overflow}
+
+    options.update(pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow)
+    if parsed.get_backend_name() != "postgresql":
+        return options
+    if parsed.get_driver_name() == "asyncpg":
+        connect_args = {"timeout": settings.db_connect_timeout_seconds}
+        if statement_timeout_ms > 0:
+            connect_args["server_settings"] = {"statement_timeout": str(statement_timeout_ms)}
+    else:
+        connect_args = {"connect_timeout": settings.db_connect_timeout_seconds}
+        if statement_timeout_ms > 0:
+            connect_args["options"] = f"-c statement_timeout={statement_timeout_ms}"
+    return {**options, "connect_args": connect_args}
+
+
+# Primary: writes, schema setup and the cache's generation reads
+engine = create_engine(settings.database_url, **engine_options(settings.database_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_async_url = settings.async_database_url or to_async_url(settings.database_url)
+async_engine = create_async_engine(_async_url, **engine_options(_async_url, settings.db_statement_timeout_ms))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Read engines for the analytics routes: one per replica, or the primary's async engine
+read_engines = [
+    create_async_engine(to_async_url(url), **engine_options(to_async_url(url), settings.db_statement_timeout_ms))
+    for url in settings.read_database_urls
+] or [async_engine]
+_read_sessions = itertools.cycle([async_sessionmaker(read_engine, expire_on_commit=False) for read_engine in read_engines])
+
 Base = declarative_base()
 
 
@@ -17,3 +71,33 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Dependency for getting an async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    """Dependency for a read-only async session on the next replica (the primary without replicas)"""
+    async with next(_read_sessions)() as db:
+        yield db
+
+
+async def fetch_all(db: AsyncSession, statement, params: dict = None):
+    """Run one SELECT on the session and return its rows"""
+    with timed_checkout():
+        return (await db.execute(statement, params)).all()
+
+
+async def fetch_concurrently(db: AsyncSession, *statements):
+    """Run independent SELECTs at once, each on its own pooled connection
+
+    A session (like a connection) runs one statement at a time, so the
+    statements go straight to the session's engine instead.
+    """
+    async def run(statement):
+        with timed_checkout():
+            async with db.bind.connect() as conn:
+                return (await conn.execute(statement)).all()
+    return await asyncio.gather(*(run(statement) for statement in statements))
@@ -0,0 +1,224 @@
+"""
+Bulk loading helpers for the ETL.
+
+On Postgres, DataFrames are streamed into their table with COPY FROM STDIN
+through an in-memory CSV buffer, one chunk at a time, with the table's
+secondary indexes and foreign keys dropped for the duration of the load and
+rebuilt once at the end. Other databases (e.g. SQLite) fall back to
+`DataFrame.to_sql` multi-row INSERTs.
+
+Writes to a table partitioned by month (see app.partitions) go through its
+parent, which routes each row to its month's partition. The partitions for
+every month in the frame are created first, so no row lands in the default one.
+"""
+import io
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+from sqlalchemy import DateTime, Integer, inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app import partitions
+from app.config import settings
+from app.models import Base
+
+COPY_CHUNK_ROWS = 100_000
+INSERT_CHUNK_ROWS = 1000
+
+
+def resolve_load_mode(engine: Engine, mode: str = None) -> str:
+    """Pick "copy" or "insert" for this engine ("auto" means COPY on Postgres only)"""
+    mode = (mode or settings.etl_load_mode).lower()
+    if mode == "auto":
+        return "copy" if engine.dialect.name == "postgresql" else "insert"
+    if mode == "copy" and engine.dialect.name != "postgresql":
+        print(f"COPY is only supported on Postgres; using INSERT for {engine.dialect.name}")
+        return "insert"
+    return mode
+
+
+def _prepare_frame(df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+    """Cast integer columns to nullable Int64 so NaN-bearing ids are written as 1, not 1.0"""
+    table = Base.metadata.tables[table_name]
+    df = df.copy()
+    for column in table.columns:
+        if column.name in df.columns and isinstance(column.type, Integer):
+            df[column.name] = pd.to_numeric(df[column.name], errors="coerce").astype("Int64")
+    return df
+
+
+def _quote(conn: Connection, name: str) -> str:
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def _drop_constraints(conn: Connection, table_name: str):
+    """Drop a table's secondary indexes and foreign keys, returning what was dropped"""
+    table = Base.metadata.tables[table_name]
+    indexes = list(table.indexes)
+    foreign_keys = [fk for fk in inspect(conn).get_foreign_keys(table_name) if fk.get("name")]
+    quoted_table = _quote(conn, table_name)
+
+    for fk in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {quoted_table} DROP CONSTRAINT {_quote(conn, fk['name'])}"))
+    for index in indexes:
+        index.drop(bind=conn, checkfirst=True)
+    return indexes, foreign_keys
+
+
+def _restore_constraints(conn: Connection, table_name: str, dropped):
+    """Rebuild dropped indexes and foreign keys in one pass each, then refresh stats"""
+    indexes, foreign_keys = dropped
+    quoted_table = _quote(conn, table_name)
+    for index in indexes:
+        index.create(bind=conn, checkfirst=True)
+    for fk in foreign_keys:
+        columns = ", ".join(_quote(conn, c) for c in fk["constrained_columns"])
+        referred = ", ".join(_quote(conn, c) for c in fk["referred_columns"])
+        conn.execute(text(
+            f"ALTER TABLE {quoted_table} ADD CONSTRAINT {_quote(conn, fk['name'])} "
+            f"FOREIGN KEY ({columns}) REFERENCES {_quote(conn, fk['referred_table'])} ({referred})"
+        ))
+    conn.execute(text(f"ANALYZE {quoted_table}"))
+
+
+@contextmanager
+def deferred_constraints(conn: Connection, table_name: str):
+    """Drop secondary indexes and foreign keys on a table, rebuild them after the block"""
+    dropped = _drop_constraints(conn, table_name)
+    yield
+    # One bulk index build / FK validation pass instead of per-row maintenance
+    _restore_constraints(conn, table_name, dropped)
+
+
+def copy_dataframe(conn: Connection, df: pd.DataFrame, table_name: str, chunk_rows: int = COPY_CHUNK_ROWS):
+    """Stream a DataFrame into a Postgres table with COPY FROM STDIN, chunk by chunk"""
+    columns = ", ".join(_quote(conn, c) for c in df.columns)
+    sql = f"COPY {_quote(conn, table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    cursor = conn.connection.cursor()
+    try:
+        for start in range(0, len(df), chunk_rows):
+            buffer = io.StringIO()
+            df.iloc[start:start + chunk_rows].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+
+
+def _ensure_partitions(engine: Engine, df: pd.DataFrame, table_name: str):
+    if "created_at" in df.columns:
+        partitions.ensure_partitions(engine, table_name, df["created_at"])
+
+
+def _copy_part(engine: Engine, df: pd.DataFrame, table_name: str) -> int:
+    with engine.begin() as conn:
+        copy_dataframe(conn, df, table_name)
+    return len(df)
+
+
+def write_dataframe(
+    engine: Engine,
+    df: pd.DataFrame,
+    table_name: str,
+    mode: str = None,
+    parallel_chunks: int = 1
+) -> int:
+    """Append a DataFrame to a table using the fastest path the database supports
+
+    With COPY and `parallel_chunks` > 1 the frame is split into that many
+    slices, each copied on its own connection concurrently.
+    """
+    df = _prepare_frame(df, table_name)
+    _ensure_partitions(engine, df, table_name)
+    if resolve_load_mode(engine, mode) != "copy":
+        df.to_sql(table_name, engine, if_exists="append", index=False, method="multi", chunksize=INSERT_CHUNK_ROWS)
+    elif parallel_chunks <= 1 or len(df) < 2 * parallel_chunks:
+        with engine.begin() as conn:
+            with deferred_constraints(conn, table_name):
+                copy_dataframe(conn, df, table_name)
+    else:
+        with engine.begin() as conn:
+            dropped = _drop_constraints(conn, table_name)
+        try:
+            size = -(-len(df) // parallel_chunks)
+            parts = [df.iloc[start:start + size] for start in range(0, len(df), size)]
+            with ThreadPoolExecutor(max_workers=len(parts), thread_name_prefix=f"copy-{table_name}") as pool:
+                list(pool.map(lambda part: _copy_part(engine, part, table_name), parts))
+        finally:
+            with engine.begin() as conn:
+                _restore_constraints(conn, table_name, dropped)
+    return len(df)
+
+
+def upsert_dataframe(engine: Engine, df: pd.DataFrame, table_name: str, mode: str = None) -> int:
+    """Insert new rows and update existing ones (by primary key) so re-runs are idempotent
+
+    On Postgres the rows are COPYed into a temporary staging table and merged
+    with a single INSERT ... SELECT ... ON CONFLICT DO UPDATE. Elsewhere they
+    go through batched dialect-level INSERT ... ON CONFLICT statements.
+
+    A partitioned table's primary key is (id, created_at), but rows are still
+    identified by id alone. A row whose created_at changed would miss the
+    conflict and be inserted a second time, so its old version is deleted
+    first, in the same transaction.
+    """
+    table = Base.metadata.tables[table_name]
+    key = [column.name for column in table.primary_key.columns]
+    # Partition key columns that ride along in the primary key without identifying the row
+    moving = [c for c in key if c != "id"] if "id" in key else []
+    df = _prepare_frame(df, table_name).drop_duplicates(subset=["id"] if moving else key, keep="last")
+    if df.empty:
+        return 0
+    _ensure_partitions(engine, df, table_name)
+    columns = list(df.columns)
+    updates = [c for c in columns if c not in key]
+
+    if resolve_load_mode(engine, mode) == "copy":
+        with engine.begin() as conn:
+            stage = _quote(conn, f"stage_{table_name}")
+            quoted_columns = ", ".join(_quote(conn, c) for c in columns)
+            assignments = ", ".join(f"{_quote(conn, c)} = EXCLUDED.{_quote(conn, c)}" for c in updates)
+            conn.execute(text(
+                f"CREATE TEMP TABLE {stage} (LIKE {_quote(conn, table_name)} INCLUDING DEFAULTS) ON COMMIT DROP"
+            ))
+            copy_dataframe(conn, df, f"stage_{table_name}")
+            if moving:
+                moved = " OR ".join(f"t.{_quote(conn, c)} IS DISTINCT FROM s.{_quote(conn, c)}" for c in moving)
+                conn.execute(text(
+                    f"DELETE FROM {_quote(conn, table_name)} t USING {stage} s WHERE t.id = s.id AND ({moved})"
+                ))
+            conflict = "DO NOTHING" if not updates else f"DO UPDATE SET {assignments}"
+            conn.execute(text(
+                f"INSERT INTO {_quote(conn, table_name)} ({quoted_columns}) "
+                f"SELECT {quoted_columns} FROM {stage} "
+                f"ON CONFLICT ({', '.join(_quote(conn, c) for c in key)}) {conflict}"
+            ))
+        return len(df)
+
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise ValueError(f"Upserts are not supported for {engine.dialect.name}")
+
+    stmt = dialect_insert(table)
+    if updates:
+        stmt = stmt.on_conflict_do_update(index_elements=key, set_={c: stmt.excluded[c] for c in updates})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=key)
+    # Typed DateTime binds reject the raw strings some CSV columns are left as
+    for column in table.columns:
+        if column.name in df.columns and isinstance(column.type, DateTime) \
+                and not pd.api.types.is_datetime64_any_dtype(df[column.name]):
+            df[column.name] = pd.to_datetime(df[column.name], errors="coerce")
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    with engine.begin() as conn:
+        for start in range(0, len(records), INSERT_CHUNK_ROWS):
+            chunk = records[start:start + INSERT_CHUNK_ROWS]
+            if moving:
+                # Delete and re-insert by id, so a row moving to another partition isn't duplicated
+                conn.execute(table.delete().where(table.c.id.in_([record["id"] for record in chunk])))
+            conn.execute(stmt, chunk)
+    return len(df)
@@ -1,117 +1,215 @@
 """
 ETL script to load TheLook eCommerce CSV files into Postgres.
 
+Tables are loaded in parallel in foreign-key order (see app.etl.scheduler).
+With --incremental, only rows past each table's watermark are loaded and
+they are upserted, so re-runs are idempotent (see app.etl.watermarks).
+
 Usage:
-    python -m app.etl.load_thelook_csvs
+    python -m app.etl.load_thelook_csvs [--incremental] [--mode auto|copy|insert] [--workers N]
 """
+import argparse
+import logging
 import sys
 import os
+import time
 from pathlib import Path
 import pandas as pd
 from sqlalchemy import create_engine
 from app.config import settings
-from app.models import Base, User, Product, Order, OrderItem
+from app.database import engine_options
+from app.models import create_schema
+from app.cache import bump_generation
+from app.columnar import export_snapshot
+from app.etl.copy_loader import resolve_load_mode, upsert_dataframe, write_dataframe
+from app.etl.scheduler import print_load_report, run_load_plan
+from app.etl.watermarks import advance_watermark, get_watermark, record_changed_products, rows_after
+from app.rollups import rebuild_rollups, refresh_rollups
 
 # Add parent directory to path to allow imports
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 
-def load_csvs():
-    """Load CSV files from data/raw/ into Postgres"""
-    
-    # Try multiple paths: Docker volume mount, then repo root relative
-    data_dir = None
+# CSV file, model columns to keep, and date columns to parse, per table
+TABLE_SOURCES = {
+    "users": {
+        "file": "users.csv",
+        "columns": ['id', 'first_name', 'last_name', 'gender', 'age', 'country', 'city', 'state', 'email', 'created_at', 'updated_at'],
+        "date_columns": [],
+    },
+    "products": {
+        "file": "products.csv",
+        "columns": ['id', 'brand', 'department', 'category', 'name', 'retail_price', 'cost', 'created_at'],
+        "date_columns": [],
+    },
+    "orders": {
+        "file": "orders.csv",
+        "columns": ['id', 'user_id', 'status', 'created_at', 'shipped_at', 'delivered_at', 'returned_at'],
+        "date_columns": ["created_at", "shipped_at", "delivered_at", "returned_at"],
+    },
+    "order_items": {
+        "file": "order_items.csv",
+        "columns": ['id', 'order_id', 'user_id', 'product_id', 'sale_price', 'discount', 'status', 'created_at', 'returned_at'],
+        "date_columns": ["created_at", "returned_at"],
+    },
+}
+
+
+def find_data_dir() -> Path:
+    """Locate data/raw: Docker volume mount first, then relative to the repo root"""
     # Check if /data exists (Docker volume mount)
     if Path("/data/raw").exists():
-        data_dir = Path("/data/raw")
-    else:
-        # Get path to data/raw/ (relative to repo root)
-        repo_root = Path(__file__).parent.parent.parent.parent
-        data_dir = repo_root / "data" / "raw"
-    
+        return Path("/data/raw")
+    # Get path to data/raw/ (relative to repo root)
+    repo_root = Path(__file__).parent.parent.parent.parent
+    return repo_root / "data" / "raw"
+
+
+def read_source_csv(path: Path, table_name: str) -> pd.DataFrame:
+    """Read a TheLook CSV with every column it has, named like our model's"""
+    df = pd.read_csv(path)
+    # Map column names to model fields (handle case variations)
+    df.columns = df.columns.str.lower()
+    # Map order_id to id if needed
+    if table_name == "orders" and 'order_id' in df.columns and 'id' not in df.columns:
+        df['id'] = df['order_id']
+    return df
+
+
+def model_frame(df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+    """Shape a source frame to the columns of our model"""
+    source = TABLE_SOURCES[table_name]
+    # Select only columns that exist in our model
+    df = df[[col for col in source["columns"] if col in df.columns]].copy()
+    # Convert date columns if they exist
+    for col in source["date_columns"]:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def read_table_csv(path: Path, table_name: str) -> pd.DataFrame:
+    """Read a TheLook CSV and shape it to the columns of our model"""
+    return model_frame(read_source_csv(path, table_name), table_name)
+
+
+def load_csvs(mode: str = None, workers: int = None, incremental: bool = False):
+    """Load CSV files from data/raw/ into Postgres"""
+    data_dir = find_data_dir()
     if not data_dir.exists():
         print(f"Error: {data_dir} does not exist. Please create it and add CSV files.")
         return
-    
-    # Create database engine
-    engine = create_engine(settings.database_url)
-    
-    # Create tables if they don't exist
-    Base.metadata.create_all(bind=engine)
-    
-    print("Loading CSV files into Postgres...")
-    
-    # Load users.csv
-    users_file = data_dir / "users.csv"
-    if users_file.exists():
-        print(f"Loading {users_file}...")
-        df_users = pd.read_csv(users_file)
-        # Map column names to model fields (handle case variations)
-        df_users.columns = df_users.columns.str.lower()
-        # Select only columns that exist in our model
-        user_columns = ['id', 'first_name', 'last_name', 'gender', 'age', 'country', 'city', 'state', 'email', 'created_at', 'updated_at']
-        df_users_filtered = df_users[[col for col in user_columns if col in df_users.columns]].copy()
-        df_users_filtered.to_sql("users", engine, if_exists="append", index=False, method="multi", chunksize=1000)
-        print(f"Loaded {len(df_users_filtered)} users")
-    else:
-        print(f"Warning: {users_file} not found")
-    
-    # Load products.csv
-    products_file = data_dir / "products.csv"
-    if products_file.exists():
-        print(f"Loading {products_file}...")
-        df_products = pd.read_csv(products_file)
-        df_products.columns = df_products.columns.str.lower()
-        # Select only columns that exist in our model
-        product_columns = ['id', 'brand', 'department', 'category', 'name', 'retail_price', 'cost', 'created_at']
-        df_products_filtered = df_products[[col for col in product_columns if col in df_products.columns]].copy()
-        df_products_filtered.to_sql("products", engine, if_exists="append", index=False, method="multi", chunksize=1000)
-        print(f"Loaded {len(df_products_filtered)} products")
-    else:
-        print(f"Warning: {products_file} not found")
-    
-    # Load orders.csv
-    orders_file = data_dir / "orders.csv"
-    if orders_file.exists():
-        print(f"Loading {orders_file}...")
-        df_orders = pd.read_csv(orders_file)
-        df_orders.columns = df_orders.columns.str.lower()
-        # Map order_id to id if needed
-        if 'order_id' in df_orders.columns and 'id' not in df_orders.columns:
-            df_orders['id'] = df_orders['order_id']
-        # Select only columns that exist in our model
-        order_columns = ['id', 'user_id', 'status', 'created_at', 'shipped_at', 'delivered_at', 'returned_at']
-        df_orders_filtered = df_orders[[col for col in order_columns if col in df_orders.columns]].copy()
-        # Convert date columns if they exist
-        for col in ["created_at", "shipped_at", "delivered_at", "returned_at"]:
-            if col in df_orders_filtered.columns:
-                df_orders_filtered[col] = pd.to_datetime(df_orders_filtered[col], errors="coerce")
-        df_orders_filtered.to_sql("orders", engine, if_exists="append", index=False, method="multi", chunksize=1000)
-        print(f"Loaded {len(df_orders_filtered)} orders")
-    else:
-        print(f"Warning: {orders_file} not found")
-    
-    # Load order_items.csv
-    order_items_file = data_dir / "order_items.csv"
-    if order_items_file.exists():
-        print(f"Loading {order_items_file}...")
-        df_order_items = pd.read_csv(order_items_file)
-        df_order_items.columns = df_order_items.columns.str.lower()
-        # Select only columns that exist in our model
-        order_item_columns = ['id', 'order_id', 'user_id', 'product_id', 'sale_price', 'discount', 'status', 'created_at', 'returned_at']
-        df_order_items_filtered = df_order_items[[col for col in order_item_columns if col in df_order_items.columns]].copy()
-        # Convert date columns if they exist
-        for col in ["created_at", "returned_at"]:
-            if col in df_order_items_filtered.columns:
-                df_order_items_filtered[col] = pd.to_datetime(df_order_items_filtered[col], errors="coerce")
-        df_order_items_filtered.to_sql("order_items", engine, if_exists="append", index=False, method="multi", chunksize=1000)
-        print(f"Loaded {len(df_order_items_filtered)} order items")
-    else:
-        print(f"Warning: {order_items_file} not found")
-    
+
+    workers = workers or settings.etl_workers
+
+    # Create database engine on the primary, with enough connections for parallel table and chunk loads
+    options = {**engine_options(settings.database_url), "pool_size": workers, "max_overflow": workers * 2}
+    engine = create_engine(settings.database_url, **options)
+
+    # Create tables and indexes if they don't exist
+    create_schema(engine)
+
+    mode = resolve_load_mode(engine, mode)
+    if mode == "insert" and engine.dialect.name == "sqlite":
+        # SQLite serializes writers; parallel loads would only contend for the lock
+        workers = 1
+    print(f"Loading CSV files into Postgres (mode: {mode}, workers: {workers}, incremental: {incremental})...")
+
+    loaded_order_items = {}
+    # Existing products/users whose attributes changed invalidate rollup buckets
+    # that can't be located from the delta alone
+    changed_dimensions = []
+    # Products of order items updated in place (same id), for app.ml.feature_index
+    changed_products = []
+
+    def make_task(table_name: str, path: Path):
+        def task() -> int:
+            print(f"Loading {path}...")
+            source_df = read_source_csv(path, table_name)
+            watermark = get_watermark(engine, table_name)
+            if incremental:
+                # Before column selection: order items change status with only shipped_at /
+                # delivered_at moving, and the model doesn't keep those columns
+                source_df = rows_after(source_df, watermark)
+            df = model_frame(source_df, table_name)
+            if incremental:
+                rows = upsert_dataframe(engine, df, table_name, mode)
+                if table_name in ("products", "users") and watermark and watermark.max_id is not None:
+                    if (pd.to_numeric(df["id"], errors="coerce") <= watermark.max_id).any():
+                        changed_dimensions.append(table_name)
+                if table_name == "order_items" and watermark and watermark.max_id is not None:
+                    updated = pd.to_numeric(df["id"], errors="coerce") <= watermark.max_id
+                    changed_products.extend(df.loc[updated, "product_id"].dropna().astype(int))
+            else:
+                # Split large tables into concurrent chunk loads
+                chunks = min(workers, max(1, -(-len(df) // settings.etl_parallel_chunk_rows)))
+                rows = write_dataframe(engine, df, table_name, mode, parallel_chunks=chunks)
+            advance_watermark(engine, table_name, source_df, watermark)
+            print(f"Loaded {rows} {table_name.replace('_', ' ')}")
+            if table_name == "order_items":
+                loaded_order_items["df"] = df
+            return rows
+        return task
+
+    tasks = {}
+    for table_name, source in TABLE_SOURCES.items():
+        path = data_dir / source["file"]
+        if path.exists():
+            tasks[table_name] = make_task(table_name, path)
+        else:
+            print(f"Warning: {path} not found")
+
+    started = time.perf_counter()
+    results = run_load_plan(tasks, max_workers=workers)
+    print_load_report(results, time.perf_counter() - started)
+
+    if changed_dimensions:
+        print(f"Rebuilding analytics rollups (changed {', '.join(sorted(changed_dimensions))})...")
+        rebuild_rollups(engine)
+    elif "df" in loaded_order_items and not loaded_order_items["df"].empty:
+        # Fold the new rows into the analytics rollups
+        df = loaded_order_items["df"]
+        print("Refreshing analytics rollups...")
+        refresh_rollups(
+            engine,
+            days=df["created_at"].dropna().dt.date.unique() if "created_at" in df.columns else (),
+            product_ids=df["product_id"].dropna().unique() if "product_id" in df.columns else (),
+            user_ids=df["user_id"].dropna().unique() if "user_id" in df.columns else ()
+        )
+
+    # Invalidate cached analytics responses in every API worker
+    with engine.begin() as conn:
+        bump_generation(conn)
+        if incremental:
+            record_changed_products(conn, changed_products)
+
+    if settings.analytics_backend == "duckdb":
+        print("Exporting the analytics snapshot...")
+        export_snapshot(engine)
+
     print("ETL complete!")
 
 
 if __name__ == "__main__":
-    load_csvs()
-
+    parser = argparse.ArgumentParser(description="Load TheLook CSVs into the database")
+    parser.add_argument(
+        "--mode",
+        choices=["auto", "copy", "insert"],
+        default=None,
+        help="write path (default: ETL_LOAD_MODE, i.e. COPY on Postgres and INSERT elsewhere)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="parallel table/chunk loads (default: ETL_WORKERS)"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="load only rows past each table's watermark and upsert them"
+    )
+    args = parser.parse_args()
+    # The snapshot export reports through logging
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    load_csvs(mode=args.mode, workers=args.workers, incremental=args.incremental)
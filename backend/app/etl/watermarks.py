@@ -0,0 +1,114 @@
+"""
+High-water marks for incremental ETL runs.
+
+Each table keeps the largest `id` and the latest change timestamp
+(created/updated/shipped/delivered/returned) loaded so far in the
+`etl_watermarks` table. An incremental run only loads rows beyond either
+mark: new ids, or existing ids whose timestamps moved past the last run.
+
+Order items updated in place keep their id, and the timestamp that moved
+(shipped/delivered) isn't stored. So their products are logged in
+`changed_products` under the data generation the run publishes, for
+readers that refresh incrementally (app.ml.feature_index).
+"""
+from typing import Iterable, List, NamedTuple, Optional
+
+import pandas as pd
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from app.models import ChangedProduct, DataGeneration, EtlWatermark
+
+# Columns whose values move forward when a row is created or changed
+CHANGE_COLUMNS = ["created_at", "updated_at", "shipped_at", "delivered_at", "returned_at"]
+
+# Generations of changed products kept; readers further behind than this start over
+CHANGE_LOG_GENERATIONS = 100
+
+
+class Watermark(NamedTuple):
+    max_id: Optional[int]
+    max_changed_at: Optional[pd.Timestamp]
+
+
+def get_watermark(engine: Engine, table_name: str) -> Optional[Watermark]:
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(EtlWatermark.max_id, EtlWatermark.max_changed_at).where(EtlWatermark.table_name == table_name)
+        ).first()
+    if row is None:
+        return None
+    changed_at = None
+    if row.max_changed_at is not None:
+        # SQLite hands back naive datetimes; marks are always written in UTC
+        changed_at = pd.Timestamp(row.max_changed_at)
+        changed_at = changed_at.tz_localize("UTC") if changed_at.tzinfo is None else changed_at.tz_convert("UTC")
+    return Watermark(row.max_id, changed_at)
+
+
+def _change_times(df: pd.DataFrame) -> List[pd.Series]:
+    return [pd.to_datetime(df[col], errors="coerce", utc=True) for col in CHANGE_COLUMNS if col in df.columns]
+
+
+def rows_after(df: pd.DataFrame, watermark: Optional[Watermark]) -> pd.DataFrame:
+    """Rows that are new (id above the mark) or changed (a timestamp after the mark)"""
+    if watermark is None or df.empty:
+        return df
+    mask = pd.Series(False, index=df.index)
+    if watermark.max_id is not None and "id" in df.columns:
+        mask |= pd.to_numeric(df["id"], errors="coerce") > watermark.max_id
+    elif "id" in df.columns:
+        mask |= True
+    if watermark.max_changed_at is not None:
+        for times in _change_times(df):
+            mask |= times > watermark.max_changed_at
+    return df[mask]
+
+
+def advance_watermark(engine: Engine, table_name: str, df: pd.DataFrame, previous: Optional[Watermark]):
+    """Move the table's marks forward past the rows in `df`"""
+    max_id = previous.max_id if previous else None
+    max_changed_at = previous.max_changed_at if previous else None
+    if not df.empty and "id" in df.columns:
+        batch_max = pd.to_numeric(df["id"], errors="coerce").max()
+        if pd.notna(batch_max):
+            max_id = int(batch_max) if max_id is None else max(max_id, int(batch_max))
+    for times in _change_times(df):
+        batch_max = times.max()
+        if pd.notna(batch_max):
+            max_changed_at = batch_max if max_changed_at is None else max(max_changed_at, batch_max)
+
+    with engine.begin() as conn:
+        existing = conn.execute(
+            select(EtlWatermark.table_name).where(EtlWatermark.table_name == table_name)
+        ).first()
+        values = {
+            "max_id": max_id,
+            "max_changed_at": max_changed_at.tz_convert("UTC").to_pydatetime() if max_changed_at is not None else None,
+        }
+        if existing:
+            conn.execute(update(EtlWatermark).where(EtlWatermark.table_name == table_name).values(**values))
+        else:
+            conn.execute(insert(EtlWatermark).values(table_name=table_name, **values))
+
+
+def _generation(conn: Connection) -> int:
+    return conn.execute(select(DataGeneration.generation).where(DataGeneration.id == 1)).scalar() or 0
+
+
+def record_changed_products(conn: Connection, product_ids: Iterable[int]):
+    """Log products with updated order items under the current generation (call right after bump_generation)"""
+    generation = _generation(conn)
+    conn.execute(delete(ChangedProduct).where(ChangedProduct.generation <= generation - CHANGE_LOG_GENERATIONS))
+    rows = [{"generation": generation, "product_id": int(product_id)} for product_id in set(product_ids)]
+    if rows:
+        conn.execute(insert(ChangedProduct), rows)
+
+
+def changed_products_since(conn: Connection, generation: int) -> Optional[List[int]]:
+    """Products logged after `generation`, or None if the log no longer reaches back that far"""
+    if _generation(conn) - generation >= CHANGE_LOG_GENERATIONS:
+        return None
+    return conn.execute(
+        select(ChangedProduct.product_id).where(ChangedProduct.generation > generation).distinct()
+    ).scalars().all()
@@ -0,0 +1,114 @@
+"""
+Analytics over the dbt `fct_order_items` table instead of the raw tables.
+
+Set FCT_ORDER_ITEMS_TABLE to the table dbt builds (schema-qualified, e.g.
+`analytics.fct_order_items`, when the dbt target schema isn't the API's).
+Every query that would otherwise join order_items to products, users and
+orders then reads that one pre-joined table:
+
+- the product and customer breakdowns behind /analytics/summary,
+  /dashboard and friends with USE_ROLLUPS=false
+- /analytics/query shapes the rollups can't answer (source "fact")
+- time series by category or department, and the keyset breakdown pages,
+  with USE_ROLLUPS=false
+- Parquet snapshots (app.columnar) and /analytics/export/order-items
+
+With rollups on, rollups still answer first. The ETL keeps them current.
+The fact table is only as fresh as the last `dbt run`. dbt doesn't bump
+the data generation, so cached responses built from it are replaced when
+their TTL runs out.
+"""
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, MetaData, String, Table, case, func, select
+
+from app.config import settings
+from app.rollups import age_band
+
+
+def enabled() -> bool:
+    return bool(settings.fct_order_items_table)
+
+
+def _schema_and_name(qualified: str):
+    schema, _, name = qualified.rpartition(".")
+    return schema or None, name
+
+
+_schema, _name = _schema_and_name(settings.fct_order_items_table or "fct_order_items")
+
+# Columns of warehouse/models/core/fct_order_items.sql. dbt owns the table, so it's not in Base.metadata.
+fct_order_items = Table(
+    _name,
+    MetaData(),
+    Column("order_item_id", Integer, primary_key=True),
+    Column("order_id", Integer),
+    Column("user_id", Integer),
+    Column("product_id", Integer),
+    Column("order_status", String),
+    Column("order_created_at", DateTime(timezone=True)),
+    Column("shipped_at", DateTime(timezone=True)),
+    Column("delivered_at", DateTime(timezone=True)),
+    Column("order_returned_at", DateTime(timezone=True)),
+    Column("brand", String),
+    Column("category", String),
+    Column("department", String),
+    Column("retail_price", Float),
+    Column("cost", Float),
+    Column("customer_age", Integer),
+    Column("customer_gender", String),
+    Column("customer_country", String),
+    Column("sale_price", Float),
+    Column("discount", Float),
+    Column("item_status", String),
+    Column("item_created_at", DateTime(timezone=True)),
+    Column("item_returned_at", DateTime(timezone=True)),
+    Column("is_returned", Boolean),
+    Column("net_revenue", Float),
+    Column("discount_pct", Float),
+    Column("has_product", Boolean),
+    schema=_schema,
+)
+fct = fct_order_items.c
+
+
+def fct_order_items_select():
+    """Every fact row, in the column order of columnar.fct_order_items_select()"""
+    return select(*fct_order_items.columns).order_by(fct.item_created_at)
+
+
+def product_breakdown_select():
+    """Fact-table equivalent of the raw per (category, department, brand) breakdown"""
+    is_complete = fct.item_status == "Complete"
+    return select(
+        fct.has_product,
+        fct.category,
+        fct.department,
+        fct.brand,
+        func.count(fct.order_item_id).label("total_items"),
+        func.sum(case((fct.item_status == "Returned", 1), else_=0)).label("returned_items"),
+        func.sum(case((fct.is_returned, 1), else_=0)).label("returned_or_flagged"),
+        func.sum(case((is_complete, 1), else_=0)).label("complete_items"),
+        func.sum(case((is_complete, fct.sale_price))).label("revenue"),
+        func.count(func.distinct(case((is_complete & fct.has_product, fct.product_id)))).label("product_count")
+    ).group_by(
+        fct.has_product, fct.category, fct.department, fct.brand
+    )
+
+
+def customer_breakdown_select():
+    """Fact-table equivalent of the raw per (age range, country) breakdown
+
+    Items without a customer row have no age or country, so they land in
+    the (NULL, NULL) group, which the endpoints leave out like the raw join does.
+    """
+    age_range = age_band(fct.customer_age).label("age_range")
+    return select(
+        age_range,
+        fct.customer_country.label("country"),
+        func.count(func.distinct(fct.user_id)).label("customer_count"),
+        func.count(fct.sale_price).label("priced_items"),
+        func.sum(fct.sale_price).label("revenue")
+    ).where(
+        fct.item_status == "Complete"
+    ).group_by(
+        age_range, fct.customer_country
+    )
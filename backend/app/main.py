@@ -1,17 +1,64 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from app.routers import analytics, ml
-from app.database import engine, Base
+import time
+
+# Import-to-listening time is measured from here (see lifespan below)
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio  # noqa: E402
+import logging  # noqa: E402
+from contextlib import asynccontextmanager  # noqa: E402
+from fastapi import FastAPI, Response  # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from app.routers import analytics, ml  # noqa: E402
+from app.cache import AnalyticsCacheMiddleware  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import async_engine, engine, read_engines  # noqa: E402
+from app.metrics import MetricsMiddleware, instrument_engine, render_metrics  # noqa: E402
+from app.ml.registry import registry  # noqa: E402
+from app.warmup import state as warmup_state, warm_up  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def _log_through_uvicorn():
+    """Send app.* logs to uvicorn's handlers at its --log-level, unless a log config already handles them"""
+    app_logger, server_logger = logging.getLogger("app"), logging.getLogger("uvicorn")
+    if app_logger.handlers or logging.getLogger().handlers or not server_logger.handlers:
+        return
+    app_logger.setLevel(logging.getLogger("uvicorn.error").getEffectiveLevel())
+    for handler in server_logger.handlers:
+        app_logger.addHandler(handler)
+
+
+_log_through_uvicorn()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema checks, pool, model and cache warm-up run in the background; /ready reports when they finish
+    warmup = asyncio.create_task(warm_up(app))
+    startup_seconds = time.perf_counter() - IMPORT_STARTED
+    warmup_state.startup_seconds = startup_seconds
+    over = " (over the STARTUP_BUDGET_SECONDS budget)" if startup_seconds > settings.startup_budget_seconds else ""
+    logger.log(logging.WARNING if over else logging.INFO, "Listening %.2fs after import%s", startup_seconds, over)
+    yield
+    warmup.cancel()
+    registry.stop()
+    for async_read_engine in {async_engine, *read_engines}:
+        await async_read_engine.dispose()
+    engine.dispose()
 
-# Create tables
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Runway Outcomes Lab API",
     description="Backend API for fashion analytics and return prediction",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
+# Response cache for /analytics/* (added first so CORS headers wrap cached responses)
+app.add_middleware(AnalyticsCacheMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -19,8 +66,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Request/SQL metrics (added last so it's outermost and times the whole stack)
+if settings.metrics_enabled:
+    instrument_engine(engine, "sync")
+    instrument_engine(async_engine, "async")
+    for i, read_engine in enumerate(read_engines):
+        if read_engine is not async_engine:
+            instrument_engine(read_engine, f"read-{i}")
+    app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(analytics.router)
 app.include_router(ml.router)
@@ -32,6 +89,19 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 503 until the background warm-up has finished"""
+    return JSONResponse(warmup_state.report(), status_code=200 if warmup_state.ready else 503)
+
+
+if settings.metrics_enabled:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        """Prometheus metrics for this worker"""
+        return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/")
 def root():
     """Root endpoint"""
@@ -0,0 +1,319 @@
+"""
+Request, SQL and connection-pool metrics in Prometheus text format.
+
+MetricsMiddleware times every request per route template. SQLAlchemy
+cursor hooks on the sync and async engines time every statement and count
+its rows, labelled with the route that issued it and a fingerprint of the
+normalized SQL (`db_statement_info` maps fingerprints back to SQL), and
+count statements per request. Pool gauges are read at scrape time.
+Checkout waits run from when app.database's helpers ask for a connection
+(see timed_checkout) to the pool's checkout event. Everything is exposed
+on GET /metrics.
+
+Statements slower than SLOW_QUERY_MS are also logged with their
+normalized SQL and, on Postgres, their EXPLAIN plan (fetched off the
+request path).
+
+Metrics are per process: with several uvicorn workers each scrape sees
+the worker that served it.
+"""
+import bisect
+import functools
+import hashlib
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import Match
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# Route template of the request being served ("background" outside requests)
+_current_route: ContextVar[str] = ContextVar("metrics_route", default="background")
+# Statements issued by the current request: [count, seconds]
+_request_statements: ContextVar[Optional[List[float]]] = ContextVar("metrics_request_statements", default=None)
+# When the current code started asking for a pooled connection (see timed_checkout)
+_checkout_started: ContextVar[Optional[float]] = ContextVar("metrics_checkout_started", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # bucket counts, then +Inf count and sum
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        lines += [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in sorted(snapshot.items())]
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], REQUEST_BUCKETS
+)
+statement_duration = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time by issuing route and statement fingerprint",
+    ["route", "statement"], STATEMENT_BUCKETS
+)
+statement_rows = Counter(
+    "db_statement_rows_total", "Rows returned or affected by SQL statements", ["route", "statement"]
+)
+statements_per_request = Histogram(
+    "db_statements_per_request", "SQL statements issued per HTTP request", ["route"], COUNT_BUCKETS
+)
+db_time_per_request = Histogram(
+    "db_time_per_request_seconds", "Total SQL execution time per HTTP request", ["route"], REQUEST_BUCKETS
+)
+pool_wait = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["engine"], STATEMENT_BUCKETS
+)
+
+_statement_sql: Dict[str, str] = {}
+_engines: Dict[str, Engine] = {}
+_explain_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+
+_NORMALIZE = [
+    (re.compile(r"%\([^)]+\)s|\$\d+"), "?"),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\?(?:\s*,\s*\?)+"), "?, ..."),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL with literals and bind placeholders collapsed, so equal shapes share a fingerprint"""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql: str) -> str:
+    """Short stable id for a statement's normalized SQL (cached per raw SQL string)"""
+    normalized = normalize_sql(sql)
+    key = hashlib.sha1(normalized.encode()).hexdigest()[:12]
+    if key not in _statement_sql:
+        _statement_sql[key] = normalized
+    return key
+
+
+# SQL hooks ---------------------------------------------------------------------
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and context.execution_options.get("skip_metrics"):
+        return
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started or context is not None and context.execution_options.get("skip_metrics"):
+        return
+    elapsed = time.perf_counter() - started.pop()
+    route = _current_route.get()
+    key = fingerprint(statement)
+    statement_duration.observe(elapsed, route, key)
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount is not None and rowcount > 0:
+        statement_rows.inc(rowcount, route, key)
+    totals = _request_statements.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+    if settings.slow_query_ms > 0 and elapsed * 1000 >= settings.slow_query_ms:
+        _log_slow_query(conn, context, key, elapsed, route)
+
+
+def _log_slow_query(conn, context, key: str, elapsed: float, route: str):
+    compiled = getattr(context, "compiled", None)
+    message = f"Slow query {key} ({elapsed * 1000:.1f} ms, route {route}): {_statement_sql[key]}"
+    if not settings.slow_query_explain or compiled is None or conn.dialect.name != "postgresql" \
+            or not getattr(compiled.statement, "is_select", False):
+        logger.warning("%s", message)
+        return
+    # EXPLAIN on a separate connection and thread, so the request isn't held up
+    _explain_pool.submit(_explain_and_log, compiled.statement, message)
+
+
+def _explain_and_log(statement, message: str):
+    try:
+        from app.database import engine
+        with engine.connect() as conn:
+            compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+            plan = conn.exec_driver_sql(
+                f"EXPLAIN {compiled}", compiled.params, execution_options={"skip_metrics": True}
+            ).scalars().all()
+        logger.warning("%s\n  %s", message, "\n  ".join(plan))
+    except Exception as e:
+        logger.warning("%s\n  (EXPLAIN failed: %s)", message, e)
+
+
+@contextmanager
+def timed_checkout():
+    """Time the pool checkout made inside the block, if any (the session may already hold a connection)"""
+    token = _checkout_started.set(time.perf_counter())
+    try:
+        yield
+    finally:
+        _checkout_started.reset(token)
+
+
+def _time_pool_checkout(pool, engine_name: str):
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        started = _checkout_started.get()
+        if started is None:
+            return
+        pool_wait.observe(time.perf_counter() - started, engine_name)
+        # Later checkouts in the same block didn't wait from `started`
+        _checkout_started.set(None)
+    event.listen(pool, "checkout", on_checkout)
+
+
+def instrument_engine(engine: Engine, name: str):
+    """Attach statement hooks, pool gauges and checkout timing to an engine (sync or async)"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if name in _engines:
+        return
+    _engines[name] = sync_engine
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    _time_pool_checkout(sync_engine.pool, name)
+
+
+def _pool_gauges() -> List[str]:
+    gauges = {
+        "db_pool_size": ("Configured pool size", "size"),
+        "db_pool_checked_out": ("Connections currently checked out", "checkedout"),
+        "db_pool_checked_in": ("Idle connections in the pool", "checkedin"),
+        "db_pool_overflow": ("Connections open beyond pool_size (negative: unused pool slots)", "overflow"),
+    }
+    lines = []
+    for metric, (help_text, method) in gauges.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for name, engine in sorted(_engines.items()):
+            read = getattr(engine.pool, method, None)
+            if callable(read):
+                lines.append(f'{metric}{{engine="{name}"}} {read()}')
+    return lines
+
+
+def render_metrics() -> str:
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in (request_duration, statements_per_request, db_time_per_request, statement_duration, statement_rows, pool_wait):
+        lines += metric.render()
+    lines += _pool_gauges()
+    lines += ["# HELP db_statement_info Normalized SQL for each statement fingerprint", "# TYPE db_statement_info gauge"]
+    lines += [
+        f'db_statement_info{{statement="{key}",sql="{_escape(sql[:500])}"}} 1'
+        for key, sql in sorted(_statement_sql.items())
+    ]
+    return "\n".join(lines) + "\n"
+
+
+# Middleware --------------------------------------------------------------------
+
+
+def _route_template(request: Request) -> str:
+    # Resolve the route up front so SQL issued while handling it is labelled with it
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Record latency, statement count and DB time per request and route template"""
+
+    async def dispatch(self, request: Request, call_next):
+        route = _route_template(request)
+        route_token = _current_route.set(route)
+        totals = [0, 0.0]
+        totals_token = _request_statements.set(totals)
+        started = time.perf_counter()
+        status = "500"
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            request_duration.observe(time.perf_counter() - started, request.method, route, status)
+            statements_per_request.observe(totals[0], route)
+            db_time_per_request.observe(totals[1], route)
+            _current_route.reset(route_token)
+            _request_statements.reset(totals_token)
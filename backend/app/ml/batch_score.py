@@ -0,0 +1,272 @@
+"""
+Offline return-risk scoring for the whole catalog.
+
+Every product is scored against every customer segment, i.e. each age band
+x country pair seen in `users`, scored at the segment's average age. The
+scores go into `product_return_predictions`, which GET /ml/predictions
+serves.
+
+A run is split into product id ranges (`product_id // chunk_products`).
+Worker processes score the ranges in parallel. Each worker reads its
+products, scores the product x segment grid with one vectorized
+`predict_columns` call, then replaces that range's rows in one transaction
+that also records the chunk in `prediction_run_chunks`. An interrupted
+run resumes where it stopped: the next invocation skips finished chunks,
+as long as the live model version hasn't changed. Readers see the old or
+the new scores for each range, never a gap. Once every chunk is done, rows
+left over from earlier runs are deleted.
+
+Usage:
+    python -m app.ml.batch_score [--workers N] [--chunk-products N] [--discount-pct X] [--restart]
+"""
+import argparse
+import json
+import logging
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.engine import Engine
+
+from app.config import settings
+from app.database import engine_options
+from app.etl.copy_loader import INSERT_CHUNK_ROWS, copy_dataframe, resolve_load_mode
+from app.ml.model import ReturnPredictionModel
+from app.ml.registry import ModelRegistry, load_artifact
+from app.models import PredictionRun, PredictionRunChunk, Product, ProductReturnPrediction, User, create_schema
+from app.rollups import age_band
+
+# (age band, country, representative customer age)
+Segment = Tuple[str, str, int]
+
+
+def segments_query():
+    """Age band x country segments of customers with a known age and country"""
+    band = age_band(User.age).label("age_band")
+    return select(
+        band,
+        User.country,
+        func.avg(User.age).label("customer_age")
+    ).where(
+        User.age.isnot(None),
+        User.country.isnot(None)
+    ).group_by(
+        band, User.country
+    ).order_by(
+        band, User.country
+    )
+
+
+def read_segments(engine: Engine) -> List[Segment]:
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(segments_query())
+        return [(band, country, int(round(age))) for band, country, age in result]
+
+
+def products_query(first_id: int, last_id: int):
+    """Priced products in an id range"""
+    return select(
+        Product.id, Product.category, Product.department, Product.brand, Product.retail_price
+    ).where(
+        Product.id.between(first_id, last_id),
+        Product.retail_price.isnot(None)
+    ).order_by(Product.id)
+
+
+def score_grid(model: ReturnPredictionModel, products, segments: List[Segment], discount_pct: float) -> pd.DataFrame:
+    """Score every product against every segment in one vectorized batch"""
+    n_segments = len(segments)
+    ids, categories, departments, brands, prices = (np.asarray(values) for values in zip(*products))
+    bands, countries, ages = (np.asarray(values) for values in zip(*segments))
+    columns = {
+        "product_id": np.repeat(ids.astype(np.int64), n_segments),
+        "category": np.repeat(categories.astype(object), n_segments),
+        "department": np.repeat(departments.astype(object), n_segments),
+        "brand": np.repeat(brands.astype(object), n_segments),
+        "price": np.repeat(prices.astype(np.float64), n_segments),
+        "discount_pct": np.full(len(ids) * n_segments, discount_pct, dtype=np.float64),
+        "customer_age": np.tile(ages.astype(np.int64), len(ids)),
+        "customer_country": np.tile(countries.astype(object), len(ids)),
+    }
+    product_ids, probabilities, labels = model.predict_columns(columns)
+    return pd.DataFrame({
+        "product_id": product_ids,
+        "age_band": np.tile(bands.astype(object), len(ids)),
+        "country": columns["customer_country"],
+        "category": columns["category"],
+        "department": columns["department"],
+        "brand": columns["brand"],
+        "price": columns["price"],
+        "customer_age": columns["customer_age"],
+        "return_probability": probabilities,
+        "risk_label": labels,
+    })
+
+
+# Worker processes ----------------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(run: dict):
+    # Each process gets its own connection and its own copy of the run's model version
+    _worker["engine"] = create_engine(
+        settings.database_url, **{**engine_options(settings.database_url), "pool_size": 1, "max_overflow": 0}
+    )
+    _worker["model"] = load_artifact(run["model_version"]) if run["model_version"] else ReturnPredictionModel()
+    _worker["run"] = run
+
+
+def _score_chunk(chunk: int) -> int:
+    """Score one product id range and atomically replace its predictions; returns rows written"""
+    engine, model, run = _worker["engine"], _worker["model"], _worker["run"]
+    first_id = chunk * run["chunk_products"]
+    last_id = first_id + run["chunk_products"] - 1
+
+    with engine.connect() as conn:
+        products = conn.execute(products_query(first_id, last_id)).all()
+    frame = score_grid(model, products, run["segments"], run["discount_pct"]) if products else None
+
+    with engine.begin() as conn:
+        conn.execute(delete(ProductReturnPrediction).where(ProductReturnPrediction.product_id.between(first_id, last_id)))
+        rows = 0
+        if frame is not None:
+            frame = frame.assign(run_id=run["id"], model_version=run["model_version"], scored_at=run["scored_at"])
+            if resolve_load_mode(engine) == "copy":
+                copy_dataframe(conn, frame, ProductReturnPrediction.__tablename__)
+            else:
+                records = frame.astype(object).to_dict("records")
+                for start in range(0, len(records), INSERT_CHUNK_ROWS):
+                    conn.execute(insert(ProductReturnPrediction), records[start:start + INSERT_CHUNK_ROWS])
+            rows = len(frame)
+        conn.execute(insert(PredictionRunChunk).values(run_id=run["id"], chunk=chunk, rows=rows))
+    return rows
+
+
+# Runs ------------------------------------------------------------------------------
+
+
+def _start_or_resume(
+    engine: Engine,
+    model_version: Optional[str],
+    chunk_products: int,
+    discount_pct: float,
+    restart: bool
+) -> dict:
+    """The latest run if it's unfinished and uses this model and discount, or a new one"""
+    with engine.begin() as conn:
+        # Only the latest run can resume: an older one's finished chunks may since have been rescored
+        run = conn.execute(select(PredictionRun).order_by(PredictionRun.id.desc()).limit(1)).first()
+        if run is not None and run.finished_at is None and not restart \
+                and run.model_version == model_version and run.discount_pct == discount_pct:
+            print(f"Resuming run {run.id}")
+            return {
+                "id": run.id, "model_version": run.model_version, "discount_pct": run.discount_pct,
+                "chunk_products": run.chunk_products, "segments": [tuple(s) for s in json.loads(run.segments)],
+                "scored_at": datetime.now(timezone.utc),
+            }
+
+        # Ids sort in start order (the latest run is found by id); the suffix keeps runs started together apart
+        run_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        segments = read_segments(engine)
+        conn.execute(insert(PredictionRun).values(
+            id=run_id, model_version=model_version, discount_pct=discount_pct,
+            chunk_products=chunk_products, segments=json.dumps(segments)
+        ))
+        return {
+            "id": run_id, "model_version": model_version, "discount_pct": discount_pct,
+            "chunk_products": chunk_products, "segments": segments, "scored_at": datetime.now(timezone.utc),
+        }
+
+
+def score_catalog(
+    workers: int = None,
+    chunk_products: int = None,
+    discount_pct: float = 0.0,
+    restart: bool = False
+) -> str:
+    """Score every product x segment with the live model; returns the run id"""
+    workers = workers or settings.batch_score_workers
+    chunk_products = chunk_products or settings.batch_score_chunk_products
+    options = {**engine_options(settings.database_url), "pool_size": 1, "max_overflow": 1}
+    engine = create_engine(settings.database_url, **options)
+    create_schema(engine)
+    if engine.dialect.name == "sqlite":
+        # SQLite serializes writers; parallel chunks would only contend for the lock
+        workers = 1
+
+    model_version = ModelRegistry(poll_seconds=0).get().version
+    run = _start_or_resume(engine, model_version, chunk_products, discount_pct, restart)
+    if not run["segments"]:
+        raise RuntimeError("No customer segments found; load data with app.etl.load_thelook_csvs first")
+
+    with engine.connect() as conn:
+        first_id, last_id = conn.execute(select(func.min(Product.id), func.max(Product.id))).one()
+        done = set(conn.execute(select(PredictionRunChunk.chunk).where(PredictionRunChunk.run_id == run["id"])).scalars())
+    chunks = range(first_id // run["chunk_products"], last_id // run["chunk_products"] + 1) if first_id is not None else range(0)
+    todo = [chunk for chunk in chunks if chunk not in done]
+    print(
+        f"Run {run['id']}: scoring {len(todo)} of {len(chunks)} chunks x {len(run['segments'])} segments "
+        f"(model {model_version or 'heuristic'}, workers: {workers})"
+    )
+
+    started = time.perf_counter()
+    rows = 0
+    # Forked workers must not inherit (and later close) this process's pooled connections
+    engine.dispose()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(run,)) as pool:
+        # Keep a bounded number of chunks in flight so memory doesn't grow with the catalog
+        pending = iter(todo)
+        running = set()
+        finished = 0
+        # Report about every tenth of the chunks; several can finish in one wait, so compare against a threshold
+        report_every = max(1, len(todo) // 10)
+        next_report = report_every
+        while True:
+            while len(running) < workers * 2:
+                chunk = next(pending, None)
+                if chunk is None:
+                    break
+                running.add(pool.submit(_score_chunk, chunk))
+            if not running:
+                break
+            completed, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                rows += future.result()
+                finished += 1
+            if finished >= next_report or finished == len(todo):
+                next_report = (finished // report_every + 1) * report_every
+                elapsed = time.perf_counter() - started
+                print(f"  {finished}/{len(todo)} chunks, {rows} predictions ({rows / max(elapsed, 1e-9):,.0f}/s)")
+
+    with engine.begin() as conn:
+        # Products and segments no longer in the catalog keep rows from older runs until now
+        stale = conn.execute(delete(ProductReturnPrediction).where(ProductReturnPrediction.run_id != run["id"])).rowcount
+        conn.execute(update(PredictionRun).where(PredictionRun.id == run["id"]).values(finished_at=func.now()))
+    engine.dispose()
+
+    print(f"Run {run['id']} complete: {rows} predictions in {time.perf_counter() - started:.1f}s ({stale} stale removed)")
+    return run["id"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the whole catalog against every customer segment")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: BATCH_SCORE_WORKERS)")
+    parser.add_argument(
+        "--chunk-products", type=int, default=None,
+        help="products per resumable chunk for new runs (default: BATCH_SCORE_CHUNK_PRODUCTS)"
+    )
+    parser.add_argument("--discount-pct", type=float, default=0.0, help="discount to score every product at")
+    parser.add_argument("--restart", action="store_true", help="start a new run instead of resuming an unfinished one")
+    args = parser.parse_args()
+    # The model registry reports through logging
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    score_catalog(
+        workers=args.workers, chunk_products=args.chunk_products,
+        discount_pct=args.discount_pct, restart=args.restart
+    )
@@ -0,0 +1,146 @@
+"""
+Streaming bulk scoring for POST /ml/predict_returns/stream.
+
+The upload is read as it arrives, either as CSV with a header row or as
+NDJSON with one ProductInput object per line. It is cut into chunks of
+PREDICT_STREAM_CHUNK_ROWS lines. Each chunk is validated and scored in
+the threadpool and written back as NDJSON PredictionResult lines before
+the next chunk is read. Memory is bounded by one chunk whatever the upload
+size, and the first predictions reach the client while the rest of the
+upload is still in flight.
+
+The 200 status goes out with the first chunk, so invalid rows can't fail
+the request. Each one is reported after its chunk's predictions as
+{"line": n, "error": "..."}, where n is the line number in the upload.
+
+The response body is generated while the request body is still being
+read. So UploadStreamingResponse doesn't run StreamingResponse's
+disconnect listener, which would call receive() at the same time and
+swallow upload chunks. A client that goes away mid-upload still ends the
+stream, because request.stream() raises ClientDisconnect.
+"""
+import csv
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+
+from app.config import settings
+from app.ml.model import ReturnPredictionModel, products_to_columns
+from app.schemas import ProductInput
+
+CSV_MEDIA_TYPES = ("text/csv", "application/csv")
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json")
+
+# (line number in the upload, raw line without its newline)
+Line = Tuple[int, bytes]
+
+
+def upload_format(content_type: Optional[str]) -> Optional[str]:
+    """Upload format ("csv" or "ndjson") for a Content-Type, or None if it isn't supported"""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CSV_MEDIA_TYPES:
+        return "csv"
+    if media_type in NDJSON_MEDIA_TYPES:
+        return "ndjson"
+    return None
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Line]:
+    """Split a byte stream into numbered, non-blank lines as it arrives"""
+    pending = b""
+    line_no = 0
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_no += 1
+            line = line.rstrip(b"\r")
+            if line.strip():
+                yield line_no, line
+    if pending.strip():
+        yield line_no + 1, pending.rstrip(b"\r")
+
+
+def _split_csv(line: bytes) -> List[str]:
+    return next(csv.reader([line.decode("utf-8-sig")]))
+
+
+async def read_csv_header(lines: AsyncIterator[Line]) -> List[str]:
+    """Consume the header row; ValueError if it's missing or lacks a ProductInput field"""
+    async for _, line in lines:
+        header = [name.strip().lower() for name in _split_csv(line)]
+        missing = [field for field in ProductInput.model_fields if field not in header]
+        if missing:
+            raise ValueError(f"CSV header is missing {', '.join(missing)}")
+        return header
+    raise ValueError("CSV upload has no header row")
+
+
+def _parse(line: bytes, header: Optional[List[str]]) -> ProductInput:
+    if header is None:
+        return ProductInput.model_validate_json(line)
+    values = _split_csv(line)
+    if len(values) != len(header):
+        raise ValueError(f"expected {len(header)} fields, got {len(values)}")
+    return ProductInput.model_validate(dict(zip(header, values)))
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in detail['loc']) or 'row'}: {detail['msg']}"
+            for detail in error.errors(include_url=False)
+        )
+    return str(error)
+
+
+def score_chunk(model: ReturnPredictionModel, lines: List[Line], header: Optional[List[str]]) -> bytes:
+    """Validate and score one chunk of upload lines; returns its NDJSON output"""
+    products = []
+    errors = []
+    for line_no, line in lines:
+        try:
+            products.append(_parse(line, header))
+        except (ValueError, UnicodeDecodeError) as e:
+            errors.append({"line": line_no, "error": _describe(e)})
+
+    out = []
+    if products:
+        product_ids, probabilities, labels = model.predict_columns(products_to_columns(products))
+        out = [
+            json.dumps({"product_id": product_id, "return_probability": probability, "risk_label": label})
+            for product_id, probability, label in zip(product_ids.tolist(), probabilities.tolist(), labels.tolist())
+        ]
+    out += [json.dumps(error) for error in errors]
+    return ("\n".join(out) + "\n").encode() if out else b""
+
+
+async def score_stream(
+    model: ReturnPredictionModel,
+    lines: AsyncIterator[Line],
+    header: Optional[List[str]] = None,
+    chunk_rows: int = None,
+) -> AsyncIterator[bytes]:
+    """Score upload lines chunk by chunk, yielding NDJSON as each chunk is done"""
+    chunk_rows = chunk_rows or settings.predict_stream_chunk_rows
+    chunk: List[Line] = []
+    async for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_rows:
+            yield await run_in_threadpool(score_chunk, model, chunk, header)
+            chunk = []
+    if chunk:
+        yield await run_in_threadpool(score_chunk, model, chunk, header)
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """StreamingResponse for bodies that read the request while they are sent"""
+
+    async def __call__(self, scope, receive, send):
+        # receive() belongs to request.stream() inside the body iterator
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,347 @@
+"""
+In-memory product and customer features for ID-only predictions.
+
+POST /ml/predict_returns accepts just a `product_id` (and optionally a
+`user_id`) per item. The features it needs come from the `products` and
+`users` tables, held here as sorted NumPy id arrays with parallel
+columns. Strings are stored as int32 codes into a shared vocabulary, so
+a lookup is one `np.searchsorted` per batch and needs no query per
+request. Next to its attributes, each product carries its historical
+return rate: returned over resolved order items, with the same outcome
+definition training uses.
+
+The index is built on first use (or during warm-up). Later it follows
+the data generation counter that the ETL and rollup refreshes bump (see
+app.cache). When the counter moves, a background thread builds the next
+snapshot, and requests keep using the current one until it's swapped in.
+A refresh reloads all products, since the catalog is small. It only
+reads users past the last id or `updated_at` seen. It recounts returns
+only for products with order items past the last id or `returned_at`
+seen, or with items the ETL updated since the snapshot's generation (see
+app.etl.watermarks).
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.engine import Connection, Engine
+
+from app.cache import current_generation
+from app.database import engine as default_engine
+from app.etl.watermarks import changed_products_since
+from app.models import OrderItem, Product, User
+
+logger = logging.getLogger(__name__)
+
+USER_CHUNK_ROWS = 100_000
+ID_CHUNK_SIZE = 1000
+
+
+class UnknownIdsError(ValueError):
+    """Some requested product or user ids aren't in the index"""
+
+    def __init__(self, kind: str, ids: Sequence[int]):
+        self.kind = kind
+        self.ids = list(ids)
+        shown = ", ".join(str(i) for i in self.ids[:20]) + (", ..." if len(self.ids) > 20 else "")
+        super().__init__(f"unknown {kind} ids: {shown}")
+
+
+class Vocabulary:
+    """Interns strings as int32 codes (-1 for NULL); only ever grows"""
+
+    __slots__ = ("strings", "_codes")
+
+    def __init__(self):
+        self.strings: List[Optional[str]] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, values: Iterable[Optional[str]]) -> np.ndarray:
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            code = self._codes.get(value)
+            if code is None:
+                code = self._codes[value] = len(self.strings)
+                self.strings.append(value)
+            codes.append(code)
+        return np.asarray(codes, dtype=np.int32)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        # Trailing None decodes -1
+        lookup = np.asarray(self.strings + [None], dtype=object)
+        return lookup[codes]
+
+
+class FeatureSnapshot:
+    """One immutable generation of the index"""
+
+    __slots__ = (
+        "generation", "vocabulary",
+        "product_ids", "category", "brand", "department", "price", "resolved_items", "returned_items",
+        "user_ids", "age", "country",
+        "max_user_id", "max_user_updated_at", "max_item_id", "max_returned_at",
+    )
+
+    def product_positions(self, product_ids: np.ndarray) -> np.ndarray:
+        return _positions(self.product_ids, product_ids, "product")
+
+    def user_positions(self, user_ids: np.ndarray) -> np.ndarray:
+        return _positions(self.user_ids, user_ids, "user")
+
+    def return_rates(self, positions: np.ndarray) -> np.ndarray:
+        """Historical return rate per product position (NaN without resolved items)"""
+        resolved = self.resolved_items[positions]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(resolved > 0, self.returned_items[positions] / resolved, np.nan)
+
+    def columns(
+        self,
+        product_ids: Sequence[int],
+        user_ids: Optional[Sequence[Optional[int]]] = None,
+        discount_pct: Optional[Sequence[float]] = None,
+    ) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Model input columns for the ids, plus each product's historical return rate
+
+        A missing user_id scores with unknown age and country. Raises
+        UnknownIdsError for ids the index doesn't hold.
+        """
+        n_rows = len(product_ids)
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        products = self.product_positions(product_ids)
+
+        age = np.full(n_rows, np.nan)
+        country = np.full(n_rows, -1, dtype=np.int32)
+        if user_ids is not None:
+            known = np.asarray([user_id is not None for user_id in user_ids], dtype=bool)
+            if known.any():
+                ids = np.asarray([user_id for user_id in user_ids if user_id is not None], dtype=np.int64)
+                users = self.user_positions(ids)
+                age[known] = self.age[users]
+                country[known] = self.country[users]
+
+        columns = {
+            "product_id": product_ids,
+            "category": self.vocabulary.decode(self.category[products]),
+            "brand": self.vocabulary.decode(self.brand[products]),
+            "department": self.vocabulary.decode(self.department[products]),
+            "price": self.price[products],
+            "discount_pct": np.zeros(n_rows) if discount_pct is None else np.asarray(discount_pct, dtype=np.float64),
+            "customer_age": age,
+            "customer_country": self.vocabulary.decode(country),
+        }
+        return columns, self.return_rates(products)
+
+
+def _positions(sorted_ids: np.ndarray, ids: np.ndarray, kind: str) -> np.ndarray:
+    positions = np.searchsorted(sorted_ids, ids)
+    clipped = np.minimum(positions, len(sorted_ids) - 1)
+    found = (positions < len(sorted_ids)) & (sorted_ids[clipped] == ids) if len(sorted_ids) else np.zeros(len(ids), bool)
+    if not found.all():
+        raise UnknownIdsError(kind, np.unique(ids[~found]).tolist())
+    return clipped
+
+
+# Loading ---------------------------------------------------------------------------
+
+_is_returned = or_(OrderItem.status == "Returned", OrderItem.returned_at.isnot(None))
+
+
+def _return_counts_select(product_ids=None):
+    """Resolved and returned item counts per product (resolved as in app.ml.train)"""
+    query = select(
+        OrderItem.product_id,
+        func.count(OrderItem.id).label("resolved_items"),
+        func.sum(case((_is_returned, 1), else_=0)).label("returned_items")
+    ).where(
+        OrderItem.product_id.isnot(None),
+        OrderItem.status.in_(["Complete", "Returned"])
+    ).group_by(OrderItem.product_id)
+    if product_ids is not None:
+        query = query.where(OrderItem.product_id.in_(product_ids))
+    return query
+
+
+def _load_products(conn: Connection, snapshot: FeatureSnapshot, previous: Optional[FeatureSnapshot]):
+    rows = conn.execute(select(
+        Product.id, Product.category, Product.brand, Product.department, Product.retail_price
+    ).order_by(Product.id)).all()
+    ids, category, brand, department, price = zip(*rows) if rows else ((),) * 5
+    vocabulary = snapshot.vocabulary
+    snapshot.product_ids = np.asarray(ids, dtype=np.int64)
+    snapshot.category = vocabulary.encode(category)
+    snapshot.brand = vocabulary.encode(brand)
+    snapshot.department = vocabulary.encode(department)
+    snapshot.price = np.asarray([np.nan if p is None else p for p in price], dtype=np.float64)
+    snapshot.resolved_items = np.zeros(len(ids), dtype=np.int32)
+    snapshot.returned_items = np.zeros(len(ids), dtype=np.int32)
+    if previous is not None and len(previous.product_ids):
+        # Carry counts over for products that were already indexed
+        positions = np.searchsorted(previous.product_ids, snapshot.product_ids)
+        clipped = np.minimum(positions, len(previous.product_ids) - 1)
+        kept = previous.product_ids[clipped] == snapshot.product_ids
+        snapshot.resolved_items[kept] = previous.resolved_items[clipped[kept]]
+        snapshot.returned_items[kept] = previous.returned_items[clipped[kept]]
+
+
+def _apply_return_counts(conn: Connection, snapshot: FeatureSnapshot, product_ids=None):
+    if not len(snapshot.product_ids):
+        return
+    if product_ids is None:
+        batches = [None]
+        # Counts carried over from a previous snapshot are all redone
+        snapshot.resolved_items[:] = 0
+        snapshot.returned_items[:] = 0
+    else:
+        product_ids = sorted(product_ids)
+        batches = [product_ids[start:start + ID_CHUNK_SIZE] for start in range(0, len(product_ids), ID_CHUNK_SIZE)]
+        # Products whose items all went away (or stopped being resolved) drop to zero
+        indexed = np.isin(snapshot.product_ids, product_ids)
+        snapshot.resolved_items[indexed] = 0
+        snapshot.returned_items[indexed] = 0
+    for batch in batches:
+        rows = conn.execute(_return_counts_select(batch)).all()
+        if not rows:
+            continue
+        ids, resolved, returned = (np.asarray(values, dtype=np.int64) for values in zip(*rows))
+        positions = np.searchsorted(snapshot.product_ids, ids)
+        clipped = np.minimum(positions, len(snapshot.product_ids) - 1)
+        known = (positions < len(snapshot.product_ids)) & (snapshot.product_ids[clipped] == ids)
+        snapshot.resolved_items[clipped[known]] = resolved[known]
+        snapshot.returned_items[clipped[known]] = returned[known]
+
+
+def _load_users(conn: Connection, snapshot: FeatureSnapshot, previous: Optional[FeatureSnapshot]):
+    query = select(User.id, User.age, User.country).order_by(User.id)
+    if previous is not None:
+        changed = User.id > previous.max_user_id
+        if previous.max_user_updated_at is not None:
+            changed = changed | (User.updated_at > previous.max_user_updated_at)
+        else:
+            # No user had been updated yet, so any update is new
+            changed = changed | User.updated_at.isnot(None)
+        query = query.where(changed)
+    # Taken before the rows are read, so an update that lands in between is read again next time
+    max_updated_at = conn.execute(select(func.max(User.updated_at))).scalar()
+
+    ids, ages, countries = [], [], []
+    result = conn.execution_options(stream_results=True, yield_per=USER_CHUNK_ROWS).execute(query)
+    for rows in result.partitions(USER_CHUNK_ROWS):
+        batch_ids, batch_ages, batch_countries = zip(*rows)
+        ids.append(np.asarray(batch_ids, dtype=np.int64))
+        ages.append(np.asarray([np.nan if a is None else a for a in batch_ages], dtype=np.float32))
+        countries.append(snapshot.vocabulary.encode(batch_countries))
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+    ages = np.concatenate(ages) if ages else np.zeros(0, dtype=np.float32)
+    countries = np.concatenate(countries) if countries else np.zeros(0, dtype=np.int32)
+
+    if previous is None:
+        snapshot.user_ids, snapshot.age, snapshot.country = ids, ages, countries
+    else:
+        # Overwrite changed users in place (on copies), then append and re-sort new ones
+        user_ids, age, country = previous.user_ids, previous.age.copy(), previous.country.copy()
+        positions = np.searchsorted(user_ids, ids)
+        clipped = np.minimum(positions, max(len(user_ids) - 1, 0))
+        existing = (positions < len(user_ids)) & (user_ids[clipped] == ids) if len(user_ids) else np.zeros(len(ids), bool)
+        age[clipped[existing]] = ages[existing]
+        country[clipped[existing]] = countries[existing]
+        user_ids = np.concatenate([user_ids, ids[~existing]])
+        age = np.concatenate([age, ages[~existing]])
+        country = np.concatenate([country, countries[~existing]])
+        order = np.argsort(user_ids, kind="stable")
+        snapshot.user_ids, snapshot.age, snapshot.country = user_ids[order], age[order], country[order]
+    snapshot.max_user_id = int(snapshot.user_ids[-1]) if len(snapshot.user_ids) else 0
+    snapshot.max_user_updated_at = max_updated_at
+
+
+def _item_watermarks(conn: Connection) -> Tuple[int, Optional[datetime]]:
+    max_id, max_returned_at = conn.execute(select(func.max(OrderItem.id), func.max(OrderItem.returned_at))).one()
+    return max_id or 0, max_returned_at
+
+
+def build_snapshot(bind: Engine, previous: Optional[FeatureSnapshot] = None) -> FeatureSnapshot:
+    """Load a full snapshot, or the next one from `previous` reading only what changed"""
+    snapshot = FeatureSnapshot()
+    with bind.connect() as conn:
+        # Read the generation first: anything written after it triggers another refresh
+        snapshot.generation = current_generation()
+        snapshot.vocabulary = previous.vocabulary if previous is not None else Vocabulary()
+        max_item_id, max_returned_at = _item_watermarks(conn)
+        _load_products(conn, snapshot, previous)
+        if previous is None:
+            _apply_return_counts(conn, snapshot)
+        else:
+            touched = OrderItem.id > previous.max_item_id
+            if previous.max_returned_at is not None:
+                touched = touched | (OrderItem.returned_at > previous.max_returned_at)
+            else:
+                touched = touched | OrderItem.returned_at.isnot(None)
+            # Status changes move neither mark; the ETL logs those items' products instead
+            changed = changed_products_since(conn, previous.generation)
+            if changed is None:
+                _apply_return_counts(conn, snapshot)
+            else:
+                product_ids = set(conn.execute(
+                    select(OrderItem.product_id).where(touched, OrderItem.product_id.isnot(None)).distinct()
+                ).scalars().all())
+                product_ids.update(changed)
+                if product_ids:
+                    _apply_return_counts(conn, snapshot, product_ids)
+        _load_users(conn, snapshot, previous)
+        snapshot.max_item_id, snapshot.max_returned_at = max_item_id, max_returned_at
+    return snapshot
+
+
+class FeatureIndex:
+    """Holds the live snapshot; builds it on first use and refreshes it when the data generation moves"""
+
+    def __init__(self, bind: Engine = None):
+        self.bind = bind or default_engine
+        self._snapshot: Optional[FeatureSnapshot] = None
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+
+    def get(self) -> FeatureSnapshot:
+        """The live snapshot (callers should use one snapshot for a whole batch)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._timed_build(None)
+                snapshot = self._snapshot
+        elif current_generation() != snapshot.generation and self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, name="feature-index", daemon=True).start()
+        return snapshot
+
+    def refresh(self):
+        """Build the next snapshot now (incrementally from the live one)"""
+        with self._lock:
+            self._snapshot = self._timed_build(self._snapshot)
+
+    def _refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Feature index refresh failed")
+        finally:
+            self._refreshing.release()
+
+    def _timed_build(self, previous: Optional[FeatureSnapshot]) -> FeatureSnapshot:
+        started = time.perf_counter()
+        snapshot = build_snapshot(self.bind, previous)
+        elapsed = time.perf_counter() - started
+        kind = "Refreshed" if previous is not None else "Loaded"
+        logger.info(
+            "%s feature index in %.2fs: %d products, %d users (generation %s)",
+            kind, elapsed, len(snapshot.product_ids), len(snapshot.user_ids), snapshot.generation,
+        )
+        return snapshot
+
+
+feature_index = FeatureIndex()
@@ -0,0 +1,57 @@
+"""
+Feature encoding shared by training (app.ml.train) and scoring (app.ml.model).
+
+Categorical fields are hashed into a fixed-width space, so encoding needs no
+fitted vocabulary: every chunk of a streamed training set, and every request
+batch, maps to the same columns without a pass over the full data.
+"""
+import functools
+from typing import Dict
+
+import numpy as np
+from scipy import sparse
+
+N_HASHED_FEATURES = 2 ** 18
+CATEGORICAL_FIELDS = ["category", "brand", "department", "customer_country"]
+NUMERIC_FIELDS = ["price", "discount_pct", "customer_age"]
+# Columns build_features derives from NUMERIC_FIELDS, ahead of the hashed ones
+N_NUMERIC_FEATURES = 5
+
+# Bump when the encoding changes; artifacts record the version they were trained with
+FEATURE_VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _hasher():
+    # Imported on first use: scikit-learn takes about a second to import, and the API shouldn't pay for it at startup
+    from sklearn.feature_extraction import FeatureHasher
+    return FeatureHasher(n_features=N_HASHED_FEATURES, input_type="string", alternate_sign=False)
+
+
+def _categorical_tokens(columns: Dict[str, np.ndarray], n_rows: int):
+    fields = [(field, columns[field]) for field in CATEGORICAL_FIELDS]
+    for i in range(n_rows):
+        yield [f"{field}={values[i]}" for field, values in fields]
+
+
+def build_features(columns: Dict[str, np.ndarray]) -> sparse.csr_matrix:
+    """Encode a struct-of-arrays batch (ProductInput field names) as a sparse matrix"""
+    n_rows = len(columns["price"])
+    if n_rows == 0:
+        # FeatureHasher.transform can't take an empty batch
+        return sparse.csr_matrix((0, N_NUMERIC_FEATURES + N_HASHED_FEATURES))
+    price = np.nan_to_num(np.asarray(columns["price"], dtype=np.float64))
+    discount_pct = np.nan_to_num(np.asarray(columns["discount_pct"], dtype=np.float64))
+    customer_age = np.asarray(columns["customer_age"], dtype=np.float64)
+    age_known = ~np.isnan(customer_age)
+    customer_age = np.where(age_known, customer_age, 0.0)
+
+    numeric = np.column_stack([
+        np.minimum(price / 200.0, 5.0),
+        discount_pct / 100.0,
+        customer_age / 100.0,
+        np.maximum(0.0, (30.0 - customer_age) / 30.0) * age_known,
+        age_known.astype(np.float64),
+    ])
+    hashed = _hasher().transform(_categorical_tokens(columns, n_rows))
+    return sparse.hstack([sparse.csr_matrix(numeric), hashed], format="csr")
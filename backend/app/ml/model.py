@@ -1,74 +1,80 @@
-import os
-import pickle
-from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy.special import expit
+from app.ml.features import build_features
 from app.schemas import ProductInput, PredictionResult
 
 
 class ReturnPredictionModel:
-    """Simple return prediction model (heuristic-based stub)"""
+    """Return prediction model: trained linear weights from app.ml.train, or a heuristic fallback"""
     
-    def __init__(self):
-        self.model_path = Path(__file__).parent.parent.parent / "models" / "returns_model.pkl"
-        self.model = None
-        self._load_model()
+    def __init__(self, coef: Optional[np.ndarray] = None, intercept: float = 0.0, version: Optional[str] = None, meta: Optional[dict] = None):
+        # coef is usually a read-only memmap of the artifact's coef.npy (see app.ml.registry)
+        self.coef = coef
+        self.intercept = intercept
+        self.version = version
+        self.meta = meta or {}
     
-    def _load_model(self):
-        """Try to load a trained model, otherwise use heuristic"""
-        if self.model_path.exists():
-            try:
-                with open(self.model_path, "rb") as f:
-                    self.model = pickle.load(f)
-            except Exception as e:
-                print(f"Could not load model: {e}. Using heuristic.")
-                self.model = None
-        else:
-            print("No trained model found. Using heuristic.")
-            self.model = None
+    @property
+    def is_trained(self) -> bool:
+        return self.coef is not None
     
     def predict(self, products: List[ProductInput]) -> List[PredictionResult]:
         """Predict return probability for products"""
-        predictions = []
-        
-        for product in products:
-            if self.model:
-                # If we had a trained model, use it here
-                # For now, this is a stub
-                return_prob = 0.25
-            else:
-                # Heuristic: higher price + high discount + younger customer → higher return risk
-                base_risk = 0.15
-                
-                # Price factor (higher price = higher risk)
-                price_factor = min(product.price / 200.0, 1.0) * 0.15
-                
-                # Discount factor (higher discount = higher risk)
-                discount_factor = (product.discount_pct / 100.0) * 0.20
-                
-                # Age factor (younger = slightly higher risk)
-                age_factor = max(0, (30 - product.customer_age) / 30.0) * 0.10
-                
-                return_prob = min(base_risk + price_factor + discount_factor + age_factor, 0.95)
-            
-            # Risk label
-            if return_prob < 0.2:
-                risk_label = "Low"
-            elif return_prob < 0.4:
-                risk_label = "Medium"
-            else:
-                risk_label = "High"
-            
-            predictions.append(
-                PredictionResult(
-                    product_id=product.product_id,
-                    return_probability=round(return_prob, 3),
-                    risk_label=risk_label
-                )
-            )
-        
-        return predictions
+        product_ids, probabilities, labels = self.predict_columns(products_to_columns(products))
+        return [
+            PredictionResult(product_id=product_id, return_probability=probability, risk_label=label)
+            for product_id, probability, label in zip(product_ids.tolist(), probabilities.tolist(), labels.tolist())
+        ]
+
+    def predict_columns(self, columns: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score a struct-of-arrays batch; returns (product_ids, rounded probabilities, risk labels)"""
+        price = np.asarray(columns["price"], dtype=np.float64)
+        discount_pct = np.asarray(columns["discount_pct"], dtype=np.float64)
+        # Float so ID-only requests (app.ml.feature_index) can pass NaN for an unknown age
+        customer_age = np.asarray(columns["customer_age"], dtype=np.float64)
+
+        if self.coef is not None:
+            # Logistic regression over the hashed features (sparse @ dense weights)
+            return_prob = expit(build_features(columns) @ self.coef + self.intercept)
+        else:
+            # Heuristic: higher price + high discount + younger customer → higher return risk
+            # (same operations, in the same order, as the original per-row version)
+            # (an unknown price or age contributes nothing)
+            base_risk = 0.15
+            price_factor = np.minimum(np.nan_to_num(price) / 200.0, 1.0) * 0.15
+            discount_factor = (discount_pct / 100.0) * 0.20
+            age_factor = np.where(np.isnan(customer_age), 0.0, np.maximum(0, (30 - customer_age) / 30.0) * 0.10)
+            return_prob = np.minimum(base_risk + price_factor + discount_factor + age_factor, 0.95)
+
+        # Risk label (from the unrounded probability)
+        risk_label = np.select(
+            [return_prob < 0.2, return_prob < 0.4],
+            ["Low", "Medium"],
+            default="High"
+        )
+
+        return np.asarray(columns["product_id"], dtype=np.int64), round_half_even_3(return_prob), risk_label
+
+
+def products_to_columns(products: List[ProductInput]) -> Dict[str, np.ndarray]:
+    """Convert a list of ProductInput rows into NumPy columns"""
+    return {
+        field: np.array([getattr(product, field) for product in products])
+        for field in ProductInput.model_fields
+    }
 
 
-# Global model instance
-model = ReturnPredictionModel()
+def round_half_even_3(values: np.ndarray) -> np.ndarray:
+    """Vectorized equivalent of Python's round(x, 3)
 
+    np.round scales by 1000 first, which can land on the other side of a .5
+    boundary than Python's correctly-rounded round(); those rare near-ties
+    are redone with the builtin.
+    """
+    rounded = np.round(values, 3)
+    scaled = values * 1000.0
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(value, 3) for value in values[near_tie].tolist()]
+    return rounded
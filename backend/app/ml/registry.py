@@ -0,0 +1,143 @@
+"""
+Lazily loaded, hot-swappable return prediction model.
+
+Artifacts written by app.ml.train live in `<MODEL_DIR>/returns_model/<version>/`
+as a raw NumPy weight vector (`coef.npy`) plus `meta.json`, and the
+`CURRENT` file names the live version. Weights are opened with
+`np.load(mmap_mode="r")`, so every uvicorn worker maps the same file and
+the OS keeps a single copy in the page cache.
+
+Nothing is loaded at import time: the first request loads the current
+version, then a daemon thread polls `CURRENT` and loads new versions off
+the request path. The swap is a single reference assignment, so requests
+already holding the old model finish on it and none are dropped.
+"""
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.config import settings
+from app.ml.features import FEATURE_VERSION
+from app.ml.model import ReturnPredictionModel
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_NAME = "returns_model"
+POINTER_FILE = "CURRENT"
+
+
+def artifact_root() -> Path:
+    return Path(settings.model_dir) / ARTIFACT_NAME
+
+
+def write_artifact(version: str, coef: np.ndarray, intercept: float, meta: dict) -> Path:
+    """Write a model version and publish it by atomically replacing CURRENT"""
+    root = artifact_root()
+    version_dir = root / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    np.save(version_dir / "coef.npy", np.ascontiguousarray(coef, dtype=np.float64))
+    with open(version_dir / "meta.json", "w") as f:
+        json.dump({**meta, "version": version, "intercept": float(intercept)}, f, indent=2)
+
+    tmp_path = root / f"{POINTER_FILE}.tmp"
+    tmp_path.write_text(version)
+    os.replace(tmp_path, root / POINTER_FILE)
+    return version_dir
+
+
+def current_version() -> Optional[str]:
+    """Version named by the CURRENT pointer, if any model has been published"""
+    try:
+        return (artifact_root() / POINTER_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_artifact(version: str) -> ReturnPredictionModel:
+    version_dir = artifact_root() / version
+    with open(version_dir / "meta.json") as f:
+        meta = json.load(f)
+    if meta.get("feature_version") != FEATURE_VERSION:
+        raise ValueError(f"artifact uses feature version {meta.get('feature_version')}, expected {FEATURE_VERSION}")
+    coef = np.load(version_dir / "coef.npy", mmap_mode="r")
+    if coef.shape != (meta["n_features"],):
+        raise ValueError(f"coef.npy has shape {coef.shape}, expected ({meta['n_features']},)")
+    return ReturnPredictionModel(coef=coef, intercept=meta["intercept"], version=version, meta=meta)
+
+
+class ModelRegistry:
+    """Holds the live model; loads it on first use and hot-swaps new versions"""
+
+    def __init__(self, poll_seconds: float = None):
+        self.poll_seconds = settings.model_poll_seconds if poll_seconds is None else poll_seconds
+        self._model: Optional[ReturnPredictionModel] = None
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # A version that failed to load isn't retried on every poll
+        self._failed_version: Optional[str] = None
+
+    def get(self) -> ReturnPredictionModel:
+        """The live model (callers should hold on to it for the whole request)"""
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load(current_version(), fallback=ReturnPredictionModel())
+                    self._start_watcher()
+                model = self._model
+        return model
+
+    def refresh(self) -> bool:
+        """Load the version named by CURRENT if it isn't live yet; True if the model changed"""
+        version = current_version()
+        live = self._model
+        if live is not None and version in (live.version, self._failed_version):
+            return False
+        with self._lock:
+            live = self._model
+            if live is not None and version in (live.version, self._failed_version):
+                return False
+            # Keep serving the previous model if the new one can't be loaded
+            model = self._load(version, fallback=live or ReturnPredictionModel())
+            changed = model is not live
+            self._model = model
+        return changed
+
+    def stop(self):
+        self._stopped.set()
+
+    def _load(self, version: Optional[str], fallback: ReturnPredictionModel) -> ReturnPredictionModel:
+        if version is None:
+            if not fallback.is_trained:
+                logger.info("No trained model found. Using heuristic.")
+            return fallback
+        try:
+            model = load_artifact(version)
+            logger.info("Loaded trained model %s", version)
+            return model
+        except Exception as e:
+            self._failed_version = version
+            logger.error("Could not load model %s: %s. Keeping %s.", version, e, fallback.version or "heuristic")
+            return fallback
+
+    def _start_watcher(self):
+        if self.poll_seconds <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_seconds):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Model refresh failed")
+
+
+registry = ModelRegistry()
@@ -0,0 +1,153 @@
+"""
+Out-of-core training for the return prediction model.
+
+Training rows follow the dbt `fct_order_items` model (order items joined to
+orders, products and users). They are streamed from a server-side cursor in
+fixed-size chunks and fed to an incrementally trained logistic regression
+(SGDClassifier.partial_fit) over hashed features, so memory is bounded by
+the chunk size and the fixed-width weight vector, not by the history size.
+
+Usage:
+    python -m app.ml.train [--chunk-rows N] [--epochs N]
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sqlalchemy import case, create_engine, func, or_, select
+
+from app.config import settings
+from app.database import engine_options
+from app.ml.features import FEATURE_VERSION, build_features
+from app.ml.registry import write_artifact
+from app.models import Order, OrderItem, Product, User
+
+# Every HOLDOUT_MODULUS-th order item (by id) is held out for evaluation
+HOLDOUT_MODULUS = 10
+
+
+def training_query():
+    """fct_order_items-shaped rows for items whose return outcome is known"""
+    is_returned = or_(OrderItem.status == "Returned", OrderItem.returned_at.isnot(None))
+    return select(
+        OrderItem.id,
+        OrderItem.sale_price.label("price"),
+        func.coalesce(OrderItem.discount / func.nullif(OrderItem.sale_price, 0) * 100.0, 0.0).label("discount_pct"),
+        Product.category,
+        Product.brand,
+        Product.department,
+        User.age.label("customer_age"),
+        User.country.label("customer_country"),
+        case((is_returned, 1), else_=0).label("is_returned")
+    ).select_from(
+        OrderItem
+    ).outerjoin(
+        Order, OrderItem.order_id == Order.id
+    ).outerjoin(
+        Product, OrderItem.product_id == Product.id
+    ).outerjoin(
+        User, OrderItem.user_id == User.id
+    ).where(
+        # Only resolved items: still-shipping ones may yet be returned
+        OrderItem.status.in_(["Complete", "Returned"]),
+        or_(Order.status.is_(None), Order.status != "Cancelled")
+    ).order_by(
+        OrderItem.id
+    )
+
+
+def _columns(rows):
+    ids, price, discount_pct, category, brand, department, age, country, label = zip(*rows)
+    return np.asarray(ids), {
+        "price": np.asarray(price, dtype=np.float64),
+        "discount_pct": np.asarray(discount_pct, dtype=np.float64),
+        "customer_age": np.asarray([np.nan if a is None else a for a in age], dtype=np.float64),
+        "category": np.asarray(category, dtype=object),
+        "brand": np.asarray(brand, dtype=object),
+        "department": np.asarray(department, dtype=object),
+        "customer_country": np.asarray(country, dtype=object),
+    }, np.asarray(label, dtype=np.int8)
+
+
+def _log_loss_sum(y: np.ndarray, p: np.ndarray) -> float:
+    p = np.clip(p, 1e-15, 1 - 1e-15)
+    return float(-(y * np.log(p) + (1 - y) * np.log(1 - p)).sum())
+
+
+def train(chunk_rows: int = None, epochs: int = 1, seed: int = 0) -> Path:
+    """Stream the training set through partial_fit and write a versioned artifact"""
+    chunk_rows = chunk_rows or settings.train_chunk_rows
+    engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+    rng = np.random.default_rng(seed)
+    # A small constant step keeps partial_fit stable when chunks arrive one at a time
+    classifier = SGDClassifier(loss="log_loss", alpha=1e-4, learning_rate="constant", eta0=0.01, random_state=seed)
+
+    trained_rows = 0
+    started = time.perf_counter()
+    for epoch in range(epochs):
+        holdout_totals = {"rows": 0, "loss": 0.0, "positives": 0}
+        pending_holdout = []
+
+        def score_holdout():
+            for holdout_features, holdout_labels in pending_holdout:
+                probabilities = classifier.predict_proba(holdout_features)[:, 1]
+                holdout_totals["loss"] += _log_loss_sum(holdout_labels, probabilities)
+                holdout_totals["rows"] += len(holdout_labels)
+                holdout_totals["positives"] += int(holdout_labels.sum())
+            pending_holdout.clear()
+
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(training_query())
+            for rows in result.partitions(chunk_rows):
+                ids, columns, labels = _columns(rows)
+                features = build_features(columns)
+                holdout = ids % HOLDOUT_MODULUS == 0
+                if holdout.any():
+                    pending_holdout.append((features[holdout], labels[holdout]))
+                if hasattr(classifier, "coef_"):
+                    # Score held-out rows before the model trains on the rest of their chunk
+                    score_holdout()
+
+                train_idx = np.flatnonzero(~holdout)
+                if len(train_idx) == 0:
+                    continue
+                # Rows stream in id (≈ time) order; shuffle within the chunk
+                rng.shuffle(train_idx)
+                classifier.partial_fit(features[train_idx], labels[train_idx], classes=[0, 1])
+                # The first chunk's held-out rows had no model to score them until now
+                score_holdout()
+                if epoch == 0:
+                    trained_rows += len(train_idx)
+        metrics = {
+            "holdout_rows": holdout_totals["rows"],
+            "holdout_log_loss": holdout_totals["loss"] / holdout_totals["rows"] if holdout_totals["rows"] else None,
+            "holdout_return_rate": holdout_totals["positives"] / holdout_totals["rows"] if holdout_totals["rows"] else None,
+        }
+        print(f"Epoch {epoch + 1}/{epochs}: trained on {trained_rows} rows, holdout {metrics}")
+
+    if not hasattr(classifier, "coef_"):
+        raise RuntimeError("No training rows found; load data with app.etl.load_thelook_csvs first")
+
+    version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    # Plain NumPy weights rather than a pickled estimator: workers mmap them (see app.ml.registry)
+    coef = classifier.coef_.ravel()
+    version_dir = write_artifact(version, coef, float(classifier.intercept_[0]), {
+        "feature_version": FEATURE_VERSION,
+        "n_features": len(coef),
+        "trained_rows": trained_rows,
+        "metrics": metrics,
+    })
+
+    print(f"Wrote {version_dir} in {time.perf_counter() - started:.1f}s")
+    return version_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the return prediction model")
+    parser.add_argument("--chunk-rows", type=int, default=None, help="rows per streamed chunk (default: TRAIN_CHUNK_ROWS)")
+    parser.add_argument("--epochs", type=int, default=1, help="passes over the training data")
+    args = parser.parse_args()
+    train(chunk_rows=args.chunk_rows, epochs=args.epochs)
@@ -1,9 +1,25 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+import hashlib
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, ForeignKeyConstraint, Boolean, Index, LargeBinary, text
+from sqlalchemy import delete, insert, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from app import partitions
 from app.database import Base
 
 
+def _partitioned_by_month() -> dict:
+    """Table options for orders and order_items: monthly range partitions on created_at when enabled"""
+    return {"postgresql_partition_by": "RANGE (created_at)"} if partitions.ENABLED else {}
+
+
+def _unless_partitioned(constraint):
+    """Skip a constraint's DDL when partitioning is on; the ORM still uses it for joins"""
+    constraint.ddl_if(callable_=lambda *args, **kwargs: not partitions.ENABLED)
+    return constraint
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -40,10 +56,11 @@ class Product(Base):
 class Order(Base):
     __tablename__ = "orders"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     status = Column(String, nullable=True)  # Completed, Returned, Cancelled, etc.
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Postgres wants the partition key in the primary key of a partitioned table
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), primary_key=partitions.ENABLED)
     shipped_at = Column(DateTime(timezone=True), nullable=True)
     delivered_at = Column(DateTime(timezone=True), nullable=True)
     returned_at = Column(DateTime(timezone=True), nullable=True)
@@ -51,21 +68,279 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
 
+    __table_args__ = _partitioned_by_month()
+    # Rows are still identified by id alone
+    __mapper_args__ = {"primary_key": [id]}
+
 
 class OrderItem(Base):
     __tablename__ = "order_items"
 
-    id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    order_id = Column(Integer, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     sale_price = Column(Float, nullable=True)
     discount = Column(Float, nullable=True)
     status = Column(String, nullable=True)  # Complete, Returned, etc.
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), primary_key=partitions.ENABLED)
     returned_at = Column(DateTime(timezone=True), nullable=True)
 
     order = relationship("Order", back_populates="order_items")
     user = relationship("User")
     product = relationship("Product", back_populates="order_items")
 
+    # Derived from the analytics, rollup refresh and training queries. INCLUDE
+    # columns let Postgres answer them with index-only scans; SQLite ignores
+    # them (and keeps the partial WHERE clauses).
+    __table_args__ = (
+        # A partitioned orders table has no unique index on id alone for this to reference
+        _unless_partitioned(ForeignKeyConstraint(["order_id"], ["orders.id"])),
+        # Completed revenue / distinct orders over a time window (revenue-over-time, daily totals)
+        Index(
+            "ix_order_items_status_created_at", "status", "created_at",
+            postgresql_include=["sale_price", "order_id"]
+        ),
+        # Every item in a day window (daily sales rollup refresh)
+        Index("ix_order_items_created_at", "created_at"),
+        # Per-product breakdowns and product rollup refresh; also backs the products FK
+        Index(
+            "ix_order_items_product_id_status", "product_id", "status",
+            postgresql_include=["sale_price", "returned_at", "id"]
+        ),
+        # Per-product return counts
+        Index(
+            "ix_order_items_product_id_returned", "product_id",
+            postgresql_where=text("status = 'Returned'"),
+            sqlite_where=text("status = 'Returned'")
+        ),
+        # Per-customer completed spend (customer breakdown, customer rollup refresh)
+        Index(
+            "ix_order_items_user_id_complete", "user_id",
+            postgresql_include=["sale_price"],
+            postgresql_where=text("status = 'Complete'"),
+            sqlite_where=text("status = 'Complete'")
+        ),
+        _partitioned_by_month(),
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+
+# Pre-aggregated rollups maintained by app.rollups
+
+
+class DailySalesRollup(Base):
+    """Order item measures per day x category x department x brand x country x age band"""
+    __tablename__ = "rollup_daily_sales"
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=True, index=True)
+    has_product = Column(Boolean, nullable=False)
+    category = Column(String, nullable=True)
+    department = Column(String, nullable=True)
+    brand = Column(String, nullable=True)
+    country = Column(String, nullable=True)
+    age_band = Column(String, nullable=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    returned_count = Column(Integer, nullable=False, default=0)  # status == Returned
+    returned_or_flagged_count = Column(Integer, nullable=False, default=0)  # Returned or returned_at set
+    complete_count = Column(Integer, nullable=False, default=0)
+    priced_complete_count = Column(Integer, nullable=False, default=0)  # complete items with a sale_price
+    revenue = Column(Float, nullable=True)  # sum of sale_price for complete items
+
+
+class DailyTotalsRollup(Base):
+    """Completed revenue and distinct order count per day"""
+    __tablename__ = "rollup_daily_totals"
+
+    day = Column(Date, primary_key=True)
+    revenue = Column(Float, nullable=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+
+class DailyBreakdownRollup(Base):
+    """Completed revenue and distinct order count per day x category and per day x department"""
+    __tablename__ = "rollup_daily_breakdown"
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=True)
+    dimension = Column(String, nullable=False)  # "category" or "department"
+    value = Column(String, nullable=True)
+    revenue = Column(Float, nullable=True)
+    order_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_rollup_daily_breakdown_dimension_day", "dimension", "day"),
+    )
+
+
+class DailySketchRollup(Base):
+    """HyperLogLog sketches of completed orders and customers per day, overall and per country / age band"""
+    __tablename__ = "rollup_daily_sketches"
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=True)
+    dimension = Column(String, nullable=False)  # "all", "country" or "age_band"
+    value = Column(String, nullable=True)  # NULL for "all"
+    orders = Column(LargeBinary, nullable=True)  # see app.sketches
+    customers = Column(LargeBinary, nullable=True)
+
+    __table_args__ = (
+        Index("ix_rollup_daily_sketches_dimension_day", "dimension", "day"),
+    )
+
+
+class ProductSalesRollup(Base):
+    """Completed item count per product, used for distinct product counts"""
+    __tablename__ = "rollup_product_sales"
+
+    product_id = Column(Integer, primary_key=True)
+    category = Column(String, nullable=True)
+    department = Column(String, nullable=True)
+    brand = Column(String, nullable=True)
+    complete_count = Column(Integer, nullable=False, default=0)
+
+
+class CustomerSalesRollup(Base):
+    """Completed item count per customer, used for distinct customer counts"""
+    __tablename__ = "rollup_customer_sales"
+
+    user_id = Column(Integer, primary_key=True)
+    country = Column(String, nullable=True)
+    age_band = Column(String, nullable=True)
+    complete_count = Column(Integer, nullable=False, default=0)
+
+
+class DataGeneration(Base):
+    """Single-row counter bumped whenever analytics source data changes"""
+    __tablename__ = "data_generation"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class EtlWatermark(Base):
+    """Per-table high-water marks for incremental ETL runs"""
+    __tablename__ = "etl_watermarks"
+
+    table_name = Column(String, primary_key=True)
+    max_id = Column(Integer, nullable=True)
+    max_changed_at = Column(DateTime(timezone=True), nullable=True)  # latest created/updated/shipped/returned timestamp seen
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ChangedProduct(Base):
+    """Products whose existing order items an incremental ETL run updated, by the data generation it published"""
+    __tablename__ = "changed_products"
+
+    generation = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+
+
+# Offline catalog scoring written by app.ml.batch_score
+
+
+class ProductReturnPrediction(Base):
+    """Latest return-risk score per product x customer segment (age band x country)"""
+    __tablename__ = "product_return_predictions"
+
+    product_id = Column(Integer, primary_key=True)
+    age_band = Column(String, primary_key=True)
+    country = Column(String, primary_key=True)
+    category = Column(String, nullable=True)
+    department = Column(String, nullable=True)
+    brand = Column(String, nullable=True)
+    price = Column(Float, nullable=True)
+    customer_age = Column(Integer, nullable=False)  # representative age scored for the segment
+    return_probability = Column(Float, nullable=False)
+    risk_label = Column(String, nullable=False)
+    run_id = Column(String, nullable=False, index=True)
+    model_version = Column(String, nullable=True)  # NULL: heuristic fallback
+    scored_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Riskiest products, overall and per segment
+        Index("ix_product_return_predictions_probability", "return_probability"),
+        Index("ix_product_return_predictions_segment", "age_band", "country", "return_probability"),
+    )
+
+
+class PredictionRun(Base):
+    """One batch scoring run; what it scores is fixed at the start so it can resume"""
+    __tablename__ = "prediction_runs"
+
+    id = Column(String, primary_key=True)
+    model_version = Column(String, nullable=True)
+    discount_pct = Column(Float, nullable=False, default=0.0)
+    chunk_products = Column(Integer, nullable=False)  # chunk = product_id // chunk_products
+    segments = Column(String, nullable=False)  # JSON [[age_band, country, customer_age], ...]
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class PredictionRunChunk(Base):
+    """A product id range a run has scored and written (committed with its predictions)"""
+    __tablename__ = "prediction_run_chunks"
+
+    run_id = Column(String, ForeignKey("prediction_runs.id"), primary_key=True)
+    chunk = Column(Integer, primary_key=True)
+    rows = Column(Integer, nullable=False, default=0)
+    finished_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SchemaVersion(Base):
+    """Fingerprint of the schema create_schema last applied, so startup can skip the DDL checks"""
+    __tablename__ = "schema_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+# pg_advisory_xact_lock key serializing schema setup across workers
+SCHEMA_LOCK_KEY = 4815162342
+
+
+def create_schema(bind):
+    """Create missing tables, plus indexes added to already existing tables"""
+    Base.metadata.create_all(bind=bind)
+    # create_all skips existing tables entirely, including any new indexes on them
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    # Partitioned tables take rows only once they have partitions
+    partitions.ensure_future_partitions(bind)
+
+
+def schema_fingerprint(dialect) -> str:
+    """Hash of the DDL for every table and index, as this dialect would emit it"""
+    ddl = []
+    for table in Base.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl += sorted(str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes)
+    return hashlib.sha1("\n".join(ddl).encode()).hexdigest()[:16]
+
+
+def _stored_version(conn):
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return None
+    return conn.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+
+
+def ensure_schema(bind: Engine) -> bool:
+    """Run create_schema unless the database already has this schema version; True if DDL ran"""
+    version = schema_fingerprint(bind.dialect)
+    with bind.connect() as conn:
+        if _stored_version(conn) == version:
+            return False
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Workers starting together wait here; all but the first then find the new version
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            if _stored_version(conn) == version:
+                return False
+        create_schema(conn)
+        conn.execute(delete(SchemaVersion))
+        conn.execute(insert(SchemaVersion).values(id=1, version=version))
+    return True
@@ -0,0 +1,184 @@
+"""
+Full revenue breakdowns by brand and by country, one page at a time.
+
+GET /analytics/revenue-by-brand and /revenue-by-country return only the
+top `limit` groups. Their /page variants walk the whole breakdown with
+keyset pagination. Groups are ordered by revenue in whole cents,
+descending, then by key. Each page ends with an opaque cursor holding
+the last group's (cents, key), and the next page asks the database only
+for groups after that pair. So page 1,000 costs the same as page 1,
+where OFFSET would aggregate and then skip every earlier group again.
+
+The ordering compares cents rather than the float sums. A float sum can
+change in its last bits with summation order (e.g. parallel aggregation),
+which would make the cursor's revenue compare unequal to its own group.
+
+With rollups on, revenue comes from `rollup_daily_sales`, product counts
+from `rollup_product_sales` and customer counts from
+`rollup_customer_sales`. Otherwise both come from the raw order items,
+or from the dbt fact table when FCT_ORDER_ITEMS_TABLE is set.
+The counts are joined on with plain equality (a NULL brand is keyed as
+''), so Postgres can hash join them. Pages always read the database,
+whatever ANALYTICS_BACKEND is.
+
+A cursor is only a position. If the ETL loads new data between two
+pages, the later pages carry on from that position in the new totals.
+"""
+import base64
+import binascii
+import functools
+import json
+from typing import NamedTuple, Optional, Tuple
+
+from sqlalchemy import BigInteger, and_, bindparam, cast, func, or_, select
+
+from app import facts
+from app.config import settings
+from app.models import CustomerSalesRollup, DailySalesRollup, OrderItem, Product, ProductSalesRollup, User
+
+BREAKDOWNS = ("brand", "country")
+# Name of each breakdown's count column in responses and exports
+COUNT_COLUMNS = {"brand": "product_count", "country": "customer_count"}
+
+
+class Cursor(NamedTuple):
+    """Position after the last group of a page"""
+    cents: int
+    key: str
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode()
+
+
+def decode_cursor(token: str) -> Cursor:
+    """Parse a cursor from a previous page; raises ValueError if it isn't one"""
+    try:
+        cents, key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(cents, int) or isinstance(cents, bool) or not isinstance(key, str):
+        raise ValueError("Invalid cursor")
+    return Cursor(cents, key)
+
+
+def _brand_groups():
+    """(key, revenue, count) per brand with completed items whose product exists"""
+    if not settings.use_rollups and facts.enabled():
+        fct = facts.fct
+        brand = func.coalesce(fct.brand, "")
+        return select(
+            brand.label("key"),
+            func.sum(fct.sale_price).label("revenue"),
+            func.count(func.distinct(fct.product_id)).label("count")
+        ).where(fct.item_status == "Complete", fct.has_product).group_by(brand)
+    if not settings.use_rollups:
+        brand = func.coalesce(Product.brand, "")
+        return select(
+            brand.label("key"),
+            func.sum(OrderItem.sale_price).label("revenue"),
+            func.count(func.distinct(Product.id)).label("count")
+        ).select_from(OrderItem).join(
+            Product, OrderItem.product_id == Product.id
+        ).where(OrderItem.status == "Complete").group_by(brand)
+
+    brand = func.coalesce(DailySalesRollup.brand, "")
+    sales = select(
+        brand.label("key"),
+        func.sum(DailySalesRollup.revenue).label("revenue")
+    ).where(
+        DailySalesRollup.has_product
+    ).group_by(brand).having(func.sum(DailySalesRollup.complete_count) > 0).subquery()
+    product_brand = func.coalesce(ProductSalesRollup.brand, "")
+    products = select(
+        product_brand.label("key"),
+        func.count(ProductSalesRollup.product_id).label("count")
+    ).where(ProductSalesRollup.complete_count > 0).group_by(product_brand).subquery()
+    return select(
+        sales.c.key, sales.c.revenue, func.coalesce(products.c.count, 0).label("count")
+    ).outerjoin(products, sales.c.key == products.c.key)
+
+
+def _country_groups():
+    """(key, revenue, count) per known country with completed items"""
+    if not settings.use_rollups and facts.enabled():
+        fct = facts.fct
+        return select(
+            fct.customer_country.label("key"),
+            func.sum(fct.sale_price).label("revenue"),
+            func.count(func.distinct(fct.user_id)).label("count")
+        ).where(
+            fct.item_status == "Complete", fct.customer_country.isnot(None)
+        ).group_by(fct.customer_country)
+    if not settings.use_rollups:
+        return select(
+            User.country.label("key"),
+            func.sum(OrderItem.sale_price).label("revenue"),
+            func.count(func.distinct(User.id)).label("count")
+        ).join(
+            OrderItem, OrderItem.user_id == User.id
+        ).where(OrderItem.status == "Complete", User.country.isnot(None)).group_by(User.country)
+
+    sales = select(
+        DailySalesRollup.country.label("key"),
+        func.sum(DailySalesRollup.revenue).label("revenue")
+    ).where(
+        DailySalesRollup.complete_count > 0, DailySalesRollup.country.isnot(None)
+    ).group_by(DailySalesRollup.country).subquery()
+    customers = select(
+        CustomerSalesRollup.country.label("key"),
+        func.count(CustomerSalesRollup.user_id).label("count")
+    ).where(
+        CustomerSalesRollup.complete_count > 0, CustomerSalesRollup.country.isnot(None)
+    ).group_by(CustomerSalesRollup.country).subquery()
+    return select(sales.c.key, sales.c.revenue, customers.c.count).join(customers, sales.c.key == customers.c.key)
+
+
+_GROUPS = {"brand": _brand_groups, "country": _country_groups}
+
+
+def _ranked(breakdown: str):
+    """The breakdown's groups with their revenue in cents, and its ORDER BY"""
+    groups = _GROUPS[breakdown]().subquery()
+    revenue = func.coalesce(groups.c.revenue, 0.0)
+    cents = cast(func.round(revenue * 100), BigInteger)
+    return groups, revenue, cents, (cents.desc(), groups.c.key)
+
+
+@functools.lru_cache()
+def page_select(breakdown: str, after_cursor: bool):
+    """One page of (key, revenue, count, cents) rows; the limit and cursor are bound parameters"""
+    groups, revenue, cents, ordering = _ranked(breakdown)
+    statement = select(groups.c.key, revenue.label("revenue"), groups.c.count, cents.label("cents"))
+    if after_cursor:
+        statement = statement.where(or_(
+            cents < bindparam("cents"),
+            and_(cents == bindparam("cents"), groups.c.key > bindparam("key"))
+        ))
+    return statement.order_by(*ordering).limit(bindparam("limit"))
+
+
+def page_params(cursor: Optional[Cursor], limit: int) -> dict:
+    # One row past the page tells whether there is a next page
+    params = {"limit": limit + 1}
+    if cursor is not None:
+        params.update(cents=cursor.cents, key=cursor.key)
+    return params
+
+
+def split_page(rows, limit: int) -> Tuple[list, Optional[str]]:
+    """A page's rows and the cursor for the page after it (None on the last page)"""
+    if len(rows) <= limit:
+        return list(rows), None
+    last = rows[limit - 1]
+    return list(rows[:limit]), encode_cursor(Cursor(int(last.cents), last.key))
+
+
+def export_select(breakdown: str):
+    """The whole breakdown in page order, with the columns of the breakdown endpoint"""
+    groups, revenue, _, ordering = _ranked(breakdown)
+    return select(
+        func.coalesce(func.nullif(groups.c.key, ""), "Unknown").label(breakdown),
+        revenue.label("revenue"),
+        groups.c.count.label(COUNT_COLUMNS[breakdown])
+    ).order_by(*ordering)
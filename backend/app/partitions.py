@@ -0,0 +1,317 @@
+"""
+Monthly range partitioning of `orders` and `order_items` on created_at (Postgres).
+
+With PARTITION_BY_MONTH=true and a Postgres DATABASE_URL, both tables are
+created PARTITION BY RANGE (created_at), with one partition per calendar
+month (UTC) named `<table>_pYYYY_MM`, plus a `<table>_default` partition for
+rows no month partition covers. Partitions are created:
+
+- by create_schema and at API startup: the current month and the
+  PARTITION_MONTHS_AHEAD months after it
+- by the ETL before each load: every month in the rows being loaded, so
+  COPY and INSERT into the parent route each row to its month's partition
+- by `python -m app.partitions`, which can run from cron
+
+Creating a month whose rows already sit in the default partition moves
+them into the new partition in the same transaction.
+
+The planner skips partitions only for filters that compare created_at
+itself with a constant or bound parameter (`created_at >= :start`). It
+can't skip them for filters on an expression of it (`date(created_at) =
+...`). The API's time windows (revenue over time, time series, the cube,
+rollup refreshes) are written the first way, so a 30-day window reads at
+most two month partitions.
+
+Postgres requires the partition key in every unique index, which costs:
+
+- The primary key is (id, created_at). ids stay unique because the loader
+  and sequence assign them. The ETL's upserts still match rows by id: a
+  row whose created_at changes in the source has its old version deleted
+  before the new one is inserted (see app.etl.copy_loader.upsert_dataframe).
+- order_items.order_id has no foreign key to orders, since no unique index
+  on orders.id alone can exist. The ORM relationship is unchanged.
+- Lookups and joins by id alone probe every partition's index.
+
+Existing heap tables aren't converted by create_schema. Run
+`python -m app.partitions --convert` once, in a maintenance window: it
+rewrites each table under an exclusive lock, then vacuums it. Views on the
+tables (the dbt staging views) have to be dropped first and rebuilt after.
+
+`--detach-before YYYY-MM` detaches the partitions of earlier months. That
+is a catalog change: no rows are copied or deleted, and the parent is
+locked only briefly. A detached partition is a plain table with the same
+rows. Dump and drop it, move it with `--archive-schema`, or attach it
+again. The rollups keep detached months' totals until their next full
+rebuild.
+"""
+import argparse
+import logging
+import re
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Set
+
+import pandas as pd
+from sqlalchemy import Table, text
+from sqlalchemy.engine import Connection, make_url
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("orders", "order_items")
+# Whether the models declare the partitioned layout (read at import, like the rest of the schema)
+ENABLED = settings.partition_by_month and make_url(settings.database_url).get_backend_name() == "postgresql"
+# pg_advisory_xact_lock key serializing partition creation across ETL tasks and workers
+PARTITION_LOCK_KEY = 4815162343
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+def _bound(month: date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+@contextmanager
+def _transaction(bind):
+    if isinstance(bind, Connection):
+        yield bind
+    else:
+        with bind.begin() as conn:
+            yield conn
+
+
+def is_partitioned(conn: Connection, table_name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": table_name}).first() is not None
+
+
+def existing_months(conn: Connection, table_name: str) -> Set[date]:
+    """Months that have a partition of this table"""
+    names = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:table)"
+    ), {"table": table_name}).scalars()
+    pattern = re.compile(rf"^{re.escape(table_name)}_p(\d{{4}})_(\d{{2}})$")
+    return {date(int(m.group(1)), int(m.group(2)), 1) for m in map(pattern.match, names) if m}
+
+
+def _create_default(conn: Connection, table_name: str):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table_name}_default PARTITION OF {table_name} DEFAULT"))
+
+
+def create_partition(conn: Connection, table_name: str, month: date):
+    """Create one month's partition, moving over any of its rows from the default partition"""
+    name, default = partition_name(table_name, month), f"{table_name}_default"
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    in_month = f"created_at >= {lower} AND created_at < {upper}"
+    if conn.execute(text(f"SELECT 1 FROM {default} WHERE {in_month} LIMIT 1")).first() is None:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table_name} FOR VALUES FROM ({lower}) TO ({upper})"))
+        return
+    # Postgres won't add a partition whose range still has rows in the default one
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table_name} INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE {in_month} RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ))
+    conn.execute(text(f"ALTER TABLE {table_name} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+
+
+def _ensure(conn: Connection, table_name: str, months: Iterable[date]) -> List[str]:
+    if not is_partitioned(conn, table_name):
+        logger.warning("%s isn't partitioned yet; run python -m app.partitions --convert", table_name)
+        return []
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    _create_default(conn, table_name)
+    created = []
+    for month in sorted(set(months) - existing_months(conn, table_name)):
+        create_partition(conn, table_name, month)
+        created.append(partition_name(table_name, month))
+    return created
+
+
+def load_months(timestamps) -> Set[date]:
+    """UTC months of a column of timestamps, ignoring missing ones"""
+    values = pd.to_datetime(pd.Series(timestamps), utc=True, errors="coerce").dropna()
+    return {date(int(key) // 100, int(key) % 100, 1) for key in pd.unique(values.dt.year * 100 + values.dt.month)}
+
+
+def ensure_partitions(bind, table_name: str, timestamps) -> List[str]:
+    """Create the partitions a batch of rows with these created_at values routes to"""
+    if not ENABLED or table_name not in PARTITIONED_TABLES:
+        return []
+    with _transaction(bind) as conn:
+        return _ensure(conn, table_name, load_months(timestamps))
+
+
+def ensure_future_partitions(bind, months_ahead: int = None) -> List[str]:
+    """Create the default partitions and those from this month to months_ahead months ahead"""
+    if not ENABLED:
+        return []
+    months_ahead = settings.partition_months_ahead if months_ahead is None else months_ahead
+    this_month = month_start(datetime.now(timezone.utc))
+    months = [add_months(this_month, offset) for offset in range(months_ahead + 1)]
+    with _transaction(bind) as conn:
+        return [name for table_name in PARTITIONED_TABLES for name in _ensure(conn, table_name, months)]
+
+
+def _strip_heap(conn: Connection, table_name: str, heap_name: str):
+    """Rename a heap table out of the way and drop the constraints, indexes and sequence whose names it holds"""
+    conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {heap_name}"))
+    constraints = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table) AND contype IN ('p', 'u', 'f')"
+    ), {"table": heap_name}).scalars().all()
+    for constraint in constraints:
+        # CASCADE also drops foreign keys referencing it (order_items.order_id -> orders.id)
+        conn.execute(text(f'ALTER TABLE {heap_name} DROP CONSTRAINT IF EXISTS "{constraint}" CASCADE'))
+    indexes = conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema()"
+    ), {"table": heap_name}).scalars().all()
+    for index in indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index}"'))
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": heap_name}).scalar()
+    if sequence:
+        conn.execute(text(f"ALTER TABLE {heap_name} ALTER COLUMN id DROP DEFAULT"))
+        conn.execute(text(f"DROP SEQUENCE {sequence}"))
+
+
+def _dependent_views(conn: Connection, table_name: str) -> List[str]:
+    return conn.execute(text(
+        "SELECT DISTINCT view.oid::regclass::text FROM pg_depend "
+        "JOIN pg_rewrite ON pg_rewrite.oid = pg_depend.objid "
+        "JOIN pg_class view ON view.oid = pg_rewrite.ev_class "
+        "WHERE pg_depend.refobjid = to_regclass(:table) AND view.oid <> pg_depend.refobjid"
+    ), {"table": table_name}).scalars().all()
+
+
+def convert(bind, tables: Dict[str, Table], months_ahead: int = None) -> List[str]:
+    """Rebuild existing heap orders / order_items tables as partitioned ones, keeping their rows
+
+    `tables` is the models' metadata.tables, whose definitions are created.
+    """
+    converted = []
+    with _transaction(bind) as conn:
+        # Views would keep pointing at the old tables, which are dropped
+        views = [view for table_name in PARTITIONED_TABLES for view in _dependent_views(conn, table_name)]
+        if views:
+            raise RuntimeError(
+                f"Drop the views on orders / order_items first, and recreate them afterwards (dbt run): {sorted(views)}"
+            )
+        for table_name in PARTITIONED_TABLES:
+            table = tables[table_name]
+            if conn.execute(text("SELECT to_regclass(:table)"), {"table": table_name}).scalar() is None:
+                continue
+            if is_partitioned(conn, table_name):
+                continue
+            heap_name = f"{table_name}_unpartitioned"
+            conn.execute(text(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE"))
+            _strip_heap(conn, table_name, heap_name)
+            table.create(bind=conn)
+            months = conn.execute(text(
+                f"SELECT DISTINCT CAST(date_trunc('month', created_at AT TIME ZONE 'UTC') AS date) "
+                f"FROM {heap_name} WHERE created_at IS NOT NULL"
+            )).scalars().all()
+            _ensure(conn, table_name, months)
+            columns = ", ".join(column.name for column in table.columns)
+            conn.execute(text(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM {heap_name}"))
+            conn.execute(text(f"DROP TABLE {heap_name}"))
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                f"coalesce((SELECT max(id) FROM {table_name}), 0) + 1, false)"
+            ))
+            converted.append(table_name)
+    ensure_future_partitions(bind, months_ahead)
+    return converted
+
+
+def detach_partitions(bind, before: date, archive_schema: str = None) -> List[str]:
+    """Detach every month partition older than `before`, optionally moving it to another schema"""
+    if not ENABLED:
+        return []
+    detached = []
+    with _transaction(bind) as conn:
+        if archive_schema:
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+        for table_name in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table_name):
+                continue
+            for month in sorted(existing_months(conn, table_name)):
+                if month >= before:
+                    break
+                name = partition_name(table_name, month)
+                conn.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+                if archive_schema:
+                    conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {archive_schema}"))
+                detached.append(name)
+    return detached
+
+
+def _month_arg(value: str) -> date:
+    return month_start(datetime.strptime(value, "%Y-%m"))
+
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+
+    from app.cache import bump_generation
+    from app.database import engine_options
+    from app.models import Base
+
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of orders and order_items")
+    parser.add_argument(
+        "--months-ahead",
+        type=int,
+        default=None,
+        help="months after the current one to create partitions for (default: PARTITION_MONTHS_AHEAD)"
+    )
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="rebuild existing unpartitioned tables as partitioned ones (exclusive lock; rewrites every row)"
+    )
+    parser.add_argument(
+        "--detach-before",
+        type=_month_arg,
+        default=None,
+        metavar="YYYY-MM",
+        help="detach the partitions of months before this one"
+    )
+    parser.add_argument(
+        "--archive-schema",
+        default=None,
+        help="schema to move detached partitions into"
+    )
+    args = parser.parse_args()
+
+    if not ENABLED:
+        print("Partitioning is off: set PARTITION_BY_MONTH=true with a Postgres DATABASE_URL")
+        raise SystemExit(1)
+    engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+    if args.convert:
+        converted = convert(engine, Base.metadata.tables, args.months_ahead)
+        print(f"Converted: {', '.join(converted) or 'nothing to convert'}")
+        # Fresh stats, and a visibility map so index-only scans skip the rewritten heap again
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table_name in converted:
+                conn.execute(text(f"VACUUM ANALYZE {table_name}"))
+    created = ensure_future_partitions(engine, args.months_ahead)
+    print(f"Created partitions: {', '.join(created) or 'none needed'}")
+    if args.detach_before:
+        detached = detach_partitions(engine, args.detach_before, args.archive_schema)
+        print(f"Detached partitions: {', '.join(detached) or 'none'}")
+        if detached:
+            # Raw-table analytics change; invalidate cached responses in every API worker
+            with engine.begin() as conn:
+                bump_generation(conn)
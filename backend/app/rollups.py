@@ -0,0 +1,466 @@
+"""
+Incrementally maintained rollup tables for the analytics endpoints.
+
+The rollups are keyed by day (and by product / customer for the distinct
+counts), so a batch of new order items only touches the buckets it falls
+into. Affected buckets are recomputed from the raw tables, which keeps the
+refresh idempotent and exact.
+
+Usage:
+    python -m app.rollups          # full rebuild
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import and_, case, delete, event, func, insert, literal, select, union_all
+from sqlalchemy.engine import Connection, Engine
+
+from app import sketches
+from app.cache import bump_generation
+from app.database import SessionLocal, engine as default_engine
+from app.models import (
+    OrderItem, Product, User, create_schema,
+    DailySalesRollup, DailyTotalsRollup, DailyBreakdownRollup, DailySketchRollup,
+    ProductSalesRollup, CustomerSalesRollup
+)
+
+# Above this many affected products/customers a full rebuild is one scan
+# instead of many IN (...) scans.
+FULL_REBUILD_THRESHOLD = 5000
+ID_CHUNK_SIZE = 1000
+
+
+def age_band(age):
+    """Age band expression shared with dim_customer (NULL when age is unknown)"""
+    return case(
+        (age.is_(None), None),
+        (age < 18, "Under 18"),
+        (age < 25, "18-24"),
+        (age < 35, "25-34"),
+        (age < 45, "35-44"),
+        (age < 55, "45-54"),
+        (age < 65, "55-64"),
+        else_="65+"
+    )
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _daily_sales_select():
+    is_complete = OrderItem.status == "Complete"
+    is_returned = OrderItem.status == "Returned"
+    day = func.date(OrderItem.created_at)
+    has_product = Product.id.isnot(None)
+    band = age_band(User.age)
+    return select(
+        day,
+        has_product,
+        Product.category,
+        Product.department,
+        Product.brand,
+        User.country,
+        band,
+        func.count(OrderItem.id),
+        _count_if(is_returned),
+        _count_if(is_returned | OrderItem.returned_at.isnot(None)),
+        _count_if(is_complete),
+        _count_if(is_complete & OrderItem.sale_price.isnot(None)),
+        func.sum(case((is_complete, OrderItem.sale_price)))
+    ).select_from(
+        OrderItem
+    ).outerjoin(
+        Product, OrderItem.product_id == Product.id
+    ).outerjoin(
+        User, OrderItem.user_id == User.id
+    ).group_by(
+        day, has_product, Product.category, Product.department, Product.brand, User.country, band
+    )
+
+
+def _daily_totals_select():
+    day = func.date(OrderItem.created_at)
+    return select(
+        day,
+        func.sum(OrderItem.sale_price),
+        func.count(func.distinct(OrderItem.order_id))
+    ).where(
+        OrderItem.status == "Complete",
+        OrderItem.created_at.isnot(None)
+    ).group_by(day)
+
+
+# Columns the time series can break down by (see app.timeseries)
+BREAKDOWN_DIMENSIONS = {"category": Product.category, "department": Product.department}
+
+
+def _daily_breakdown_select(window=None):
+    day = func.date(OrderItem.created_at)
+    selects = []
+    for dimension, column in BREAKDOWN_DIMENSIONS.items():
+        stmt = select(
+            day,
+            literal(dimension),
+            column,
+            func.sum(OrderItem.sale_price),
+            func.count(func.distinct(OrderItem.order_id))
+        ).select_from(
+            OrderItem
+        ).outerjoin(
+            Product, OrderItem.product_id == Product.id
+        ).where(
+            OrderItem.status == "Complete",
+            OrderItem.created_at.isnot(None)
+        ).group_by(day, column)
+        if window is not None:
+            stmt = stmt.where(window)
+        selects.append(stmt)
+    return union_all(*selects)
+
+
+# Dimensions with a sketch per day and value, besides the overall ("all") sketch per day
+SKETCH_DIMENSIONS = ("country", "age_band")
+
+
+def _sketch_source_select(window=None):
+    stmt = select(
+        func.date(OrderItem.created_at),
+        User.country,
+        age_band(User.age),
+        OrderItem.order_id,
+        User.id
+    ).select_from(
+        OrderItem
+    ).outerjoin(
+        User, OrderItem.user_id == User.id
+    ).where(
+        OrderItem.status == "Complete",
+        OrderItem.created_at.isnot(None)
+    )
+    if window is not None:
+        stmt = stmt.where(window)
+    return stmt
+
+
+def _insert_sketches(conn: Connection, window=None):
+    """Sketch the completed orders and customers of each day (in the window) and insert them"""
+    frame = pd.DataFrame(
+        conn.execute(_sketch_source_select(window)).all(),
+        columns=["day", "country", "age_band", "order_id", "user_id"]
+    )
+    if frame.empty:
+        return
+    # SQLite returns DATE expressions as strings
+    frame["day"] = pd.to_datetime(frame["day"]).dt.date
+    rows = []
+    for dimension in ("all",) + SKETCH_DIMENSIONS:
+        keys = frame[["day"]] if dimension == "all" else frame[["day", dimension]]
+        orders = sketches.build(keys, frame["order_id"])
+        customers = sketches.build(keys, frame["user_id"])
+        for key in orders.keys() | customers.keys():
+            day, value = (key, None) if dimension == "all" else key
+            rows.append({
+                "day": day,
+                "dimension": dimension,
+                "value": None if pd.isna(value) else value,
+                "orders": orders.get(key),
+                "customers": customers.get(key),
+            })
+    for start in range(0, len(rows), ID_CHUNK_SIZE):
+        conn.execute(insert(DailySketchRollup), rows[start:start + ID_CHUNK_SIZE])
+
+
+def _product_sales_select(product_ids=None):
+    stmt = select(
+        Product.id,
+        Product.category,
+        Product.department,
+        Product.brand,
+        func.count(OrderItem.id)
+    ).join(
+        OrderItem, OrderItem.product_id == Product.id
+    ).where(
+        OrderItem.status == "Complete"
+    ).group_by(Product.id, Product.category, Product.department, Product.brand)
+    if product_ids is not None:
+        # Filter both sides: the planner doesn't carry IN lists across the join
+        stmt = stmt.where(Product.id.in_(product_ids), OrderItem.product_id.in_(product_ids))
+    return stmt
+
+
+def _customer_sales_select(user_ids=None):
+    band = age_band(User.age)
+    stmt = select(
+        User.id,
+        User.country,
+        band,
+        func.count(OrderItem.id)
+    ).join(
+        OrderItem, OrderItem.user_id == User.id
+    ).where(
+        OrderItem.status == "Complete"
+    ).group_by(User.id, User.country, band)
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(user_ids), OrderItem.user_id.in_(user_ids))
+    return stmt
+
+
+_DAILY_SALES_COLUMNS = [
+    "day", "has_product", "category", "department", "brand", "country", "age_band",
+    "item_count", "returned_count", "returned_or_flagged_count", "complete_count",
+    "priced_complete_count", "revenue",
+]
+_DAILY_TOTALS_COLUMNS = ["day", "revenue", "order_count"]
+_DAILY_BREAKDOWN_COLUMNS = ["day", "dimension", "value", "revenue", "order_count"]
+_PRODUCT_SALES_COLUMNS = ["product_id", "category", "department", "brand", "complete_count"]
+_CUSTOMER_SALES_COLUMNS = ["user_id", "country", "age_band", "complete_count"]
+
+
+def _day_ranges(days: Iterable[date]) -> List[Tuple[date, date]]:
+    """Collapse days into inclusive contiguous ranges"""
+    ranges = []
+    for day in sorted(set(days)):
+        if ranges and day - ranges[-1][1] <= timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _chunks(values, size: int = ID_CHUNK_SIZE):
+    values = sorted(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _rebuild_all(conn: Connection):
+    conn.execute(delete(DailySalesRollup))
+    conn.execute(insert(DailySalesRollup).from_select(_DAILY_SALES_COLUMNS, _daily_sales_select()))
+    conn.execute(delete(DailyTotalsRollup))
+    conn.execute(insert(DailyTotalsRollup).from_select(_DAILY_TOTALS_COLUMNS, _daily_totals_select()))
+    conn.execute(delete(DailyBreakdownRollup))
+    conn.execute(insert(DailyBreakdownRollup).from_select(_DAILY_BREAKDOWN_COLUMNS, _daily_breakdown_select()))
+    conn.execute(delete(DailySketchRollup))
+    _insert_sketches(conn)
+    _rebuild_products(conn)
+    _rebuild_customers(conn)
+
+
+def _rebuild_products(conn: Connection):
+    conn.execute(delete(ProductSalesRollup))
+    conn.execute(insert(ProductSalesRollup).from_select(_PRODUCT_SALES_COLUMNS, _product_sales_select()))
+
+
+def _rebuild_customers(conn: Connection):
+    conn.execute(delete(CustomerSalesRollup))
+    conn.execute(insert(CustomerSalesRollup).from_select(_CUSTOMER_SALES_COLUMNS, _customer_sales_select()))
+
+
+def _refresh_days(conn: Connection, days: Iterable[date]):
+    for first, last in _day_ranges(days):
+        window = and_(
+            OrderItem.created_at >= datetime.combine(first, time.min),
+            OrderItem.created_at < datetime.combine(last + timedelta(days=1), time.min)
+        )
+        conn.execute(delete(DailySalesRollup).where(DailySalesRollup.day.between(first, last)))
+        conn.execute(insert(DailySalesRollup).from_select(
+            _DAILY_SALES_COLUMNS, _daily_sales_select().where(window)
+        ))
+        conn.execute(delete(DailyTotalsRollup).where(DailyTotalsRollup.day.between(first, last)))
+        conn.execute(insert(DailyTotalsRollup).from_select(
+            _DAILY_TOTALS_COLUMNS, _daily_totals_select().where(window)
+        ))
+        conn.execute(delete(DailyBreakdownRollup).where(DailyBreakdownRollup.day.between(first, last)))
+        conn.execute(insert(DailyBreakdownRollup).from_select(
+            _DAILY_BREAKDOWN_COLUMNS, _daily_breakdown_select(window)
+        ))
+        conn.execute(delete(DailySketchRollup).where(DailySketchRollup.day.between(first, last)))
+        _insert_sketches(conn, window)
+
+
+def _refresh_products(conn: Connection, product_ids: Iterable[int]):
+    for chunk in _chunks(product_ids):
+        conn.execute(delete(ProductSalesRollup).where(ProductSalesRollup.product_id.in_(chunk)))
+        conn.execute(insert(ProductSalesRollup).from_select(
+            _PRODUCT_SALES_COLUMNS, _product_sales_select(chunk)
+        ))
+
+
+def _refresh_customers(conn: Connection, user_ids: Iterable[int]):
+    for chunk in _chunks(user_ids):
+        conn.execute(delete(CustomerSalesRollup).where(CustomerSalesRollup.user_id.in_(chunk)))
+        conn.execute(insert(CustomerSalesRollup).from_select(
+            _CUSTOMER_SALES_COLUMNS, _customer_sales_select(chunk)
+        ))
+
+
+def rebuild_rollups(bind: Optional[Engine] = None):
+    """Recompute every rollup table from the raw tables"""
+    bind = bind or default_engine
+    with bind.begin() as conn:
+        _rebuild_all(conn)
+        bump_generation(conn)
+
+
+def refresh_rollups(
+    bind: Optional[Engine] = None,
+    days: Iterable[date] = (),
+    product_ids: Iterable[int] = (),
+    user_ids: Iterable[int] = ()
+):
+    """Recompute only the rollup buckets touched by new or changed order items"""
+    bind = bind or default_engine
+    # Widen by a day on each side: the rollups bucket by the database session's
+    # time zone, which may differ from the caller's.
+    padded_days = set()
+    for day in days:
+        if day is not None:
+            padded_days.update((day - timedelta(days=1), day, day + timedelta(days=1)))
+    product_ids = {int(pid) for pid in product_ids if pid is not None}
+    user_ids = {int(uid) for uid in user_ids if uid is not None}
+
+    with bind.begin() as conn:
+        if padded_days:
+            _refresh_days(conn, padded_days)
+        if len(product_ids) > FULL_REBUILD_THRESHOLD:
+            _rebuild_products(conn)
+        elif product_ids:
+            _refresh_products(conn, product_ids)
+        if len(user_ids) > FULL_REBUILD_THRESHOLD:
+            _rebuild_customers(conn)
+        elif user_ids:
+            _refresh_customers(conn, user_ids)
+        bump_generation(conn)
+
+
+# Reads ---------------------------------------------------------------------
+
+
+def product_breakdown_select():
+    """Rollup equivalent of the raw per (category, department, brand) breakdown"""
+    sales = select(
+        DailySalesRollup.has_product,
+        DailySalesRollup.category,
+        DailySalesRollup.department,
+        DailySalesRollup.brand,
+        func.sum(DailySalesRollup.item_count).label("total_items"),
+        func.sum(DailySalesRollup.returned_count).label("returned_items"),
+        func.sum(DailySalesRollup.returned_or_flagged_count).label("returned_or_flagged"),
+        func.sum(DailySalesRollup.complete_count).label("complete_items"),
+        func.sum(DailySalesRollup.revenue).label("revenue")
+    ).group_by(
+        DailySalesRollup.has_product,
+        DailySalesRollup.category,
+        DailySalesRollup.department,
+        DailySalesRollup.brand
+    ).subquery()
+    products = select(
+        ProductSalesRollup.category,
+        ProductSalesRollup.department,
+        ProductSalesRollup.brand,
+        func.count(ProductSalesRollup.product_id).label("product_count")
+    ).where(
+        ProductSalesRollup.complete_count > 0
+    ).group_by(
+        ProductSalesRollup.category,
+        ProductSalesRollup.department,
+        ProductSalesRollup.brand
+    ).subquery()
+    return select(
+        sales,
+        func.coalesce(products.c.product_count, 0).label("product_count")
+    ).outerjoin(
+        products,
+        and_(
+            sales.c.has_product,
+            sales.c.category.is_not_distinct_from(products.c.category),
+            sales.c.department.is_not_distinct_from(products.c.department),
+            sales.c.brand.is_not_distinct_from(products.c.brand)
+        )
+    )
+
+
+def customer_breakdown_select():
+    """Rollup equivalent of the raw per (age range, country) breakdown"""
+    sales = select(
+        DailySalesRollup.age_band.label("age_range"),
+        DailySalesRollup.country,
+        func.sum(DailySalesRollup.priced_complete_count).label("priced_items"),
+        func.sum(DailySalesRollup.revenue).label("revenue")
+    ).where(
+        DailySalesRollup.complete_count > 0
+    ).group_by(
+        DailySalesRollup.age_band,
+        DailySalesRollup.country
+    ).subquery()
+    customers = select(
+        CustomerSalesRollup.age_band,
+        CustomerSalesRollup.country,
+        func.count(CustomerSalesRollup.user_id).label("customer_count")
+    ).where(
+        CustomerSalesRollup.complete_count > 0
+    ).group_by(
+        CustomerSalesRollup.age_band,
+        CustomerSalesRollup.country
+    ).subquery()
+    return select(
+        sales.c.age_range,
+        sales.c.country,
+        func.coalesce(customers.c.customer_count, 0).label("customer_count"),
+        sales.c.priced_items,
+        sales.c.revenue
+    ).join(
+        customers,
+        and_(
+            sales.c.age_range.is_not_distinct_from(customers.c.age_band),
+            sales.c.country.is_not_distinct_from(customers.c.country)
+        )
+    )
+
+
+def daily_totals_select(after: date):
+    """Daily completed revenue and order counts for days strictly after `after`"""
+    return select(
+        DailyTotalsRollup.day,
+        DailyTotalsRollup.revenue,
+        DailyTotalsRollup.order_count
+    ).where(
+        DailyTotalsRollup.day > after
+    ).order_by(DailyTotalsRollup.day)
+
+
+# ORM write tracking ----------------------------------------------------------
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_new_order_items(session, flush_context):
+    pending = session.info.setdefault("rollup_pending", {"days": set(), "products": set(), "users": set()})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, OrderItem):
+            # created_at may still be pending a server default; fall back to today
+            created_at = obj.__dict__.get("created_at")
+            pending["days"].add(created_at.date() if isinstance(created_at, datetime) else date.today())
+            pending["products"].add(obj.product_id)
+            pending["users"].add(obj.user_id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_pending_rollups(session):
+    pending = session.info.pop("rollup_pending", None)
+    if pending and (pending["days"] or pending["products"] or pending["users"]):
+        refresh_rollups(session.get_bind(), pending["days"], pending["products"], pending["users"])
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_pending_rollups(session):
+    session.info.pop("rollup_pending", None)
+
+
+if __name__ == "__main__":
+    print("Rebuilding rollup tables...")
+    # Rollup tables added since the last deploy may not exist yet
+    create_schema(default_engine)
+    rebuild_rollups()
+    print("Rollups rebuilt!")
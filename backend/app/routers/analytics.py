@@ -1,75 +1,110 @@
-from typing import List
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case
-from app.database import get_db
+import asyncio
+from typing import Annotated, List, Literal, Optional
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Date, func, case, select
+from app import approx as approximate, columnar, cube, export, facts, pagination, rollups, timeseries
+from app.config import settings
+from app.database import fetch_all, fetch_concurrently, get_read_db
 from app.models import OrderItem, Product, Order, User
 from app.schemas import (
     SummaryMetrics, CategoryReturnRate, RevenueByDepartment,
     RevenueByBrand, RevenueOverTime, DepartmentReturnRate,
-    AgeDistribution, CountryRevenue
+    AgeDistribution, CountryRevenue, DashboardData, TimeSeriesPoint,
+    CubeQuery, CubeQueryResult, RevenueByBrandPage, CountryRevenuePage
 )
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
 
-@router.get("/summary", response_model=SummaryMetrics)
-def get_summary(db: Session = Depends(get_db)):
-    """Get overall summary metrics"""
-    
-    # Total revenue (sum of sale_price for completed items)
-    total_revenue = db.query(func.sum(OrderItem.sale_price)).filter(
-        OrderItem.status == "Complete"
-    ).scalar() or 0.0
-    
-    # Overall return rate
-    total_items = db.query(func.count(OrderItem.id)).scalar() or 1
-    returned_items = db.query(func.count(OrderItem.id)).filter(
-        (OrderItem.status == "Returned") | (OrderItem.returned_at.isnot(None))
-    ).scalar() or 0
-    overall_return_rate = returned_items / total_items if total_items > 0 else 0.0
-    
-    # Top category by revenue
-    top_category_revenue = db.query(
+def _product_breakdown_select():
+    """Aggregate order items per (category, department, brand) in one scan"""
+    is_complete = OrderItem.status == "Complete"
+    is_returned = OrderItem.status == "Returned"
+    has_product = Product.id.isnot(None).label("has_product")
+    return select(
+        has_product,
         Product.category,
+        Product.department,
+        Product.brand,
+        func.count(OrderItem.id).label("total_items"),
+        func.sum(case((is_returned, 1), else_=0)).label("returned_items"),
+        func.sum(
+            case((is_returned | OrderItem.returned_at.isnot(None), 1), else_=0)
+        ).label("returned_or_flagged"),
+        func.sum(case((is_complete, 1), else_=0)).label("complete_items"),
+        func.sum(case((is_complete, OrderItem.sale_price))).label("revenue"),
+        func.count(func.distinct(case((is_complete, Product.id)))).label("product_count")
+    ).select_from(
+        OrderItem
+    ).outerjoin(
+        Product, OrderItem.product_id == Product.id
+    ).group_by(
+        has_product, Product.category, Product.department, Product.brand
+    )
+
+
+def _customer_breakdown_select():
+    """Aggregate completed order items per (age range, country) in one scan"""
+    age_range = rollups.age_band(User.age).label("age_range")
+    return select(
+        age_range,
+        User.country,
+        func.count(func.distinct(User.id)).label("customer_count"),
+        func.count(OrderItem.sale_price).label("priced_items"),
         func.sum(OrderItem.sale_price).label("revenue")
     ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).filter(
+        OrderItem, OrderItem.user_id == User.id
+    ).where(
         OrderItem.status == "Complete"
     ).group_by(
-        Product.category
-    ).order_by(
-        func.sum(OrderItem.sale_price).desc()
-    ).first()
-    
-    top_category_by_revenue = top_category_revenue[0] if top_category_revenue and top_category_revenue[0] else "N/A"
-    
-    # Top category by return rate
-    category_stats = db.query(
-        Product.category,
-        func.count(OrderItem.id).label("total"),
-        func.sum(
-            case((OrderItem.status == "Returned", 1), else_=0)
-        ).label("returned")
-    ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).group_by(
-        Product.category
-    ).having(
-        func.count(OrderItem.id) > 0
-    ).all()
-    
+        age_range, User.country
+    )
+
+
+def _rollup(rows, key, fields):
+    """Sum the given fields of breakdown rows per key, preserving first-seen order"""
+    totals = {}
+    for row in rows:
+        group = totals.setdefault(getattr(row, key), dict.fromkeys(fields, 0))
+        for field in fields:
+            group[field] += getattr(row, field) or 0
+    return totals
+
+
+def _with_product(rows):
+    """Keep breakdown rows whose items joined to a product (inner-join semantics)"""
+    return [row for row in rows if row.has_product]
+
+
+def _summary_from(rows) -> SummaryMetrics:
+    """Build summary metrics from a product breakdown"""
+    total_revenue = sum(row.revenue or 0 for row in rows)
+    total_items = sum(row.total_items for row in rows) or 1
+    returned_items = sum(row.returned_or_flagged or 0 for row in rows)
+    overall_return_rate = returned_items / total_items if total_items > 0 else 0.0
+
+    categories = _rollup(_with_product(rows), "category", ("total_items", "returned_items", "complete_items", "revenue"))
+
+    top_category_by_revenue = "N/A"
+    sold = [(category, stats["revenue"]) for category, stats in categories.items() if stats["complete_items"] > 0]
+    if sold:
+        top_category = max(sold, key=lambda item: item[1])[0]
+        top_category_by_revenue = top_category or "N/A"
+
     top_category_by_return_rate = "N/A"
     max_return_rate = 0.0
-    
-    for category, total, returned in category_stats:
-        rate = (returned or 0) / total if total > 0 else 0.0
+
+    for category, stats in categories.items():
+        total = stats["total_items"]
+        rate = stats["returned_items"] / total if total > 0 else 0.0
         if rate > max_return_rate:
             max_return_rate = rate
             top_category_by_return_rate = category or "N/A"
-    
+
     return SummaryMetrics(
         total_revenue=float(total_revenue),
         overall_return_rate=overall_return_rate,
@@ -78,204 +113,387 @@ def get_summary(db: Session = Depends(get_db)):
     )
 
 
-@router.get("/returns-by-category", response_model=List[CategoryReturnRate])
-def get_returns_by_category(db: Session = Depends(get_db)):
-    """Get return rates grouped by product category"""
-    
-    results = db.query(
-        Product.category,
-        func.count(OrderItem.id).label("total_items"),
-        func.sum(
-            case((OrderItem.status == "Returned", 1), else_=0)
-        ).label("returned_items")
-    ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).group_by(
-        Product.category
-    ).having(
-        func.count(OrderItem.id) > 0
-    ).all()
-    
+def _returns_by_category_from(rows) -> List[CategoryReturnRate]:
+    categories = _rollup(_with_product(rows), "category", ("total_items", "returned_items"))
     return [
         CategoryReturnRate(
             category=category or "Unknown",
-            total_items=int(total_items),
-            returned_items=int(returned_items or 0),
-            return_rate=(returned_items or 0) / total_items if total_items > 0 else 0.0
+            total_items=int(stats["total_items"]),
+            returned_items=int(stats["returned_items"]),
+            return_rate=stats["returned_items"] / stats["total_items"] if stats["total_items"] > 0 else 0.0
         )
-        for category, total_items, returned_items in results
+        for category, stats in categories.items()
+        if stats["total_items"] > 0
     ]
 
 
-@router.get("/revenue-by-department", response_model=List[RevenueByDepartment])
-def get_revenue_by_department(db: Session = Depends(get_db)):
-    """Get revenue grouped by department"""
-    results = db.query(
-        Product.department,
-        func.sum(OrderItem.sale_price).label("revenue"),
-        func.count(OrderItem.id).label("order_count")
-    ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).filter(
-        OrderItem.status == "Complete"
-    ).group_by(
-        Product.department
-    ).order_by(
-        func.sum(OrderItem.sale_price).desc()
-    ).all()
-    
+def _returns_by_department_from(rows) -> List[DepartmentReturnRate]:
+    departments = _rollup(_with_product(rows), "department", ("total_items", "returned_items"))
     return [
-        RevenueByDepartment(
+        DepartmentReturnRate(
             department=dept or "Unknown",
-            revenue=float(revenue or 0),
-            order_count=int(order_count or 0)
+            total_items=int(stats["total_items"]),
+            returned_items=int(stats["returned_items"]),
+            return_rate=stats["returned_items"] / stats["total_items"] if stats["total_items"] > 0 else 0.0
         )
-        for dept, revenue, order_count in results
+        for dept, stats in departments.items()
+        if stats["total_items"] > 0
     ]
 
 
-@router.get("/revenue-by-brand", response_model=List[RevenueByBrand])
-def get_revenue_by_brand(db: Session = Depends(get_db), limit: int = 10):
-    """Get top brands by revenue"""
-    results = db.query(
-        Product.brand,
-        func.sum(OrderItem.sale_price).label("revenue"),
-        func.count(func.distinct(Product.id)).label("product_count")
-    ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).filter(
-        OrderItem.status == "Complete"
-    ).group_by(
-        Product.brand
-    ).order_by(
-        func.sum(OrderItem.sale_price).desc()
-    ).limit(limit).all()
-    
+def _revenue_by_department_from(rows) -> List[RevenueByDepartment]:
+    departments = _rollup(_with_product(rows), "department", ("revenue", "complete_items"))
+    sold = [(dept, stats) for dept, stats in departments.items() if stats["complete_items"] > 0]
+    sold.sort(key=lambda item: item[1]["revenue"], reverse=True)
     return [
-        RevenueByBrand(
-            brand=brand or "Unknown",
-            revenue=float(revenue or 0),
-            product_count=int(product_count or 0)
+        RevenueByDepartment(
+            department=dept or "Unknown",
+            revenue=float(stats["revenue"]),
+            order_count=int(stats["complete_items"])
         )
-        for brand, revenue, product_count in results
+        for dept, stats in sold
     ]
 
 
-@router.get("/revenue-over-time", response_model=List[RevenueOverTime])
-def get_revenue_over_time(db: Session = Depends(get_db), days: int = 30):
-    """Get daily revenue over the last N days"""
-    from datetime import date as date_type
-    start_date = datetime.now() - timedelta(days=days)
-    
-    results = db.query(
-        func.date(OrderItem.created_at).label("date"),
-        func.sum(OrderItem.sale_price).label("revenue"),
-        func.count(func.distinct(OrderItem.order_id)).label("order_count")
-    ).filter(
-        OrderItem.status == "Complete",
-        OrderItem.created_at >= start_date
-    ).group_by(
-        func.date(OrderItem.created_at)
-    ).order_by(
-        func.date(OrderItem.created_at)
-    ).all()
-    
+def _revenue_by_brand_from(rows, limit: int) -> List[RevenueByBrand]:
+    # Each product belongs to exactly one (category, department, brand) group,
+    # so distinct product counts can be summed across groups.
+    brands = _rollup(_with_product(rows), "brand", ("revenue", "complete_items", "product_count"))
+    sold = [(brand, stats) for brand, stats in brands.items() if stats["complete_items"] > 0]
+    sold.sort(key=lambda item: item[1]["revenue"], reverse=True)
     return [
-        RevenueOverTime(
-            date=date.strftime("%Y-%m-%d") if date else "",
-            revenue=float(revenue or 0),
-            order_count=int(order_count or 0)
+        RevenueByBrand(
+            brand=brand or "Unknown",
+            revenue=float(stats["revenue"]),
+            product_count=int(stats["product_count"])
         )
-        for date, revenue, order_count in results
+        for brand, stats in sold[:max(limit, 0)]
     ]
 
 
-@router.get("/returns-by-department", response_model=List[DepartmentReturnRate])
-def get_returns_by_department(db: Session = Depends(get_db)):
-    """Get return rates grouped by department"""
-    results = db.query(
-        Product.department,
-        func.count(OrderItem.id).label("total_items"),
-        func.sum(
-            case((OrderItem.status == "Returned", 1), else_=0)
-        ).label("returned_items")
-    ).join(
-        OrderItem, OrderItem.product_id == Product.id
-    ).group_by(
-        Product.department
-    ).having(
-        func.count(OrderItem.id) > 0
-    ).all()
-    
+def _age_distribution_from(rows) -> List[AgeDistribution]:
+    # Each customer has exactly one (age range, country), so distinct customer
+    # counts can be summed across groups.
+    age_ranges = _rollup(
+        [row for row in rows if row.age_range is not None],
+        "age_range",
+        ("customer_count", "priced_items", "revenue")
+    )
     return [
-        DepartmentReturnRate(
-            department=dept or "Unknown",
-            total_items=int(total_items),
-            returned_items=int(returned_items or 0),
-            return_rate=(returned_items or 0) / total_items if total_items > 0 else 0.0
+        AgeDistribution(
+            age_range=age_range or "Unknown",
+            customer_count=int(stats["customer_count"]),
+            avg_order_value=float(stats["revenue"] / stats["priced_items"]) if stats["priced_items"] else 0.0
         )
-        for dept, total_items, returned_items in results
+        for age_range, stats in age_ranges.items()
     ]
 
 
-@router.get("/age-distribution", response_model=List[AgeDistribution])
-def get_age_distribution(db: Session = Depends(get_db)):
-    """Get customer age distribution with average order value"""
-    results = db.query(
-        case(
-            (User.age < 18, "Under 18"),
-            (User.age < 25, "18-24"),
-            (User.age < 35, "25-34"),
-            (User.age < 45, "35-44"),
-            (User.age < 55, "45-54"),
-            (User.age < 65, "55-64"),
-            else_="65+"
-        ).label("age_range"),
-        func.count(func.distinct(User.id)).label("customer_count"),
-        func.avg(OrderItem.sale_price).label("avg_order_value")
-    ).join(
-        OrderItem, OrderItem.user_id == User.id
-    ).filter(
-        OrderItem.status == "Complete",
-        User.age.isnot(None)
-    ).group_by(
-        "age_range"
-    ).all()
-    
+def _revenue_by_country_from(rows, limit: int) -> List[CountryRevenue]:
+    countries = _rollup(
+        [row for row in rows if row.country is not None],
+        "country",
+        ("customer_count", "revenue")
+    )
+    ranked = sorted(countries.items(), key=lambda item: item[1]["revenue"], reverse=True)
     return [
-        AgeDistribution(
-            age_range=age_range or "Unknown",
-            customer_count=int(count or 0),
-            avg_order_value=float(avg_value or 0)
+        CountryRevenue(
+            country=country or "Unknown",
+            revenue=float(stats["revenue"]),
+            customer_count=int(stats["customer_count"])
         )
-        for age_range, count, avg_value in results
+        for country, stats in ranked[:max(limit, 0)]
     ]
 
 
-@router.get("/revenue-by-country", response_model=List[CountryRevenue])
-def get_revenue_by_country(db: Session = Depends(get_db), limit: int = 10):
-    """Get top countries by revenue"""
-    results = db.query(
-        User.country,
+def _product_select():
+    """Product-side breakdown, from the rollups when enabled, else the fact table if configured"""
+    if settings.use_rollups:
+        return rollups.product_breakdown_select()
+    if facts.enabled():
+        return facts.product_breakdown_select()
+    return _product_breakdown_select()
+
+
+def _customer_select():
+    """Customer-side breakdown, from the rollups when enabled, else the fact table if configured"""
+    if settings.use_rollups:
+        return rollups.customer_breakdown_select()
+    if facts.enabled():
+        return facts.customer_breakdown_select()
+    return _customer_breakdown_select()
+
+
+def _use_columnar() -> bool:
+    return settings.analytics_backend == "duckdb"
+
+
+async def _product_rows(db: AsyncSession):
+    """Product breakdown from the configured backend (the database until a snapshot exists)"""
+    if _use_columnar():
+        rows = await run_in_threadpool(columnar.product_breakdown)
+        if rows is not None:
+            return rows
+    return await fetch_all(db, _product_select())
+
+
+async def _customer_rows(db: AsyncSession):
+    """Customer breakdown from the configured backend (the database until a snapshot exists)"""
+    if _use_columnar():
+        rows = await run_in_threadpool(columnar.customer_breakdown)
+        if rows is not None:
+            return rows
+    return await fetch_all(db, _customer_select())
+
+
+@router.get("/summary", response_model=SummaryMetrics)
+async def get_summary(db: AsyncSession = Depends(get_read_db)):
+    """Get overall summary metrics"""
+    return _summary_from(await _product_rows(db))
+
+
+@router.get("/dashboard", response_model=DashboardData, response_model_exclude_none=True)
+async def get_dashboard(db: AsyncSession = Depends(get_read_db), limit: int = 10):
+    """Get every dashboard panel in one round trip (two concurrent table scans)"""
+    if _use_columnar():
+        product_rows, customer_rows = await asyncio.gather(_product_rows(db), _customer_rows(db))
+    else:
+        product_rows, customer_rows = await fetch_concurrently(db, _product_select(), _customer_select())
+    return DashboardData(
+        summary=_summary_from(product_rows),
+        returns_by_category=_returns_by_category_from(product_rows),
+        revenue_by_department=_revenue_by_department_from(product_rows),
+        returns_by_department=_returns_by_department_from(product_rows),
+        revenue_by_brand=_revenue_by_brand_from(product_rows, limit),
+        age_distribution=_age_distribution_from(customer_rows),
+        revenue_by_country=_revenue_by_country_from(customer_rows, limit)
+    )
+
+
+@router.get("/returns-by-category", response_model=List[CategoryReturnRate])
+async def get_returns_by_category(db: AsyncSession = Depends(get_read_db)):
+    """Get return rates grouped by product category"""
+    return _returns_by_category_from(await _product_rows(db))
+
+
+@router.get("/revenue-by-department", response_model=List[RevenueByDepartment])
+async def get_revenue_by_department(db: AsyncSession = Depends(get_read_db)):
+    """Get revenue grouped by department"""
+    return _revenue_by_department_from(await _product_rows(db))
+
+
+@router.get("/revenue-by-brand", response_model=List[RevenueByBrand], response_model_exclude_none=True)
+async def get_revenue_by_brand(db: AsyncSession = Depends(get_read_db), limit: int = 10, approx: bool = False):
+    """Get top brands by revenue (estimated from a sample with approx=true)"""
+    if approx:
+        return await approximate.revenue_by_brand(db, limit)
+    return _revenue_by_brand_from(await _product_rows(db), limit)
+
+
+async def _page(db: AsyncSession, breakdown: str, cursor: Optional[str], limit: int):
+    """One keyset page of a breakdown, and the cursor for the next one"""
+    try:
+        after = pagination.decode_cursor(cursor) if cursor is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = await fetch_all(
+        db, pagination.page_select(breakdown, after is not None), pagination.page_params(after, limit)
+    )
+    return pagination.split_page(rows, limit)
+
+
+@router.get("/revenue-by-brand/page", response_model=RevenueByBrandPage, response_model_exclude_none=True)
+async def get_revenue_by_brand_page(
+    db: AsyncSession = Depends(get_read_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Get every brand by revenue, one page at a time (pass next_cursor back as cursor)"""
+    rows, next_cursor = await _page(db, "brand", cursor, limit)
+    return RevenueByBrandPage(
+        items=[
+            RevenueByBrand(brand=row.key or "Unknown", revenue=float(row.revenue), product_count=int(row.count))
+            for row in rows
+        ],
+        next_cursor=next_cursor
+    )
+
+
+def _revenue_over_time_select(start_date: datetime, end_date: Optional[datetime] = None):
+    filters = [OrderItem.status == "Complete", OrderItem.created_at >= start_date]
+    if end_date is not None:
+        filters.append(OrderItem.created_at < end_date)
+    # Typed so SQLite's 'YYYY-MM-DD' strings come back as dates too
+    day = func.date(OrderItem.created_at, type_=Date)
+    return select(
+        day.label("date"),
         func.sum(OrderItem.sale_price).label("revenue"),
-        func.count(func.distinct(User.id)).label("customer_count")
-    ).join(
-        OrderItem, OrderItem.user_id == User.id
-    ).filter(
-        OrderItem.status == "Complete",
-        User.country.isnot(None)
+        func.count(func.distinct(OrderItem.order_id)).label("order_count")
+    ).where(
+        *filters
     ).group_by(
-        User.country
+        day
     ).order_by(
-        func.sum(OrderItem.sale_price).desc()
-    ).limit(limit).all()
-    
+        day
+    )
+
+
+async def _revenue_over_time_rows(db: AsyncSession, start_date: datetime):
+    """(date, revenue, order_count) per day since start_date, from the database"""
+    if not settings.use_rollups:
+        return await fetch_all(db, _revenue_over_time_select(start_date))
+    # The window starts mid-day, so the first (partial) day comes from the
+    # raw rows and every whole day after it from the daily rollup.
+    next_midnight = datetime.combine(start_date.date() + timedelta(days=1), datetime.min.time())
+    first_day, whole_days = await fetch_concurrently(
+        db,
+        _revenue_over_time_select(start_date, next_midnight),
+        rollups.daily_totals_select(after=start_date.date())
+    )
+    return [(start_date.date(), revenue, order_count) for _, revenue, order_count in first_day] + list(whole_days)
+
+
+def _date_range(start: Optional[date], end: Optional[date]):
+    """Inclusive date range, defaulting to the 30 days ending today"""
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=422, detail="start must not be after end")
+    return start, end
+
+
+async def _series(
+    db: AsyncSession,
+    start: Optional[date],
+    end: Optional[date],
+    granularity: str,
+    breakdown: Optional[str] = None,
+    fill: bool = True
+) -> List[timeseries.SeriesPoint]:
+    start, end = _date_range(start, end)
+    statement = timeseries.series_select(start, end, granularity, breakdown, db.bind.dialect.name)
+    return timeseries.assemble(await fetch_all(db, statement), start, end, granularity, fill)
+
+
+@router.get("/revenue-over-time", response_model=List[RevenueOverTime], response_model_exclude_none=True)
+async def get_revenue_over_time(
+    db: AsyncSession = Depends(get_read_db),
+    days: int = 30,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: Optional[Literal["day", "week", "month"]] = None,
+    approx: bool = False
+):
+    """Get daily revenue over the last N days, or bucketed revenue for a start/end date range"""
+    ranged = start is not None or end is not None or granularity is not None
+    if approx:
+        # Whole days only: the sketches and daily totals can't split the first day at the current time
+        if not ranged:
+            start, end = (datetime.now() - timedelta(days=days)).date(), date.today()
+        start, end = _date_range(start, end)
+        return await approximate.revenue_over_time(db, start, end, granularity or "day", fill=ranged)
+    if ranged:
+        points = await _series(db, start, end, granularity or "day")
+        return [
+            RevenueOverTime(date=point.bucket.isoformat(), revenue=point.revenue, order_count=point.order_count)
+            for point in points
+        ]
+
+    start_date = datetime.now() - timedelta(days=days)
+
+    results = None
+    if _use_columnar():
+        results = await run_in_threadpool(columnar.revenue_over_time, start_date)
+    if results is None:
+        results = await _revenue_over_time_rows(db, start_date)
+
     return [
-        CountryRevenue(
-            country=country or "Unknown",
+        RevenueOverTime(
+            date=day.strftime("%Y-%m-%d") if day else "",
             revenue=float(revenue or 0),
-            customer_count=int(customer_count or 0)
+            order_count=int(order_count or 0)
+        )
+        for day, revenue, order_count in results
+    ]
+
+
+@router.get("/timeseries", response_model=List[TimeSeriesPoint])
+async def get_timeseries(
+    db: AsyncSession = Depends(get_read_db),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: Literal["day", "week", "month"] = "day",
+    breakdown: Optional[Literal["category", "department"]] = None,
+    fill: bool = True
+):
+    """Completed revenue and orders per day/week/month bucket, optionally per category or department"""
+    points = await _series(db, start, end, granularity, breakdown, fill)
+    return [
+        TimeSeriesPoint(
+            date=point.bucket.isoformat(), group=point.group, revenue=point.revenue, order_count=point.order_count
         )
-        for country, revenue, customer_count in results
+        for point in points
     ]
 
+
+@router.get("/returns-by-department", response_model=List[DepartmentReturnRate])
+async def get_returns_by_department(db: AsyncSession = Depends(get_read_db)):
+    """Get return rates grouped by department"""
+    return _returns_by_department_from(await _product_rows(db))
+
+
+@router.get("/age-distribution", response_model=List[AgeDistribution], response_model_exclude_none=True)
+async def get_age_distribution(db: AsyncSession = Depends(get_read_db), approx: bool = False):
+    """Get customer age distribution with average order value (estimated with approx=true)"""
+    if approx:
+        return await approximate.age_distribution(db)
+    return _age_distribution_from(await _customer_rows(db))
+
+
+@router.get("/revenue-by-country", response_model=List[CountryRevenue], response_model_exclude_none=True)
+async def get_revenue_by_country(db: AsyncSession = Depends(get_read_db), limit: int = 10, approx: bool = False):
+    """Get top countries by revenue (estimated with approx=true)"""
+    if approx:
+        return await approximate.revenue_by_country(db, limit)
+    return _revenue_by_country_from(await _customer_rows(db), limit)
+
+
+@router.get("/revenue-by-country/page", response_model=CountryRevenuePage, response_model_exclude_none=True)
+async def get_revenue_by_country_page(
+    db: AsyncSession = Depends(get_read_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Get every country by revenue, one page at a time (pass next_cursor back as cursor)"""
+    rows, next_cursor = await _page(db, "country", cursor, limit)
+    return CountryRevenuePage(
+        items=[
+            CountryRevenue(country=row.key or "Unknown", revenue=float(row.revenue), customer_count=int(row.count))
+            for row in rows
+        ],
+        next_cursor=next_cursor
+    )
+
+
+@router.get("/query", response_model=CubeQueryResult)
+async def query_cube(query: Annotated[CubeQuery, Query()], db: AsyncSession = Depends(get_read_db)):
+    """Group order items by any dimensions and compute measures, as one planned SQL statement"""
+    plan = cube.plan(query, db.bind.dialect.name)
+    rows = await fetch_all(db, plan.statement, plan.params)
+    return CubeQueryResult(source=plan.source, rows=cube.to_records(query, rows))
+
+
+@router.get("/export/{dataset}", response_class=StreamingResponse)
+async def export_dataset(
+    dataset: Literal["order-items", "revenue-by-brand", "revenue-by-country"],
+    file_format: Literal["csv", "parquet"] = Query("csv", alias="format"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Stream a whole dataset as CSV or Parquet, chunk by chunk from a server-side cursor"""
+    if file_format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail='Parquet export needs pyarrow: pip install -e ".[columnar]"')
+    return StreamingResponse(
+        export.stream(db.bind, dataset, file_format),
+        media_type=export.MEDIA_TYPES[file_format],
+        headers=export.headers(dataset, file_format)
+    )
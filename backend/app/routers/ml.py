@@ -1,13 +1,132 @@
-from fastapi import APIRouter
-from app.schemas import PredictReturnsRequest, PredictReturnsResponse
-from app.ml.model import model
+from typing import List, Optional, Union
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import fetch_all, get_read_db
+from app.models import ProductReturnPrediction
+from app.ml.feature_index import UnknownIdsError, feature_index
+from app.schemas import (
+    ModelInfo, PredictReturnsRequest, PredictReturnsColumnarRequest, PredictReturnsByIdRequest,
+    PredictReturnsByIdColumnarRequest, PredictReturnsResponse, ProductRiskPrediction
+)
+from app.ml import bulk
+from app.ml.model import products_to_columns
+from app.ml.registry import registry
 
 router = APIRouter(prefix="/ml", tags=["ml"])
 
 
-@router.post("/predict_returns", response_model=PredictReturnsResponse)
-def predict_returns(request: PredictReturnsRequest):
-    """Predict return probability for products"""
-    predictions = model.predict(request.products)
-    return PredictReturnsResponse(predictions=predictions)
+def _id_columns(request: Union[PredictReturnsByIdRequest, PredictReturnsByIdColumnarRequest]):
+    """Model columns and historical return rates for an id-only request, from the feature index"""
+    if isinstance(request, PredictReturnsByIdRequest):
+        product_ids = [item.product_id for item in request.items]
+        user_ids = [item.user_id for item in request.items]
+        discount_pct = [item.discount_pct for item in request.items]
+    else:
+        product_ids, user_ids, discount_pct = request.product_id, request.user_id, request.discount_pct
+    try:
+        return feature_index.get().columns(product_ids, user_ids, discount_pct)
+    except UnknownIdsError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
+
+@router.post("/predict_returns", response_model=PredictReturnsResponse, response_model_exclude_unset=True)
+def predict_returns(
+    request: Union[
+        PredictReturnsRequest, PredictReturnsColumnarRequest,
+        PredictReturnsByIdRequest, PredictReturnsByIdColumnarRequest
+    ]
+):
+    """Predict return probability for products (full features, or just ids; row-wise or columnar)"""
+    return_rates = None
+    if isinstance(request, PredictReturnsRequest):
+        columns = products_to_columns(request.products)
+    elif isinstance(request, PredictReturnsColumnarRequest):
+        columns = {field: np.asarray(values) for field, values in request.__dict__.items()}
+    else:
+        columns, return_rates = _id_columns(request)
+
+    product_ids, probabilities, labels = registry.get().predict_columns(columns)
+
+    # Plain dicts straight from the arrays; the response model validates and serializes them
+    predictions = [
+        {"product_id": product_id, "return_probability": probability, "risk_label": label}
+        for product_id, probability, label in zip(product_ids.tolist(), probabilities.tolist(), labels.tolist())
+    ]
+    if return_rates is not None:
+        # Echoed for reference; the model doesn't use it as a feature
+        for prediction, rate in zip(predictions, np.round(return_rates, 4).tolist()):
+            prediction["historical_return_rate"] = None if np.isnan(rate) else rate
+    return {"predictions": predictions}
+
+
+@router.post("/predict_returns/stream", response_class=bulk.UploadStreamingResponse)
+async def predict_returns_stream(request: Request):
+    """Score a CSV or NDJSON upload of products, streaming NDJSON predictions back chunk by chunk"""
+    upload_format = bulk.upload_format(request.headers.get("content-type"))
+    if upload_format is None:
+        raise HTTPException(status_code=415, detail="Send text/csv (with a header row) or application/x-ndjson")
+    lines = bulk.iter_lines(request.stream())
+    header = None
+    if upload_format == "csv":
+        # Read the header before the response starts, so a bad one is still a 400
+        try:
+            header = await bulk.read_csv_header(lines)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    # One model for the whole upload, even if a new version is published mid-stream
+    return bulk.UploadStreamingResponse(
+        bulk.score_stream(registry.get(), lines, header), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/predictions", response_model=List[ProductRiskPrediction])
+async def get_predictions(
+    db: AsyncSession = Depends(get_read_db),
+    product_id: Optional[int] = None,
+    category: Optional[str] = None,
+    department: Optional[str] = None,
+    age_band: Optional[str] = None,
+    country: Optional[str] = None,
+    risk_label: Optional[str] = None,
+    min_probability: Optional[float] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Precomputed product x segment return risk from the last batch scoring run, riskiest first"""
+    table = ProductReturnPrediction.__table__
+    filters = {
+        "product_id": product_id, "category": category, "department": department,
+        "age_band": age_band, "country": country, "risk_label": risk_label,
+    }
+    statement = select(table).where(*(table.c[name] == value for name, value in filters.items() if value is not None))
+    if min_probability is not None:
+        statement = statement.where(table.c.return_probability >= min_probability)
+    statement = statement.order_by(
+        table.c.return_probability.desc(), table.c.product_id, table.c.age_band, table.c.country
+    ).limit(limit).offset(offset)
+    return [ProductRiskPrediction.model_validate(row, from_attributes=True) for row in await fetch_all(db, statement)]
+
+
+def _model_info() -> ModelInfo:
+    model = registry.get()
+    return ModelInfo(
+        version=model.version,
+        trained=model.is_trained,
+        trained_rows=model.meta.get("trained_rows"),
+        metrics=model.meta.get("metrics")
+    )
+
+
+@router.get("/model", response_model=ModelInfo)
+def get_model_info():
+    """Version of the model currently serving predictions"""
+    return _model_info()
+
+
+@router.post("/model/reload", response_model=ModelInfo)
+def reload_model():
+    """Swap in the latest published model now instead of waiting for the next poll"""
+    registry.refresh()
+    return _model_info()
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from datetime import date, datetime
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Dict, List, Literal, Optional, Union
 
 
 class SummaryMetrics(BaseModel):
@@ -31,10 +32,81 @@ class PredictReturnsRequest(BaseModel):
     products: List[ProductInput]
 
 
+class PredictReturnsColumnarRequest(BaseModel):
+    """Struct-of-arrays batch: one list per ProductInput field, all the same length"""
+    product_id: List[int]
+    category: List[str]
+    brand: List[str]
+    department: List[str]
+    price: List[float]
+    discount_pct: List[float]
+    customer_age: List[int]
+    customer_country: List[str]
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        lengths = {len(values) for values in self.__dict__.values()}
+        if len(lengths) > 1:
+            raise ValueError("all columns must have the same length")
+        return self
+
+
+class ProductIdInput(BaseModel):
+    product_id: int
+    user_id: Optional[int] = None
+    discount_pct: float = 0.0
+
+
+class PredictReturnsByIdRequest(BaseModel):
+    """Products (and customers) by id; their features come from the in-memory feature index"""
+    items: List[ProductIdInput]
+
+
+class PredictReturnsByIdColumnarRequest(BaseModel):
+    """Struct-of-arrays id batch; user_id entries may be null"""
+    # Forbid extra keys so a full columnar request never matches this model
+    model_config = ConfigDict(extra="forbid")
+
+    product_id: List[int]
+    user_id: Optional[List[Optional[int]]] = None
+    discount_pct: Optional[List[float]] = None
+
+    @model_validator(mode="after")
+    def check_lengths(self):
+        lengths = {len(values) for values in (self.product_id, self.user_id, self.discount_pct) if values is not None}
+        if len(lengths) > 1:
+            raise ValueError("all columns must have the same length")
+        return self
+
+
 class PredictionResult(BaseModel):
     product_id: int
     return_probability: float
     risk_label: str
+    # Share of the product's resolved order items that were returned (id requests only)
+    historical_return_rate: Optional[float] = None
+
+
+class ProductRiskPrediction(BaseModel):
+    product_id: int
+    age_band: str
+    country: str
+    category: Optional[str]
+    department: Optional[str]
+    brand: Optional[str]
+    price: Optional[float]
+    customer_age: int
+    return_probability: float
+    risk_label: str
+    model_version: Optional[str]
+    scored_at: datetime
+
+
+class ModelInfo(BaseModel):
+    version: Optional[str]
+    trained: bool
+    trained_rows: Optional[int] = None
+    metrics: Optional[Dict[str, Optional[float]]] = None
 
 
 class PredictReturnsResponse(BaseModel):
@@ -51,12 +123,21 @@ class RevenueByBrand(BaseModel):
     brand: str
     revenue: float
     product_count: int
+    error_bounds: Optional[Dict[str, float]] = None  # approx=true only: 95% bound per estimated field
 
 
 class RevenueOverTime(BaseModel):
     date: str
     revenue: float
     order_count: int
+    error_bounds: Optional[Dict[str, float]] = None  # approx=true only: 95% bound per estimated field
+
+
+class TimeSeriesPoint(BaseModel):
+    date: str  # first day of the bucket
+    group: Optional[str] = None  # category or department when broken down
+    revenue: float
+    order_count: int
 
 
 class DepartmentReturnRate(BaseModel):
@@ -70,10 +151,73 @@ class AgeDistribution(BaseModel):
     age_range: str
     customer_count: int
     avg_order_value: float
+    error_bounds: Optional[Dict[str, float]] = None  # approx=true only: 95% bound per estimated field
 
 
 class CountryRevenue(BaseModel):
     country: str
     revenue: float
     customer_count: int
-
+    error_bounds: Optional[Dict[str, float]] = None  # approx=true only: 95% bound per estimated field
+
+
+class RevenueByBrandPage(BaseModel):
+    items: List[RevenueByBrand]
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page; None on the last page
+
+
+class CountryRevenuePage(BaseModel):
+    items: List[CountryRevenue]
+    next_cursor: Optional[str] = None  # pass as ?cursor= for the next page; None on the last page
+
+
+class DashboardData(BaseModel):
+    summary: SummaryMetrics
+    returns_by_category: List[CategoryReturnRate]
+    revenue_by_department: List[RevenueByDepartment]
+    returns_by_department: List[DepartmentReturnRate]
+    revenue_by_brand: List[RevenueByBrand]
+    age_distribution: List[AgeDistribution]
+    revenue_by_country: List[CountryRevenue]
+
+
+CubeDimension = Literal["category", "department", "brand", "country", "age_band", "day"]
+CubeMeasure = Literal["revenue", "item_count", "returned_count", "return_rate", "customer_count"]
+
+
+class CubeQuery(BaseModel):
+    """GET /analytics/query parameters: group by dimensions, compute measures, filter by values and dates"""
+    model_config = ConfigDict(extra="forbid")
+
+    dimensions: List[CubeDimension] = []
+    measures: List[CubeMeasure] = ["revenue"]
+    # Keep only items whose dimension value is one of these
+    category: List[str] = []
+    department: List[str] = []
+    brand: List[str] = []
+    country: List[str] = []
+    age_band: List[str] = []
+    # Item creation dates, inclusive
+    start: Optional[date] = None
+    end: Optional[date] = None
+    order_by: Optional[str] = None  # a requested dimension or measure (default: the first measure)
+    descending: bool = True
+    limit: int = Field(1000, ge=1, le=10000)
+
+    @model_validator(mode="after")
+    def check_query(self):
+        # Repeated names would only repeat columns
+        self.dimensions = list(dict.fromkeys(self.dimensions))
+        self.measures = list(dict.fromkeys(self.measures))
+        if not self.measures:
+            raise ValueError("at least one measure is required")
+        if self.order_by is not None and self.order_by not in self.dimensions + self.measures:
+            raise ValueError("order_by must be one of the requested dimensions or measures")
+        if self.start is not None and self.end is not None and self.start > self.end:
+            raise ValueError("start must not be after end")
+        return self
+
+
+class CubeQueryResult(BaseModel):
+    source: str  # "rollup", "fact" or "raw"
+    rows: List[Dict[str, Union[str, int, float, None]]]
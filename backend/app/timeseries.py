@@ -0,0 +1,144 @@
+"""
+Revenue time series over arbitrary date ranges.
+
+A series covers whole days from `start` to `end`, both inclusive. Days are
+grouped into day, week (starting Monday) or month buckets, and can be
+broken down by category or department. With rollups on, the buckets are
+summed from the daily rollup tables (`rollup_daily_totals`, and
+`rollup_daily_breakdown` for breakdowns). The rollups are refreshed
+incrementally by the ETL, so the database reads one row per day and group,
+however much history the range covers. Bucketing happens in SQL, so a
+three-year monthly chart returns 36 rows. Buckets with no sales are
+filled with zeros.
+
+Order counts in week and month buckets add up the daily distinct counts.
+An order whose completed items were created on different days counts
+once per day. With USE_ROLLUPS=false, the same buckets are computed from
+the raw order items instead (or the dbt fact table, see app.facts), and
+there distinct orders are exact per bucket.
+"""
+from datetime import date, timedelta
+from typing import Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import Date, cast, func, null, select
+
+from app import facts
+from app.config import settings
+from app.models import DailyBreakdownRollup, DailyTotalsRollup, OrderItem, Product
+from app.rollups import BREAKDOWN_DIMENSIONS
+
+GRANULARITIES = ("day", "week", "month")
+
+
+class SeriesPoint(NamedTuple):
+    bucket: date
+    group: Optional[str]
+    revenue: float
+    order_count: int
+
+
+def bucket_start(day, granularity: str, dialect: str):
+    """SQL expression for the first day of the bucket containing `day` (a DATE)"""
+    if granularity == "day":
+        return day
+    if dialect == "sqlite":
+        if granularity == "week":
+            # Forward to Sunday (or stay on it), then back to that week's Monday
+            return func.date(day, "weekday 0", "-6 days")
+        return func.date(day, "start of month")
+    return cast(func.date_trunc(granularity, day), Date)
+
+
+def first_bucket(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(bucket: date, granularity: str) -> date:
+    if granularity == "week":
+        return bucket + timedelta(weeks=1)
+    if granularity == "month":
+        return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return bucket + timedelta(days=1)
+
+
+def buckets(start: date, end: date, granularity: str) -> Iterator[date]:
+    """Every bucket start overlapping [start, end]"""
+    bucket = first_bucket(start, granularity)
+    while bucket <= end:
+        yield bucket
+        bucket = next_bucket(bucket, granularity)
+
+
+def _group_by(bucket, group, breakdown: Optional[str]):
+    return (bucket, group) if breakdown is not None else (bucket,)
+
+
+def series_select(start: date, end: date, granularity: str, breakdown: Optional[str], dialect: str):
+    """(bucket, group, revenue, order_count) rows for the buckets that have sales"""
+    if settings.use_rollups:
+        if breakdown is None:
+            day, group = DailyTotalsRollup.day, null()
+            revenue, orders = DailyTotalsRollup.revenue, DailyTotalsRollup.order_count
+            filters = [DailyTotalsRollup.day.between(start, end)]
+        else:
+            day, group = DailyBreakdownRollup.day, DailyBreakdownRollup.value
+            revenue, orders = DailyBreakdownRollup.revenue, DailyBreakdownRollup.order_count
+            filters = [DailyBreakdownRollup.dimension == breakdown, DailyBreakdownRollup.day.between(start, end)]
+        bucket = bucket_start(day, granularity, dialect).label("bucket")
+        return select(
+            bucket,
+            group.label("group"),
+            func.sum(revenue).label("revenue"),
+            func.sum(orders).label("order_count")
+        ).where(*filters).group_by(*_group_by(bucket, group, breakdown)).order_by(bucket)
+
+    # Raw order items (or their fact rows): compare created_at against midnights so its index can be used
+    if facts.enabled():
+        fct = facts.fct
+        created_at, status, sale_price, order_id = fct.item_created_at, fct.item_status, fct.sale_price, fct.order_id
+        group = fct[breakdown] if breakdown is not None else null()
+    else:
+        created_at, status, sale_price, order_id = (
+            OrderItem.created_at, OrderItem.status, OrderItem.sale_price, OrderItem.order_id
+        )
+        group = BREAKDOWN_DIMENSIONS[breakdown] if breakdown is not None else null()
+    bucket = bucket_start(func.date(created_at), granularity, dialect).label("bucket")
+    stmt = select(
+        bucket,
+        group.label("group"),
+        func.sum(sale_price).label("revenue"),
+        func.count(func.distinct(order_id)).label("order_count")
+    ).where(
+        status == "Complete",
+        created_at >= start,
+        created_at < end + timedelta(days=1)
+    ).group_by(*_group_by(bucket, group, breakdown)).order_by(bucket)
+    if breakdown is not None and not facts.enabled():
+        stmt = stmt.select_from(OrderItem).outerjoin(Product, OrderItem.product_id == Product.id)
+    return stmt
+
+
+def as_date(value) -> date:
+    # SQLite returns DATE expressions as 'YYYY-MM-DD' strings
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def assemble(rows, start: date, end: date, granularity: str, fill: bool = True) -> List[SeriesPoint]:
+    """Rows from series_select as points ordered by bucket then group, zero-filling empty buckets"""
+    points = {
+        (as_date(bucket), group): SeriesPoint(as_date(bucket), group, float(revenue or 0), int(order_count or 0))
+        for bucket, group, revenue, order_count in rows
+    }
+    if not fill:
+        return sorted(points.values(), key=lambda p: (p.bucket, p.group is None, p.group or ""))
+    # Every group seen anywhere in the range gets a point in every bucket
+    groups = sorted({group for _, group in points}, key=lambda g: (g is None, g or "")) or [None]
+    return [
+        points.get((bucket, group)) or SeriesPoint(bucket, group, 0.0, 0)
+        for bucket in buckets(start, end, granularity)
+        for group in groups
+    ]
@@ -0,0 +1,169 @@
+"""
+Background warm-up after the API starts listening.
+
+The lifespan hook in app.main starts `warm_up()` as a task and returns at
+once, so a worker binds its port without waiting on the database. The
+task then brings the schema up to date (skipped when the stored schema
+version matches), opens pooled connections, loads the return model and
+the feature index for id-only predictions (app.ml.feature_index), and
+fills the analytics response cache by requesting the dashboard routes
+through the app itself. GET /ready answers 503 until every step is done,
+so a load balancer only routes traffic to warm workers; GET /health stays
+a plain liveness check.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from app import partitions
+from app.config import settings
+from app.database import engine, read_engines
+from app.ml.feature_index import feature_index
+from app.ml.registry import registry
+from app.models import ensure_schema
+from app.schemas import ProductInput
+
+logger = logging.getLogger(__name__)
+
+# Analytics requests the dashboard makes on load, replayed to fill the response cache
+WARM_PATHS: List[str] = [
+    "/analytics/summary",
+    "/analytics/dashboard?limit=10",
+    "/analytics/returns-by-category",
+    "/analytics/revenue-by-department",
+    "/analytics/revenue-by-brand?limit=10",
+    "/analytics/revenue-over-time?days=30",
+    "/analytics/returns-by-department",
+    "/analytics/age-distribution",
+    "/analytics/revenue-by-country?limit=10",
+]
+
+STEPS = ["schema", "pool", "model", "features", "cache"]
+MAX_RETRY_SECONDS = 30.0
+
+
+class WarmupState:
+    """Progress of the warm-up steps, reported by GET /ready"""
+
+    def __init__(self):
+        self.steps: Dict[str, str] = {step: "pending" for step in STEPS}
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        # Import-to-listening time, set by the lifespan hook in app.main
+        self.startup_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    def report(self) -> dict:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "status": "ready" if self.ready else "warming",
+            "steps": dict(self.steps),
+            "warmup_seconds": round(elapsed, 3),
+            "startup_seconds": None if self.startup_seconds is None else round(self.startup_seconds, 3),
+        }
+
+
+state = WarmupState()
+
+
+def _migrate():
+    if ensure_schema(engine):
+        logger.info("Schema created or updated")
+    # Runs on every start, not only on schema changes, so next months' partitions are always ready
+    created = partitions.ensure_future_partitions(engine)
+    if created:
+        logger.info("Created partitions: %s", ", ".join(created))
+
+
+async def _warm_pools():
+    async def ping(read_engine):
+        async with read_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # Open pool_size connections per read engine at once, so the first burst of requests doesn't connect
+    await asyncio.gather(*(ping(read_engine) for read_engine in read_engines for _ in range(settings.db_pool_size)))
+
+
+def _warm_model():
+    # Loads the model and imports the feature encoder (scikit-learn) off the request path
+    registry.get().predict([ProductInput(
+        product_id=0, category="", brand="", department="", price=0.0,
+        discount_pct=0.0, customer_age=30, customer_country="",
+    )])
+
+
+def _warm_features():
+    # Builds the product/customer feature index used by id-only predictions
+    feature_index.get()
+
+
+async def _asgi_get(app, path_and_query: str) -> int:
+    """Send a GET through the whole middleware stack and return its status"""
+    path, _, query = path_and_query.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"warmup")], "client": ("127.0.0.1", 0), "server": ("warmup", 80),
+    }
+    status = 0
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a real client, only "disconnect" once the response is complete
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body", False):
+            response_done.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def _warm_cache(app):
+    for path in WARM_PATHS:
+        status = await _asgi_get(app, path)
+        if status != 200:
+            logger.warning("Warm-up request %s returned %s", path, status)
+
+
+async def _retry(step: str, func, *args):
+    """Run a step until it succeeds; the database may not be up yet"""
+    delay = 1.0
+    while True:
+        try:
+            await func(*args)
+            state.steps[step] = "done"
+            return
+        except Exception as e:
+            state.steps[step] = f"retrying: {e.__class__.__name__}"
+            logger.warning("Warm-up step %s failed (%s); retrying in %.0fs", step, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+
+async def warm_up(app):
+    """Run every warm-up step in order, then mark the worker ready"""
+    await _retry("schema", run_in_threadpool, _migrate)
+    await _retry("pool", _warm_pools)
+    await _retry("model", run_in_threadpool, _warm_model)
+    await _retry("features", run_in_threadpool, _warm_features)
+    await _retry("cache", _warm_cache, app)
+    state.finished_at = time.perf_counter()
+    logger.info("Warm-up finished in %.2fs", state.finished_at - state.started_at)
@@ -0,0 +1,68 @@
+"""
+Shared fixtures: SQLite databases loaded by the ETL from generated TheLook-shaped CSVs.
+
+Settings are read from the environment when app.config is imported, so the
+test environment is set here, before any app module is imported.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TMP = Path(tempfile.mkdtemp(prefix="runway-tests-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_TMP / 'api.db'}",
+    "ASYNC_DATABASE_URL": "",
+    "READ_DATABASE_URL": "",
+    "ANALYTICS_BACKEND": "sql",
+    "FCT_ORDER_ITEMS_TABLE": "",
+    "PARTITION_BY_MONTH": "false",
+    "RESPONSE_CACHE_ENABLED": "false",
+    "ETL_WORKERS": "1",
+    "MODEL_DIR": str(_TMP / "models"),
+    "ANALYTICS_SNAPSHOT_DIR": str(_TMP / "snapshots"),
+})
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "scripts"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from generate_synthetic_data import generate  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.etl import load_thelook_csvs  # noqa: E402
+
+ORDER_ITEMS = 3000
+
+
+def run_etl(monkeypatch, data_dir: Path, database_url: str, incremental: bool = False):
+    """Run the CSV load against `database_url` with the CSVs in `data_dir`"""
+    monkeypatch.setattr(load_thelook_csvs, "find_data_dir", lambda: data_dir)
+    monkeypatch.setattr(settings, "database_url", database_url)
+    load_thelook_csvs.load_csvs(mode="insert", workers=1, incremental=incremental)
+
+
+@pytest.fixture(scope="session")
+def csv_dir() -> Path:
+    path = _TMP / "csv"
+    generate(ORDER_ITEMS, path, seed=0)
+    return path
+
+
+@pytest.fixture(scope="session")
+def client(csv_dir):
+    """API client over the session database, loaded once"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        run_etl(monkeypatch, csv_dir, os.environ["DATABASE_URL"])
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(params=[True, False], ids=["rollups", "raw"])
+def use_rollups(request, monkeypatch):
+    monkeypatch.setattr(settings, "use_rollups", request.param)
+    return request.param
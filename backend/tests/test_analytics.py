@@ -0,0 +1,150 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from app import pagination
+from app.config import settings
+from app.etl.copy_loader import write_dataframe
+from app.models import create_schema
+from app.pagination import Cursor, decode_cursor, encode_cursor
+from app.rollups import rebuild_rollups
+
+ENDPOINTS = [
+    ("/analytics/summary", {}),
+    ("/analytics/dashboard", {}),
+    ("/analytics/returns-by-category", {}),
+    ("/analytics/returns-by-department", {}),
+    ("/analytics/revenue-by-department", {}),
+    ("/analytics/revenue-by-brand", {"limit": 1000}),
+    ("/analytics/revenue-by-country", {"limit": 1000}),
+    ("/analytics/age-distribution", {}),
+    ("/analytics/revenue-over-time", {"days": 30}),
+    ("/analytics/revenue-over-time", {"days": 5000}),
+    ("/analytics/revenue-over-time", {"start": "2022-01-01", "end": "2026-12-31", "granularity": "month"}),
+    ("/analytics/timeseries", {"start": "2022-01-01", "end": "2026-12-31", "granularity": "week", "breakdown": "category"}),
+]
+
+
+def _approx(value):
+    """`value` with every float compared approximately (sums differ in their last bits between sources)"""
+    if isinstance(value, dict):
+        return {key: _approx(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_approx(item) for item in value]
+    if isinstance(value, float):
+        return pytest.approx(value)
+    return value
+
+
+def _get(client, path: str, **params):
+    response = client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize("path, params", ENDPOINTS)
+def test_rollups_match_raw_tables(client, monkeypatch, path, params):
+    monkeypatch.setattr(settings, "use_rollups", True)
+    rollup = _get(client, path, **params)
+    monkeypatch.setattr(settings, "use_rollups", False)
+    raw = _get(client, path, **params)
+
+    assert raw
+    assert rollup == _approx(raw)
+
+
+def test_cursor_round_trip():
+    for cursor in [Cursor(0, ""), Cursor(123456789, "Brand 0001"), Cursor(-5, "Ünïcødé / \"quoted\"")]:
+        assert decode_cursor(encode_cursor(cursor)) == cursor
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", "bnVsbA==", "WzEsIDJd", "WyIxIiwgImEiXQ==", "W3RydWUsICJhIl0="])
+def test_decode_cursor_rejects_garbage(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("breakdown, key, count", [("brand", "brand", "product_count"), ("country", "country", "customer_count")])
+@pytest.mark.parametrize("limit", [1, 7, 1000])
+def test_pages_walk_the_whole_breakdown(client, use_rollups, breakdown, key, count, limit):
+    everything = _get(client, f"/analytics/revenue-by-{breakdown}", limit=100_000)
+
+    items, cursor, pages = [], None, 0
+    while True:
+        page = _get(client, f"/analytics/revenue-by-{breakdown}/page", limit=limit, **({"cursor": cursor} if cursor else {}))
+        assert len(page["items"]) <= limit
+        items += page["items"]
+        pages += 1
+        cursor = page.get("next_cursor")
+        if cursor is None:
+            break
+        assert pages <= len(everything)
+
+    assert [item[key] for item in items] == [row[key] for row in everything]
+    assert [item[count] for item in items] == [row[count] for row in everything]
+    assert [item["revenue"] for item in items] == pytest.approx([row["revenue"] for row in everything])
+
+
+@pytest.mark.parametrize("breakdown", ["brand", "country"])
+def test_page_rejects_bad_cursor(client, breakdown):
+    response = client.get(f"/analytics/revenue-by-{breakdown}/page", params={"cursor": "not a cursor"})
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def tied_db(tmp_path):
+    """Brands and countries tied on revenue (some only once rounded to cents), and NULL brands and countries"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'ties.db'}")
+    create_schema(engine)
+    countries = ["Japan", "China", None, "Brasil", "Spain"]
+    brands = ["B", None, "A", "C", None, "D", "E", "F"]
+    # (product_id, user_id, sale_price)
+    items = [
+        (1, 1, 10.0), (2, 2, 4.0), (2, 2, 6.0), (3, 4, 10.0), (4, 3, 10.0),
+        (6, 5, 20.0), (7, 1, 0.1), (7, 1, 0.2), (8, 4, 0.3),
+    ]
+    product_ids, user_ids, prices = zip(*items)
+    frames = {
+        "users": pd.DataFrame({"id": range(1, 6), "age": 30, "country": countries}),
+        "products": pd.DataFrame({"id": range(1, len(brands) + 1), "brand": brands, "category": "Jeans"}),
+        "orders": pd.DataFrame({"id": range(1, len(items) + 1), "user_id": user_ids,
+                                "status": "Complete", "created_at": "2024-01-01 00:00:00"}),
+    }
+    frames["order_items"] = frames["orders"].assign(
+        order_id=frames["orders"]["id"], product_id=product_ids, sale_price=prices
+    )
+    for table_name, df in frames.items():
+        write_dataframe(engine, df, table_name, "insert")
+    rebuild_rollups(engine)
+    yield engine
+    engine.dispose()
+
+
+def _walk(engine, breakdown: str, limit: int) -> list:
+    rows, cursor = [], None
+    with engine.connect() as conn:
+        while True:
+            after = decode_cursor(cursor) if cursor else None
+            page = conn.execute(
+                pagination.page_select(breakdown, after is not None), pagination.page_params(after, limit)
+            ).all()
+            page, cursor = pagination.split_page(page, limit)
+            rows += [(row.key, int(row.cents), row.count) for row in page]
+            if cursor is None:
+                return rows
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 100])
+def test_pages_break_ties_by_key(tied_db, use_rollups, limit):
+    # Ties in cents are ordered by key; NULL brands are one group keyed ''; E's 0.1 + 0.2 ties F's 0.3
+    assert _walk(tied_db, "brand", limit) == [
+        ("D", 2000, 1), ("", 1000, 1), ("A", 1000, 1), ("B", 1000, 1), ("C", 1000, 1), ("E", 30, 1), ("F", 30, 1),
+    ]
+    with tied_db.connect() as conn:
+        exported = conn.execute(pagination.export_select("brand")).all()
+    assert [row.brand for row in exported] == ["D", "Unknown", "A", "B", "C", "E", "F"]
+
+    # NULL countries are left out; Japan's 10 + 0.1 + 0.2 ties Brasil's 10 + 0.3
+    assert _walk(tied_db, "country", limit) == [
+        ("Spain", 2000, 1), ("Brasil", 1030, 1), ("Japan", 1030, 1), ("China", 1000, 1),
+    ]
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import approx, sketches
+from app.config import settings
+
+
+def _within(estimate: float, exact: float, bound: float) -> bool:
+    # A hair of slack for float sums
+    return abs(estimate - exact) <= bound + 1e-6 * max(abs(exact), 1.0)
+
+
+@pytest.mark.parametrize("n", [1, 50, 5_000, 200_000])
+def test_sketch_estimates_within_bound(n):
+    registers = sketches.merge([("all", sketches.build(pd.DataFrame({"k": ["all"] * n}), np.arange(n)).get("all"))])
+    count = sketches.estimate(registers["all"])
+    assert _within(count, n, sketches.error_bound(n))
+
+
+def test_merged_sketches_count_the_union():
+    ids = np.arange(30_000)
+    days = pd.DataFrame({"day": ids % 3})
+    # Overlapping id ranges per key: a sum of per-key counts would double-count
+    by_day = sketches.build(days, ids // 2)
+    merged = sketches.merge((0, blob) for blob in by_day.values())
+    assert set(by_day) == {0, 1, 2}
+    assert _within(sketches.estimate(merged[0]), 15_000, sketches.error_bound(15_000))
+    # Null ids aren't counted; an empty input has no sketch
+    assert sketches.build(pd.DataFrame({"day": [1, 1]}), [None, np.nan]) == {}
+
+
+def test_sampled_estimators_cover_the_truth():
+    rng = np.random.default_rng(0)
+    # Rollup rows as clusters: priced items (x) and their revenue (y)
+    x = rng.integers(1, 6, size=20_000).astype(float)
+    y = x * rng.gamma(2.0, 30.0, size=x.size)
+    fraction = 0.05
+    sums = ratios = 0
+    trials = 200
+    for _ in range(trials):
+        s = rng.random(x.size) < fraction
+        total, total_bound = approx.scaled_sum(y[s].sum(), (y[s] ** 2).sum(), fraction)
+        sums += _within(total, y.sum(), total_bound)
+        mean, mean_bound = approx.ratio(
+            y[s].sum(), (y[s] ** 2).sum(), x[s].sum(), (x[s] ** 2).sum(), (x[s] * y[s]).sum(), fraction
+        )
+        ratios += _within(mean, y.sum() / x.sum(), mean_bound)
+    # 95% intervals: allow some sampling noise in the coverage itself
+    assert sums / trials >= 0.9
+    assert ratios / trials >= 0.9
+
+    # A full "sample" is exact
+    assert approx.scaled_sum(y.sum(), (y ** 2).sum(), 1.0) == (pytest.approx(y.sum()), 0.0)
+
+
+def _get(client, path: str, **params):
+    response = client.get(path, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize("sample_rows", [None, 300], ids=["whole-rollup", "sampled"])
+def test_approx_endpoints_within_their_bounds(client, monkeypatch, sample_rows):
+    # The session database has about 3,000 sales rollup rows; by default they're all read
+    if sample_rows is not None:
+        monkeypatch.setattr(settings, "approx_sample_rows", sample_rows)
+    checks = []
+
+    def compare(path, key, fields, **params):
+        exact = {row[key]: row for row in _get(client, path, **params)}
+        estimated = _get(client, path, approx="true", **params)
+        assert estimated and all("error_bounds" not in row for row in exact.values())
+        for row in estimated:
+            assert set(row["error_bounds"]) == set(fields)
+            for field in fields:
+                checks.append(_within(row[field], exact[row[key]][field], row["error_bounds"][field]))
+                if sample_rows is None and field in ("revenue", "avg_order_value"):
+                    # Read whole, the sums are exact
+                    assert row[field] == pytest.approx(exact[row[key]][field])
+
+    compare("/analytics/revenue-by-brand", "brand", ["revenue"], limit=10_000)
+    compare("/analytics/revenue-by-country", "country", ["revenue", "customer_count"], limit=10_000)
+    compare("/analytics/age-distribution", "age_range", ["customer_count", "avg_order_value"])
+    for granularity in ["day", "month"]:
+        compare("/analytics/revenue-over-time", "date", ["order_count"],
+                start="2020-01-01", end="2026-12-31", granularity=granularity)
+
+    assert len(checks) > 50
+    assert sum(checks) / len(checks) >= 0.9
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from app import cache
+from app.config import settings
+from app.database import engine
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    """Response cache on, re-reading the data generation on every request"""
+    monkeypatch.setattr(settings, "response_cache_enabled", True)
+    monkeypatch.setattr(settings, "data_generation_poll_seconds", 0)
+    cache.response_cache.clear()
+    yield cache.response_cache
+    cache.response_cache.clear()
+
+
+def test_hit_and_not_modified(client, cached):
+    first = client.get("/analytics/revenue-by-brand", params={"limit": 5, "offset": 0})
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+
+    # Parameter order doesn't matter
+    second = client.get("/analytics/revenue-by-brand", params={"offset": 0, "limit": 5})
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.headers["ETag"] == etag
+    assert second.content == first.content
+
+    for header in [etag, f"W/{etag}", f'"other", {etag}', "*"]:
+        revalidated = client.get("/analytics/revenue-by-brand", params={"limit": 5, "offset": 0},
+                                 headers={"If-None-Match": header})
+        assert revalidated.status_code == 304, header
+        assert revalidated.content == b""
+        assert revalidated.headers["ETag"] == etag
+
+    changed = client.get("/analytics/revenue-by-brand", params={"limit": 5, "offset": 0},
+                         headers={"If-None-Match": '"other"'})
+    assert changed.status_code == 200
+    assert changed.content == first.content
+
+
+def test_generation_bump_invalidates(client, cached):
+    # Not one of warm-up's paths, which it may be caching in the background
+    path = "/analytics/revenue-by-country?limit=3"
+    assert client.get(path).headers["X-Cache"] == "MISS"
+    assert client.get(path).headers["X-Cache"] == "HIT"
+
+    with engine.begin() as conn:
+        cache.bump_generation(conn)
+
+    assert client.get(path).headers["X-Cache"] == "MISS"
+    assert client.get(path).headers["X-Cache"] == "HIT"
+
+
+def test_errors_and_exports_are_not_cached(client, cached):
+    bad = client.get("/analytics/revenue-by-brand/page", params={"cursor": "not a cursor"})
+    assert bad.status_code == 400
+    assert "X-Cache" not in bad.headers
+
+    export = client.get("/analytics/export/order-items")
+    assert export.status_code == 200
+    assert "X-Cache" not in export.headers
+
+    # Warm-up may be filling the cache in the background, so look for these two entries only
+    generation = cache.current_generation()
+    assert cached.get(("/analytics/revenue-by-brand/page", "cursor=not a cursor"), generation) is None
+    assert cached.get(("/analytics/export/order-items", ""), generation) is None
+
+
+def test_lru_eviction_and_expiry():
+    lru = cache.ResponseCache(max_entries=2)
+
+    def entry(generation=1, ttl=60):
+        return cache.CachedResponse(generation, time.monotonic() + ttl, '"e"', b"{}", "application/json")
+
+    lru.put(("a", ""), entry())
+    lru.put(("b", ""), entry())
+    assert lru.get(("a", ""), 1) is not None
+    lru.put(("c", ""), entry())
+    # "b" was least recently used
+    assert lru.get(("b", ""), 1) is None
+    assert lru.get(("a", ""), 1) is not None
+
+    assert lru.get(("c", ""), 2) is None
+    assert len(lru) == 1
+    lru.put(("d", ""), entry(ttl=-1))
+    assert lru.get(("d", ""), 1) is None
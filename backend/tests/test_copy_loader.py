@@ -0,0 +1,116 @@
+"""
+The bulk loaders (app.etl.copy_loader). INSERT paths run on SQLite; the COPY
+paths run in a scratch schema of the Postgres database named by
+TEST_POSTGRES_URL (skipped when it isn't set).
+"""
+import os
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.engine import make_url
+
+from app.etl.copy_loader import upsert_dataframe, write_dataframe
+from app.models import User, create_schema
+
+SCHEMA = "copy_loader_tests"
+
+
+def _users(ids, country="Japan"):
+    return pd.DataFrame({
+        "id": ids,
+        "age": [30 + i % 40 for i in ids],
+        "country": [country] * len(ids),
+        "created_at": pd.Timestamp("2024-01-01", tz="UTC"),
+    })
+
+
+def _countries(engine) -> dict:
+    with engine.connect() as conn:
+        return dict(conn.execute(select(User.id, User.country).order_by(User.id)).all())
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'loader.db'}")
+    create_schema(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def postgres_engine():
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("set TEST_POSTGRES_URL to a scratch Postgres database")
+    url = make_url(url).update_query_dict({"options": f"-csearch_path={SCHEMA}"})
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    create_schema(engine)
+    yield engine
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    engine.dispose()
+
+
+def _check_upsert(engine, mode: str):
+    assert upsert_dataframe(engine, _users([1, 2, 3]), "users", mode) == 3
+    # Re-running is idempotent; changed rows are updated, new ones inserted, duplicates keep the last
+    assert upsert_dataframe(engine, _users([2, 3, 4]), "users", mode) == 3
+    changed = pd.concat([_users([3], "China"), _users([5, 5], "Brasil")])
+    changed.iloc[-1, changed.columns.get_loc("country")] = "Spain"
+    assert upsert_dataframe(engine, changed, "users", mode) == 2
+    assert upsert_dataframe(engine, _users([]), "users", mode) == 0
+    assert _countries(engine) == {1: "Japan", 2: "Japan", 3: "China", 4: "Japan", 5: "Spain"}
+
+
+def test_insert_write_and_upsert(sqlite_engine):
+    _check_upsert(sqlite_engine, "insert")
+    assert write_dataframe(sqlite_engine, _users([10, 11]), "users", "insert") == 2
+    assert set(_countries(sqlite_engine)) == {1, 2, 3, 4, 5, 10, 11}
+
+
+def test_copy_falls_back_to_insert_off_postgres(sqlite_engine):
+    assert write_dataframe(sqlite_engine, _users([1, 2, 3]), "users", "copy", parallel_chunks=2) == 3
+    assert set(_countries(sqlite_engine)) == {1, 2, 3}
+
+
+@pytest.mark.parametrize("parallel_chunks", [1, 4])
+def test_copy_restores_indexes_and_foreign_keys(postgres_engine, parallel_chunks):
+    def constraints():
+        inspector = inspect(postgres_engine)
+        return (
+            sorted(index["name"] for index in inspector.get_indexes("orders")),
+            sorted(fk["name"] for fk in inspector.get_foreign_keys("orders")),
+        )
+
+    before = constraints()
+    assert before[0] and before[1]
+    write_dataframe(postgres_engine, _users(list(range(1, 101))), "users", "copy")
+    orders = pd.DataFrame({
+        "id": range(1, 1001),
+        # A nullable integer column with gaps must still COPY as integers
+        "user_id": [None if i % 50 == 0 else i % 100 + 1 for i in range(1, 1001)],
+        "status": "Complete",
+        "created_at": pd.Timestamp("2024-01-01", tz="UTC"),
+    })
+    assert write_dataframe(postgres_engine, orders, "orders", "copy", parallel_chunks) == 1000
+
+    assert constraints() == before
+    with postgres_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*), count(user_id) FROM orders")).one() == (1000, 980)
+
+
+def test_copy_upsert(postgres_engine):
+    _check_upsert(postgres_engine, "copy")
+
+
+def test_copy_keeps_foreign_keys_enforced(postgres_engine):
+    orders = pd.DataFrame({"id": [1], "user_id": [999], "status": ["Complete"]})
+    with pytest.raises(Exception, match="foreign key"):
+        write_dataframe(postgres_engine, orders, "orders", "copy")
+    with postgres_engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM orders")).scalar() == 0
+    assert {fk["referred_table"] for fk in inspect(postgres_engine).get_foreign_keys("orders")} == {"users"}
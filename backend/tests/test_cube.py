@@ -0,0 +1,39 @@
+import pytest
+
+from app.config import settings
+
+MEASURES = {"revenue", "item_count", "returned_count", "return_rate", "customer_count"}
+
+
+def _query(client, monkeypatch, use_rollups: bool, params: dict) -> dict:
+    monkeypatch.setattr(settings, "use_rollups", use_rollups)
+    response = client.get("/analytics/query", params={**params, "limit": 10000})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _by_group(rows):
+    return {tuple((name, value) for name, value in row.items() if name not in MEASURES): row for row in rows}
+
+
+@pytest.mark.parametrize("params", [
+    {"measures": "customer_count"},
+    {"measures": "customer_count", "country": "China"},
+    {"measures": "customer_count", "dimensions": "country"},
+    {"measures": "customer_count", "dimensions": "age_band", "country": ["China", "Japan"]},
+    {"measures": ["revenue", "item_count"], "dimensions": "category"},
+    {"measures": ["returned_count", "return_rate"], "dimensions": ["department", "country"]},
+    {"measures": ["revenue", "customer_count"], "dimensions": "country"},
+    {"measures": "revenue", "brand": "Brand 0001"},
+])
+def test_rollup_matches_raw(client, monkeypatch, params):
+    rollup = _query(client, monkeypatch, True, params)
+    raw = _query(client, monkeypatch, False, params)
+
+    assert rollup["source"] == "rollup"
+    assert raw["source"] == "raw"
+    expected = _by_group(raw["rows"])
+    actual = _by_group(rollup["rows"])
+    assert actual.keys() == expected.keys()
+    for group, row in expected.items():
+        assert actual[group] == pytest.approx(row)
@@ -0,0 +1,72 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from app.etl import watermarks
+from app.ml import feature_index
+from app.models import DailySalesRollup, DataGeneration, OrderItem
+from conftest import run_etl
+
+
+@pytest.fixture
+def etl_db(csv_dir, tmp_path, monkeypatch):
+    """A database fully loaded from a private copy of the CSVs: (data_dir, database_url, engine)"""
+    data_dir = tmp_path / "csv"
+    shutil.copytree(csv_dir, data_dir)
+    database_url = f"sqlite:///{tmp_path / 'etl.db'}"
+    run_etl(monkeypatch, data_dir, database_url)
+    engine = create_engine(database_url)
+    yield data_dir, database_url, engine
+    engine.dispose()
+
+
+def _deliver_shipped_items(data_dir, count: int = 25) -> list:
+    """Mark shipped items delivered in the CSV; only status and delivered_at change"""
+    items = pd.read_csv(data_dir / "order_items.csv")
+    shipped = items.index[items["status"] == "Shipped"][:count]
+    assert len(shipped) > 0
+    items.loc[shipped, "status"] = "Complete"
+    items.loc[shipped, "delivered_at"] = pd.Timestamp.now(tz="UTC").isoformat(sep=" ")
+    items.to_csv(data_dir / "order_items.csv", index=False)
+    return [int(item_id) for item_id in items.loc[shipped, "id"]]
+
+
+def test_incremental_load_picks_up_status_changes(etl_db, monkeypatch):
+    data_dir, database_url, engine = etl_db
+    delivered_ids = _deliver_shipped_items(data_dir)
+    run_etl(monkeypatch, data_dir, database_url, incremental=True)
+
+    with engine.connect() as conn:
+        statuses = conn.execute(select(OrderItem.status).where(OrderItem.id.in_(delivered_ids))).scalars().all()
+        raw_revenue = conn.execute(
+            select(func.sum(OrderItem.sale_price)).where(OrderItem.status == "Complete")
+        ).scalar()
+        rollup_revenue = conn.execute(select(func.sum(DailySalesRollup.revenue))).scalar()
+
+    assert statuses == ["Complete"] * len(delivered_ids)
+    assert rollup_revenue == pytest.approx(raw_revenue)
+
+
+@pytest.mark.parametrize("log_generations", [100, 1], ids=["changed-products", "log-too-short"])
+def test_feature_index_recounts_status_changes(etl_db, monkeypatch, log_generations):
+    data_dir, database_url, engine = etl_db
+    # With a one-generation log the refresh can't tell what changed and recounts every product
+    monkeypatch.setattr(watermarks, "CHANGE_LOG_GENERATIONS", log_generations)
+
+    def current_generation():
+        with engine.connect() as conn:
+            return conn.execute(select(DataGeneration.generation)).scalar() or 0
+
+    monkeypatch.setattr(feature_index, "current_generation", current_generation)
+    before = feature_index.build_snapshot(engine)
+    _deliver_shipped_items(data_dir)
+    run_etl(monkeypatch, data_dir, database_url, incremental=True)
+
+    refreshed = feature_index.build_snapshot(engine, before)
+    rebuilt = feature_index.build_snapshot(engine)
+    assert refreshed.resolved_items.sum() > before.resolved_items.sum()
+    np.testing.assert_array_equal(refreshed.resolved_items, rebuilt.resolved_items)
+    np.testing.assert_array_equal(refreshed.returned_items, rebuilt.returned_items)
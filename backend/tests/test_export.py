@@ -0,0 +1,89 @@
+import asyncio
+import csv
+import io
+import os
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import export
+from app.config import settings
+from app.database import engine
+from app.models import OrderItem
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def _download(client, dataset: str, file_format: str = "csv"):
+    with client.stream("GET", f"/analytics/export/{dataset}", params={"format": file_format}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-disposition"] == f'attachment; filename="{dataset}.{file_format}"'
+        return response.headers["content-type"], b"".join(response.iter_bytes())
+
+
+def _csv_rows(body: bytes) -> list:
+    return list(csv.DictReader(io.StringIO(body.decode())))
+
+
+def test_order_items_csv_has_every_item(client, monkeypatch):
+    monkeypatch.setattr(settings, "export_chunk_rows", 250)
+    content_type, body = _download(client, "order-items")
+    rows = _csv_rows(body)
+
+    assert content_type.startswith("text/csv")
+    with engine.connect() as conn:
+        item_ids = conn.execute(select(OrderItem.id)).scalars().all()
+    assert sorted(int(row["order_item_id"]) for row in rows) == sorted(item_ids)
+
+
+@pytest.mark.parametrize("breakdown, key, count", [("brand", "brand", "product_count"), ("country", "country", "customer_count")])
+def test_breakdown_exports_match_the_endpoint(client, use_rollups, breakdown, key, count):
+    everything = client.get(f"/analytics/revenue-by-{breakdown}", params={"limit": 100_000}).json()
+    rows = _csv_rows(_download(client, f"revenue-by-{breakdown}")[1])
+
+    assert [row[key] for row in rows] == [item[key] for item in everything]
+    assert [int(row[count]) for row in rows] == [item[count] for item in everything]
+    assert [float(row["revenue"]) for row in rows] == pytest.approx([item["revenue"] for item in everything])
+
+
+@pytest.mark.skipif(pq is None, reason="Parquet export needs pyarrow")
+def test_parquet_export_matches_csv(client, monkeypatch):
+    monkeypatch.setattr(settings, "export_chunk_rows", 250)
+    content_type, body = _download(client, "order-items", "parquet")
+    table = pq.read_table(io.BytesIO(body))
+
+    assert content_type == "application/vnd.apache.parquet"
+    # One row group per fetched chunk
+    assert pq.ParquetFile(io.BytesIO(body)).num_row_groups == -(-table.num_rows // 250)
+    csv_rows = _csv_rows(_download(client, "order-items")[1])
+    assert table.num_rows == len(csv_rows)
+    assert table.column_names == list(csv_rows[0])
+
+
+def test_parquet_without_pyarrow_is_501(client, monkeypatch):
+    monkeypatch.setattr(export, "pq", None)
+    response = client.get("/analytics/export/order-items", params={"format": "parquet"})
+    assert response.status_code == 501
+
+
+def test_stream_yields_a_chunk_per_fetch(client, monkeypatch):
+    monkeypatch.setattr(settings, "export_chunk_rows", 1000)
+    # Its own engine: the app's async engine belongs to the test client's event loop
+    bind = create_async_engine(os.environ["DATABASE_URL"].replace("sqlite://", "sqlite+aiosqlite://"))
+
+    async def collect():
+        try:
+            return [chunk async for chunk in export.stream(bind, "order-items", "csv")]
+        finally:
+            await bind.dispose()
+
+    chunks = asyncio.run(collect())
+    with engine.connect() as conn:
+        items = conn.execute(select(func.count()).select_from(OrderItem)).scalar()
+    # The header, then one chunk per 1,000 rows
+    assert len(chunks) == 1 + -(-items // 1000)
+    assert [chunk.count(b"\n") for chunk in chunks[1:-1]] == [1000] * (len(chunks) - 2)
@@ -0,0 +1,39 @@
+import logging
+
+from app import metrics
+from app.config import settings
+
+
+def _samples(body: str, metric: str) -> dict:
+    samples = {}
+    for line in body.splitlines():
+        if line.startswith(metric + "{"):
+            labels, value = line.rsplit(" ", 1)
+            samples[labels[len(metric):]] = float(value)
+    return samples
+
+
+def test_pool_checkout_waits_are_timed(client):
+    before = _samples(client.get("/metrics").text, "db_pool_checkout_wait_seconds_count")
+    for path in ["/analytics/summary", "/analytics/revenue-over-time", "/analytics/dashboard"]:
+        assert client.get(path).status_code == 200
+    after = _samples(client.get("/metrics").text, "db_pool_checkout_wait_seconds_count")
+
+    key = '{engine="async"}'
+    assert after[key] > before.get(key, 0)
+
+
+def test_slow_queries_are_logged(client, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "slow_query_ms", 1e-6)
+    with caplog.at_level(logging.WARNING, logger="app.metrics"):
+        assert client.get("/analytics/summary").status_code == 200
+
+    slow = [record for record in caplog.records if record.getMessage().startswith("Slow query ")]
+    assert slow and all(record.levelno == logging.WARNING for record in slow)
+    assert any("route /analytics/summary" in record.getMessage() for record in slow)
+
+
+def test_failed_explain_is_logged(caplog):
+    with caplog.at_level(logging.WARNING, logger="app.metrics"):
+        metrics._explain_and_log(None, "Slow query abc")
+    assert caplog.records[-1].getMessage().startswith("Slow query abc\n  (EXPLAIN failed: ")
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ALL_COMPLETED, wait
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import engine
+from app.ml import batch_score, bulk
+from app.ml.features import FEATURE_VERSION, N_HASHED_FEATURES, N_NUMERIC_FEATURES
+from app.ml.model import ReturnPredictionModel
+from app.ml.registry import ModelRegistry, registry, write_artifact
+from app.models import Product, User
+from app.ml.train import HOLDOUT_MODULUS, train, training_query
+from conftest import run_etl
+
+EMPTY_BODIES = [
+    {"products": []},
+    {field: [] for field in [
+        "product_id", "category", "brand", "department", "price", "discount_pct", "customer_age", "customer_country"
+    ]},
+    {"items": []},
+    {"product_id": []},
+]
+
+PRODUCT = {
+    "product_id": 1, "category": "Jeans", "brand": "Brand 0001", "department": "Women",
+    "price": 80.0, "discount_pct": 10.0, "customer_age": 25, "customer_country": "China",
+}
+
+
+@pytest.fixture(params=[True, False], ids=["trained", "heuristic"])
+def model(request, monkeypatch):
+    coef = np.full(N_NUMERIC_FEATURES + N_HASHED_FEATURES, 0.01) if request.param else None
+    prediction_model = ReturnPredictionModel(coef=coef, intercept=-1.0, version="test" if request.param else None)
+    monkeypatch.setattr(registry, "get", lambda: prediction_model)
+    return prediction_model
+
+
+@pytest.mark.parametrize("body", EMPTY_BODIES, ids=["rows", "columnar", "id-rows", "id-columnar"])
+def test_predict_empty_batch(client, model, body):
+    response = client.post("/ml/predict_returns", json=body)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"predictions": []}
+
+
+def test_predict_batch(client, model):
+    response = client.post("/ml/predict_returns", json={"products": [PRODUCT, {**PRODUCT, "product_id": 2}]})
+    assert response.status_code == 200, response.text
+    predictions = response.json()["predictions"]
+    assert [prediction["product_id"] for prediction in predictions] == [1, 2]
+    assert all(0.0 <= prediction["return_probability"] <= 1.0 for prediction in predictions)
+    assert all("historical_return_rate" not in prediction for prediction in predictions)
+
+
+def test_predict_by_id(client, model):
+    with engine.connect() as conn:
+        product_ids = conn.execute(select(Product.id).order_by(Product.id).limit(2)).scalars().all()
+        user_id = conn.execute(select(User.id).limit(1)).scalar()
+    response = client.post("/ml/predict_returns", json={"product_id": product_ids, "user_id": [user_id, None]})
+    assert response.status_code == 200, response.text
+    predictions = response.json()["predictions"]
+    assert [prediction["product_id"] for prediction in predictions] == product_ids
+    for prediction in predictions:
+        assert set(prediction) == {"product_id", "return_probability", "risk_label", "historical_return_rate"}
+        rate = prediction["historical_return_rate"]
+        assert rate is None or 0.0 <= rate <= 1.0
+
+    unknown = client.post("/ml/predict_returns", json={"items": [{"product_id": -1}]})
+    assert unknown.status_code == 422
+
+
+def _stream(client, body, content_type: str):
+    response = client.post("/ml/predict_returns/stream", content=body, headers={"Content-Type": content_type})
+    return response, [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_csv_matches_batch_predictions(client, model, monkeypatch):
+    monkeypatch.setattr(settings, "predict_stream_chunk_rows", 2)
+    products = [{**PRODUCT, "product_id": i, "price": 10.0 * i} for i in range(1, 6)]
+    expected = client.post("/ml/predict_returns", json={"products": products}).json()["predictions"]
+
+    # Columns in any order and case, CRLF line ends, a blank line and a bad row in the second chunk
+    header = list(reversed(list(PRODUCT)))
+    rows = [",".join(str(p[field]) for field in header) for p in products]
+    lines = [",".join(field.upper() for field in header), *rows[:2], "", rows[2], "oops,1", *rows[3:]]
+    response, out = _stream(client, "\r\n".join(lines), "text/csv; charset=utf-8")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    predictions = [line for line in out if "error" not in line]
+    assert sorted(predictions, key=lambda p: p["product_id"]) == expected
+    assert [line for line in out if "error" in line] == [{"line": 6, "error": "expected 8 fields, got 2"}]
+
+
+def test_stream_ndjson_split_mid_line(client, model):
+    product = {**PRODUCT, "product_id": 7}
+    body = (json.dumps(product) + "\n" + json.dumps({**product, "price": "free"}) + "\n").encode()
+    # The upload arrives in pieces that cut through lines
+    response, out = _stream(client, (body[i:i + 7] for i in range(0, len(body), 7)), "application/x-ndjson")
+
+    assert response.status_code == 200
+    assert out[0]["product_id"] == 7
+    assert out[1]["line"] == 2 and out[1]["error"].startswith("price: ")
+
+
+@pytest.mark.parametrize("body, content_type, status", [
+    ("a,b\n1,2\n", "text/plain", 415),
+    ("product_id,price\n1,2\n", "text/csv", 400),
+    ("", "text/csv", 400),
+])
+def test_stream_rejects_bad_uploads(client, model, body, content_type, status):
+    response, _ = _stream(client, body, content_type)
+    assert response.status_code == status
+
+
+def test_score_stream_yields_each_chunk(model):
+    async def lines():
+        for line_no in range(1, 6):
+            yield line_no, json.dumps({**PRODUCT, "product_id": line_no}).encode()
+
+    async def collect():
+        return [chunk async for chunk in bulk.score_stream(model, lines(), chunk_rows=2)]
+
+    chunks = asyncio.run(collect())
+    assert [chunk.count(b"\n") for chunk in chunks] == [2, 2, 1]
+
+
+@pytest.mark.parametrize("chunk_rows", [100_000, 250], ids=["one-chunk", "many-chunks"])
+def test_train_scores_every_holdout_row(client, tmp_path, monkeypatch, chunk_rows):
+    monkeypatch.setattr(settings, "model_dir", str(tmp_path))
+    with engine.connect() as conn:
+        training_ids = conn.execute(select(training_query().subquery().c.id)).scalars().all()
+
+    with open(train(chunk_rows=chunk_rows) / "meta.json") as f:
+        metrics = json.load(f)["metrics"]
+
+    assert metrics["holdout_rows"] == sum(1 for item_id in training_ids if item_id % HOLDOUT_MODULUS == 0)
+    assert metrics["holdout_log_loss"] is not None
+
+
+def test_batch_runs_started_together_get_distinct_ids(client):
+    runs = [batch_score._start_or_resume(engine, None, 100, 0.0, restart=True) for _ in range(3)]
+    ids = [run["id"] for run in runs]
+    assert len(set(ids)) == len(ids)
+    assert sorted(ids) == ids
+
+
+def _publish(version: str, weight: float, feature_version: int = FEATURE_VERSION):
+    n_features = N_NUMERIC_FEATURES + N_HASHED_FEATURES
+    meta = {"feature_version": feature_version, "n_features": n_features}
+    write_artifact(version, np.full(n_features, weight), -1.0, meta)
+
+
+def test_registry_hot_swaps_and_keeps_the_last_good_model(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "model_dir", str(tmp_path))
+    caplog.set_level(logging.INFO, logger="app.ml.registry")
+    models = ModelRegistry(poll_seconds=0)
+
+    heuristic = models.get()
+    assert not heuristic.is_trained
+    assert "No trained model found" in caplog.text
+
+    _publish("v1", 0.01)
+    assert models.refresh()
+    v1 = models.get()
+    assert v1.version == "v1" and isinstance(v1.coef, np.memmap)
+    assert not models.refresh()
+
+    # A broken version is logged and skipped; v1 keeps serving and the bad one isn't retried
+    _publish("v2", 0.02, feature_version=FEATURE_VERSION + 1)
+    assert not models.refresh()
+    assert models.get() is v1
+    assert [record.levelno for record in caplog.records if "v2" in record.getMessage()] == [logging.ERROR]
+    caplog.clear()
+    assert not models.refresh()
+    assert not caplog.records
+
+    _publish("v3", 0.03)
+    assert models.refresh()
+    assert models.get().version == "v3"
+    # Requests still holding v1 finish on it
+    product_ids, probabilities, _ = v1.predict_columns(
+        {"product_id": np.array([1]), "category": np.array(["Jeans"]), "brand": np.array(["Brand 0001"]),
+         "department": np.array(["Women"]), "price": np.array([80.0]), "discount_pct": np.array([0.0]),
+         "customer_age": np.array([25]), "customer_country": np.array(["China"])}
+    )
+    assert product_ids.tolist() == [1] and 0.0 <= probabilities[0] <= 1.0
+
+
+def test_registry_watcher_picks_up_new_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "model_dir", str(tmp_path))
+    _publish("v1", 0.01)
+    models = ModelRegistry(poll_seconds=0.05)
+    try:
+        assert models.get().version == "v1"
+        _publish("v2", 0.02)
+        deadline = time.monotonic() + 10
+        while models.get().version != "v2" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert models.get().version == "v2"
+    finally:
+        models.stop()
+
+
+def test_batch_progress_reports_every_tenth(csv_dir, tmp_path, monkeypatch, capsys):
+    # A private database, so the scoring process doesn't contend with the session's writers
+    run_etl(monkeypatch, csv_dir, f"sqlite:///{tmp_path / 'scores.db'}")
+    # Both in-flight chunks finish in every wait, so the finished count steps over odd tenths
+    monkeypatch.setattr(batch_score, "wait", lambda futures, return_when: wait(futures, return_when=ALL_COMPLETED))
+    batch_score.score_catalog(workers=1, chunk_products=15, restart=True)
+    progress = [line.split()[0] for line in capsys.readouterr().out.splitlines() if line.startswith("  ")]
+
+    done = [int(report.split("/")[0]) for report in progress]
+    total = int(progress[-1].split("/")[1])
+    every = total // 10
+    assert every % 2 == 1 and done[-1] == total
+    # Each report is the first one past the next tenth
+    thresholds = [every] + [(earlier // every + 1) * every for earlier in done[:-1]]
+    assert all(threshold <= report < threshold + 2 for threshold, report in zip(thresholds, done[:-1]))
@@ -0,0 +1,180 @@
+"""
+Monthly partitioning (app.partitions) only applies to Postgres, and the models
+read PARTITION_BY_MONTH at import. So the Postgres scenarios run in a child
+process with their own settings, in a scratch schema of the database named by
+TEST_POSTGRES_URL (skipped when it isn't set).
+
+Run this file directly to execute the scenarios against DATABASE_URL.
+"""
+import logging
+import os
+import subprocess
+import sys
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from app import partitions
+
+SCHEMA = "partition_tests"
+
+
+def test_month_arithmetic():
+    assert partitions.add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert partitions.add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert partitions.partition_name("orders", date(2024, 3, 1)) == "orders_p2024_03"
+
+
+def test_load_months_are_utc():
+    timestamps = ["2024-01-31 23:30:00-05:00", "2024-01-01 00:00:00+00:00", None, "not a date"]
+    assert partitions.load_months(timestamps) == {date(2024, 1, 1), date(2024, 2, 1)}
+
+
+def test_unpartitioned_table_logs_a_warning(monkeypatch, caplog):
+    monkeypatch.setattr(partitions, "is_partitioned", lambda conn, table_name: False)
+    with caplog.at_level(logging.WARNING, logger="app.partitions"):
+        assert partitions._ensure(None, "orders", [date(2024, 1, 1)]) == []
+    assert "orders isn't partitioned yet" in caplog.text
+
+
+def _partitioned_env(url: str) -> dict:
+    from sqlalchemy.engine import make_url
+
+    url = make_url(url).update_query_dict({"options": f"-csearch_path={SCHEMA}"})
+    return {
+        **os.environ,
+        "DATABASE_URL": url.render_as_string(hide_password=False),
+        "ASYNC_DATABASE_URL": "",
+        "READ_DATABASE_URL": "",
+        "PARTITION_BY_MONTH": "true",
+        "PARTITION_MONTHS_AHEAD": "0",
+        "PYTHONPATH": str(Path(__file__).parent.parent),
+    }
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="set TEST_POSTGRES_URL to a scratch Postgres database")
+@pytest.mark.parametrize("scenario", ["creates_and_routes", "moves_default_rows", "detaches", "upsert_moves_rows"])
+def test_partitioned_postgres(scenario):
+    result = subprocess.run(
+        [sys.executable, __file__, scenario],
+        env=_partitioned_env(os.environ["TEST_POSTGRES_URL"]),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+# Scenarios (run in the child process) ---------------------------------------------
+
+
+def _fresh_engine():
+    import pandas as pd
+    from sqlalchemy import create_engine, text
+
+    from app import partitions
+    from app.config import settings
+    from app.etl.copy_loader import upsert_dataframe
+    from app.models import create_schema
+
+    assert partitions.ENABLED
+    engine = create_engine(settings.database_url)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    create_schema(engine)
+    upsert_dataframe(engine, pd.DataFrame({"id": [1], "age": [30], "country": ["Japan"]}), "users")
+    return engine
+
+
+def _orders(ids, created_at, status="Processing"):
+    import pandas as pd
+
+    return pd.DataFrame({
+        "id": ids,
+        "user_id": [1] * len(ids),
+        "status": [status] * len(ids),
+        "created_at": pd.to_datetime(created_at, utc=True),
+    })
+
+
+def _rows_by_partition(engine, table_name: str):
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        return sorted(conn.execute(text(
+            f"SELECT id, tableoid::regclass::text, status FROM {table_name} ORDER BY id"
+        )).all())
+
+
+def creates_and_routes():
+    from datetime import datetime, timezone
+
+    from app import partitions
+    from app.etl.copy_loader import upsert_dataframe, write_dataframe
+
+    engine = _fresh_engine()
+    this_month = partitions.month_start(datetime.now(timezone.utc))
+    with engine.connect() as conn:
+        # create_schema: the current month (PARTITION_MONTHS_AHEAD=0) plus the default partition
+        assert partitions.existing_months(conn, "orders") == {this_month}
+        assert partitions.existing_months(conn, "order_items") == {this_month}
+
+    write_dataframe(engine, _orders([1, 2], ["2024-01-31 23:59:59", "2024-02-01 00:00:00"]), "orders", "copy")
+    upsert_dataframe(engine, _orders([3], ["2023-12-15"]), "orders", "insert")
+    assert _rows_by_partition(engine, "orders") == [
+        (1, "orders_p2024_01", "Processing"),
+        (2, "orders_p2024_02", "Processing"),
+        (3, "orders_p2023_12", "Processing"),
+    ]
+    assert partitions.ensure_partitions(engine, "orders", ["2024-01-10"]) == []
+
+
+def moves_default_rows():
+    from sqlalchemy import text
+
+    from app import partitions
+
+    engine = _fresh_engine()
+    with engine.begin() as conn:
+        # A row written without its month's partition lands in the default one
+        conn.execute(text("INSERT INTO orders (id, user_id, status, created_at) VALUES (1, 1, 'Processing', '2022-05-05')"))
+    assert _rows_by_partition(engine, "orders") == [(1, "orders_default", "Processing")]
+    assert partitions.ensure_partitions(engine, "orders", ["2022-05-20"]) == ["orders_p2022_05"]
+    assert _rows_by_partition(engine, "orders") == [(1, "orders_p2022_05", "Processing")]
+
+
+def detaches():
+    from sqlalchemy import text
+
+    from app import partitions
+    from app.etl.copy_loader import write_dataframe
+
+    engine = _fresh_engine()
+    write_dataframe(engine, _orders([1, 2, 3], ["2024-01-10", "2024-02-10", "2024-03-10"]), "orders", "copy")
+    detached = partitions.detach_partitions(engine, date(2024, 3, 1), archive_schema=f"{SCHEMA}_archive")
+    assert detached == ["orders_p2024_01", "orders_p2024_02"]
+    assert [row[0] for row in _rows_by_partition(engine, "orders")] == [3]
+    with engine.begin() as conn:
+        # Detaching only moves the rows out of the parent
+        archived = conn.execute(text(f"SELECT id FROM {SCHEMA}_archive.orders_p2024_01")).scalars().all()
+        conn.execute(text(f"DROP SCHEMA {SCHEMA}_archive CASCADE"))
+    assert archived == [1]
+
+
+def upsert_moves_rows():
+    from app.etl.copy_loader import upsert_dataframe
+
+    engine = _fresh_engine()
+    for mode, order_id in [("copy", 1), ("insert", 2)]:
+        upsert_dataframe(engine, _orders([order_id], ["2024-01-15"]), "orders", mode)
+        # Same id, created_at moved to another month: updated, not inserted a second time
+        upsert_dataframe(engine, _orders([order_id], ["2024-03-02"], "Shipped"), "orders", mode)
+    assert _rows_by_partition(engine, "orders") == [
+        (1, "orders_p2024_03", "Shipped"),
+        (2, "orders_p2024_03", "Shipped"),
+    ]
+
+
+if __name__ == "__main__":
+    globals()[sys.argv[1]]()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from app.etl import scheduler
+from app.etl.scheduler import dependency_graph, run_load_plan
+
+TABLES = ["users", "products", "orders", "order_items"]
+
+
+def test_dependency_graph_follows_foreign_keys():
+    assert dependency_graph(TABLES) == {
+        "users": set(),
+        "products": set(),
+        "orders": {"users"},
+        "order_items": {"orders", "products", "users"},
+    }
+    # Tables outside the plan aren't waited for
+    assert dependency_graph(["orders", "order_items"]) == {"orders": set(), "order_items": {"orders"}}
+
+
+def test_tables_start_once_their_parents_finish():
+    events = []
+    lock = threading.Lock()
+    # users and products can only both get past this if they run at the same time
+    independent = threading.Barrier(2, timeout=10)
+
+    def task(name, rows):
+        def load():
+            with lock:
+                events.append(("start", name))
+            if name in ("users", "products"):
+                independent.wait()
+            time.sleep(0.01)
+            with lock:
+                events.append(("end", name))
+            return rows
+        return load
+
+    results = run_load_plan({name: task(name, rows) for rows, name in enumerate(TABLES)}, max_workers=4)
+
+    assert {result.table: result.rows for result in results} == {"users": 0, "products": 1, "orders": 2, "order_items": 3}
+    assert all(result.seconds > 0 for result in results)
+    for child, parents in dependency_graph(TABLES).items():
+        for parent in parents:
+            assert events.index(("end", parent)) < events.index(("start", child))
+
+
+def test_failed_table_stops_its_children():
+    started = []
+
+    def task(name):
+        def load():
+            started.append(name)
+            if name == "users":
+                raise ValueError("bad users.csv")
+            return 1
+        return load
+
+    with pytest.raises(ValueError, match="bad users.csv"):
+        run_load_plan({name: task(name) for name in TABLES}, max_workers=1)
+    assert "orders" not in started and "order_items" not in started
+
+
+def test_foreign_key_cycle_is_reported(monkeypatch):
+    monkeypatch.setattr(scheduler, "dependency_graph", lambda tables: {"a": {"b"}, "b": {"a"}, "c": set()})
+    with pytest.raises(RuntimeError, match="cycle"):
+        run_load_plan({"a": lambda: 1, "b": lambda: 1, "c": lambda: 1})
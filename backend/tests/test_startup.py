@@ -0,0 +1,44 @@
+import logging
+import time
+
+from fastapi.testclient import TestClient
+
+
+def _startup_messages(caplog):
+    return [record.getMessage() for record in caplog.records if record.name in ("app.main", "app.warmup")]
+
+
+def test_startup_and_warm_up_are_logged(client, caplog):
+    caplog.set_level(logging.INFO, logger="app")
+    from app.main import app
+
+    with TestClient(app):
+        # Warm-up runs in the background after startup; /ready can't tell this run apart from the session's
+        deadline = time.monotonic() + 30
+        while not any(m.startswith("Warm-up finished in ") for m in _startup_messages(caplog)) \
+                and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    messages = _startup_messages(caplog)
+    assert any(message.startswith("Listening ") for message in messages)
+    assert any(message.startswith("Warm-up finished in ") for message in messages)
+
+
+def test_feature_index_logs_builds_and_failed_refreshes(client, caplog, monkeypatch):
+    from app.ml import feature_index
+
+    index = feature_index.FeatureIndex()
+    caplog.set_level(logging.INFO, logger="app.ml.feature_index")
+    index.get()
+
+    def fail(bind, previous=None):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(feature_index, "build_snapshot", fail)
+    index._refreshing.acquire()
+    index._refresh()
+
+    loaded, failed = caplog.records
+    assert loaded.levelno == logging.INFO and loaded.getMessage().startswith("Loaded feature index in ")
+    assert failed.levelno == logging.ERROR and failed.getMessage() == "Feature index refresh failed"
+    assert "database went away" in caplog.text
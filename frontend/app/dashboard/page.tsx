@@ -42,58 +42,35 @@ type AgeDistribution = {
   avg_order_value: number;
 };
 
-export default function DashboardPage() {
-  const { data: summary, isLoading: summaryLoading, error: summaryError } = useQuery<SummaryResponse>({
-    queryKey: ["summary"],
-    queryFn: async () => {
-      const response = await axios.get(`${API_BASE_URL}/analytics/summary`);
-      return response.data;
-    },
-    retry: 2,
-  });
-
-  const { data: categoryData, isLoading: categoryLoading, error: categoryError } = useQuery<ReturnsByCategory[]>({
-    queryKey: ["returns-by-category"],
-    queryFn: async () => {
-      const response = await axios.get(`${API_BASE_URL}/analytics/returns-by-category`);
-      return response.data.map((item: any) => ({
-        category: item.category,
-        return_rate: item.return_rate,
-      }));
-    },
-    retry: 2,
-  });
-
-  const { data: departmentRevenue, isLoading: deptLoading } = useQuery<RevenueByDepartment[]>({
-    queryKey: ["revenue-by-department"],
-    queryFn: async () => {
-      const response = await axios.get(`${API_BASE_URL}/analytics/revenue-by-department`);
-      return response.data;
-    },
-    retry: 2,
-  });
-
+type DashboardResponse = {
+  summary: SummaryResponse;
+  returns_by_category: ReturnsByCategory[];
+  revenue_by_department: RevenueByDepartment[];
+  revenue_by_brand: RevenueByBrand[];
+  age_distribution: AgeDistribution[];
+};
 
-  const { data: topBrands, isLoading: brandsLoading } = useQuery<RevenueByBrand[]>({
-    queryKey: ["revenue-by-brand"],
+export default function DashboardPage() {
+  // All panels come from a single request so the backend can share table scans
+  const { data: dashboard, isLoading, error: dashboardError } = useQuery<DashboardResponse>({
+    queryKey: ["dashboard"],
     queryFn: async () => {
-      const response = await axios.get(`${API_BASE_URL}/analytics/revenue-by-brand?limit=10`);
+      const response = await axios.get(`${API_BASE_URL}/analytics/dashboard?limit=10`);
       return response.data;
     },
     retry: 2,
   });
 
-  const { data: ageDistribution, isLoading: ageLoading } = useQuery<AgeDistribution[]>({
-    queryKey: ["age-distribution"],
-    queryFn: async () => {
-      const response = await axios.get(`${API_BASE_URL}/analytics/age-distribution`);
-      return response.data;
-    },
-    retry: 2,
-  });
+  const summary = dashboard?.summary;
+  const categoryData = dashboard?.returns_by_category.map((item) => ({
+    category: item.category,
+    return_rate: item.return_rate,
+  }));
+  const departmentRevenue = dashboard?.revenue_by_department;
+  const topBrands = dashboard?.revenue_by_brand;
+  const ageDistribution = dashboard?.age_distribution;
 
-  const isLoading = summaryLoading || categoryLoading;
-  const hasError = summaryError || categoryError;
+  const hasError = dashboardError;
   const isConnected = !hasError && !isLoading;
 
   // Loading state
@@ -125,7 +102,7 @@ export default function DashboardPage() {
             <div className="flex-1">
               <h3 className="text-red-900 font-semibold text-lg mb-2">Error loading data</h3>
               <p className="text-red-700 text-sm mb-4">
-                {summaryError?.message || categoryError?.message || "Failed to connect to backend"}
+                {dashboardError?.message || "Failed to connect to backend"}
               </p>
               <p className="text-red-600 text-sm">
                 Make sure the backend is running on http://localhost:8000
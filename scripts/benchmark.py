@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Load-test every API route and write a machine-readable benchmark report.
+
+Drives each /analytics/* route and POST /ml/predict_returns against a
+running API at several concurrency levels, and times every analytics SQL
+statement directly against the database. The JSON report holds p50/p95/p99
+latency, throughput, error and response-cache hit counts per route and
+concurrency level, plus per-query DB time, so releases can be compared
+with --compare.
+
+Optionally generates synthetic data (scripts/generate_synthetic_data.py)
+and loads it with the ETL first; load into an empty database.
+
+Usage:
+    python scripts/benchmark.py [--generate 1000000 --load] [--concurrency 1,8,32]
+        [--requests 200] [--output benchmark.json] [--compare previous.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).parent.parent
+BACKEND_DIR = REPO_ROOT / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from generate_synthetic_data import CATEGORIES, COUNTRIES, default_data_dir, generate  # noqa: E402
+
+
+class Route(NamedTuple):
+    name: str
+    method: str
+    path: str
+    body: Optional[bytes] = None
+
+
+def predict_body(batch_size: int, seed: int = 0) -> bytes:
+    """A predict_returns request with `batch_size` products drawn from the generator's vocabulary"""
+    rng = np.random.default_rng(seed)
+    products = []
+    for i in range(batch_size):
+        department, category, _, price = CATEGORIES[rng.integers(len(CATEGORIES))]
+        products.append({
+            "product_id": i + 1,
+            "category": category,
+            "brand": f"Brand {rng.integers(1, 2751):04d}",
+            "department": department,
+            "price": round(float(price * rng.lognormal(0.0, 0.45)), 2),
+            "discount_pct": float(rng.choice([0, 0, 0, 10, 20, 30, 50])),
+            "customer_age": int(rng.integers(12, 71)),
+            "customer_country": str(rng.choice(list(COUNTRIES))),
+        })
+    return json.dumps({"products": products}).encode()
+
+
+def routes(predict_batch: int) -> List[Route]:
+    return [
+        Route("summary", "GET", "/analytics/summary"),
+        Route("dashboard", "GET", "/analytics/dashboard?limit=10"),
+        Route("returns-by-category", "GET", "/analytics/returns-by-category"),
+        Route("revenue-by-department", "GET", "/analytics/revenue-by-department"),
+        Route("revenue-by-brand", "GET", "/analytics/revenue-by-brand?limit=10"),
+        Route("revenue-over-time", "GET", "/analytics/revenue-over-time?days=30"),
+        Route("returns-by-department", "GET", "/analytics/returns-by-department"),
+        Route("age-distribution", "GET", "/analytics/age-distribution"),
+        Route("revenue-by-country", "GET", "/analytics/revenue-by-country?limit=10"),
+        Route("predict-returns", "POST", "/ml/predict_returns", predict_body(predict_batch)),
+    ]
+
+
+def latency_stats(seconds: List[float]) -> Dict[str, Optional[float]]:
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    ms = np.asarray(seconds) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class HttpDriver:
+    """Issues requests over one keep-alive connection per worker thread"""
+
+    def __init__(self, base_url: str, timeout: float):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, route: Route):
+        """Send one request; returns (seconds, ok, cache hit)"""
+        headers = {"Content-Type": "application/json"} if route.body else {}
+        started = time.perf_counter()
+        try:
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = self._local.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            connection.request(route.method, route.path, body=route.body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - started
+            return elapsed, 200 <= response.status < 300, response.getheader("X-Cache") == "HIT"
+        except (OSError, http.client.HTTPException):
+            self._local.connection = None
+            return time.perf_counter() - started, False, False
+
+
+def run_route(driver: HttpDriver, route: Route, concurrency: int, requests: int, warmup: int) -> dict:
+    """Drive one route at a fixed concurrency and summarize the latencies"""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: driver.request(route), range(warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(lambda _: driver.request(route), range(requests)))
+        wall = time.perf_counter() - started
+    ok = [seconds for seconds, success, _ in results if success]
+    return {
+        "requests": requests,
+        "errors": requests - len(ok),
+        "cache_hits": sum(1 for _, success, hit in results if success and hit),
+        "throughput_rps": round(len(ok) / wall, 2) if wall > 0 else None,
+        **latency_stats(ok),
+    }
+
+
+def time_queries(runs: int) -> Dict[str, dict]:
+    """Execute every analytics and rollup-refresh statement directly and time it"""
+    from sqlalchemy import create_engine
+    from app.config import settings
+    from check_query_plans import plan_checks
+
+    engine = create_engine(settings.database_url)
+    report = {}
+    with engine.connect() as conn:
+        for check in plan_checks():
+            timings, rows = [], 0
+            for _ in range(runs):
+                started = time.perf_counter()
+                rows = len(conn.execute(check.statement).all())
+                timings.append(time.perf_counter() - started)
+            report[check.name] = {"runs": runs, "rows": rows, **latency_stats(timings)}
+            print(f"  {check.name:<45} p50 {report[check.name]['p50_ms']:>9.2f} ms  rows {rows}")
+    return report
+
+
+def table_counts() -> Dict[str, int]:
+    from sqlalchemy import create_engine, func, select
+    from app.config import settings
+    from app.models import Order, OrderItem, Product, User
+
+    engine = create_engine(settings.database_url)
+    with engine.connect() as conn:
+        return {
+            model.__tablename__: conn.execute(select(func.count()).select_from(model)).scalar()
+            for model in (User, Product, Order, OrderItem)
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_data() -> float:
+    """Run the ETL on the generated CSVs and return its wall time"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "app.etl.load_thelook_csvs"], cwd=BACKEND_DIR, check=True)
+    return time.perf_counter() - started
+
+
+def print_comparison(report: dict, baseline: dict):
+    """Per route and concurrency: p95 latency and throughput against a previous report"""
+    print(f"\n{'route':<24}{'conc':>6}{'p95 ms':>12}{'was':>10}{'rps':>10}{'was':>10}")
+    for name, levels in report["routes"].items():
+        for level, stats in levels.items():
+            before = baseline.get("routes", {}).get(name, {}).get(level)
+            if not before:
+                continue
+            print(
+                f"{name:<24}{level:>6}{stats['p95_ms'] or 0:>12.1f}{before['p95_ms'] or 0:>10.1f}"
+                f"{stats['throughput_rps'] or 0:>10.1f}{before['throughput_rps'] or 0:>10.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API routes and analytics queries")
+    parser.add_argument("--base-url", default=os.getenv("BENCHMARK_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route and level")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per route and level")
+    parser.add_argument("--predict-batch", type=int, default=100, help="products per predict_returns request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--generate", type=int, default=None, metavar="ORDER_ITEMS", help="generate synthetic CSVs first")
+    parser.add_argument("--load", action="store_true", help="load the CSVs with the ETL before benchmarking")
+    parser.add_argument("--query-runs", type=int, default=5, help="direct executions per SQL statement (0 to skip)")
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"), help="report path")
+    parser.add_argument("--compare", type=Path, default=None, help="previous report to compare against")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "base_url": args.base_url,
+            "concurrency": levels,
+            "requests_per_level": args.requests,
+            "predict_batch": args.predict_batch,
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+    }
+
+    if args.generate:
+        generate(args.generate, default_data_dir())
+        report["meta"]["generated_order_items"] = args.generate
+    if args.load:
+        report["load_seconds"] = round(load_data(), 3)
+
+    if args.query_runs > 0:
+        report["meta"]["table_rows"] = table_counts()
+        print("Timing analytics SQL statements...")
+        report["queries"] = time_queries(args.query_runs)
+
+    driver = HttpDriver(args.base_url, args.timeout)
+    report["routes"] = {}
+    for route in routes(args.predict_batch):
+        report["routes"][route.name] = {}
+        for level in levels:
+            stats = run_route(driver, route, level, args.requests, args.warmup)
+            report["routes"][route.name][str(level)] = stats
+            print(
+                f"{route.name:<24} c={level:<4} p50 {stats['p50_ms'] or 0:>8.1f} ms  p95 {stats['p95_ms'] or 0:>8.1f} ms  "
+                f"p99 {stats['p99_ms'] or 0:>8.1f} ms  {stats['throughput_rps'] or 0:>8.1f} req/s  "
+                f"errors {stats['errors']}  cache hits {stats['cache_hits']}"
+            )
+
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {args.output}")
+    if args.compare:
+        print_comparison(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
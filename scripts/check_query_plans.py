@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Check that the analytics and rollup queries are served by indexes.
+
+Runs EXPLAIN on every query behind /analytics/* (raw and rollup paths) and
+on the rollup refresh queries against the database in DATABASE_URL, and
+exits non-zero if any plan reads a table with a full scan that the query
+isn't expected to need, or reads order_items through a different index
+than the one the query is meant to use. Sequential scans are disabled for
+the session, so a Seq Scan in the plan means no index can serve that access
+path at all, even on a small seeded database.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/check_query_plans.py [--verbose]
+"""
+import argparse
+import json
+import re
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from sqlalchemy import and_, create_engine, text  # noqa: E402
+
+from app import rollups  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.models import OrderItem  # noqa: E402
+from app.routers import analytics  # noqa: E402
+
+
+class PlanCheck(NamedTuple):
+    name: str
+    statement: object
+    # Tables the query reads in full by design (small dimensions, pre-aggregates)
+    full_scan_ok: Iterable[str] = ()
+    # Indexes that must serve a table's access path (others fall back to the generic check)
+    indexes: Dict[str, Iterable[str]] = {}
+
+
+def plan_checks() -> List[PlanCheck]:
+    today = date.today()
+    window_start = datetime.combine(today - timedelta(days=30), datetime.min.time())
+    day_start = datetime.combine(today - timedelta(days=3), datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    day_window = and_(OrderItem.created_at >= day_start, OrderItem.created_at < day_end)
+    ids = list(range(1, 51))
+    return [
+        # analytics.py, raw tables (USE_ROLLUPS=false)
+        PlanCheck("analytics: product breakdown", analytics._product_breakdown_select(),
+                  full_scan_ok={"products"}, indexes={"order_items": {"ix_order_items_product_id_status"}}),
+        PlanCheck("analytics: customer breakdown", analytics._customer_breakdown_select(),
+                  full_scan_ok={"users"}, indexes={"order_items": {"ix_order_items_user_id_complete"}}),
+        PlanCheck("analytics: revenue over time", analytics._revenue_over_time_select(window_start),
+                  indexes={"order_items": {"ix_order_items_status_created_at"}}),
+        PlanCheck("analytics: revenue over time (first day)", analytics._revenue_over_time_select(day_start, day_end),
+                  indexes={"order_items": {"ix_order_items_status_created_at"}}),
+        # analytics.py, rollups
+        PlanCheck("rollups: product breakdown", rollups.product_breakdown_select(),
+                  full_scan_ok={"rollup_daily_sales", "rollup_product_sales"}),
+        PlanCheck("rollups: customer breakdown", rollups.customer_breakdown_select(),
+                  full_scan_ok={"rollup_daily_sales", "rollup_customer_sales"}),
+        PlanCheck("rollups: daily totals", rollups.daily_totals_select(after=window_start.date())),
+        # Rollup refresh after a load
+        PlanCheck("refresh: daily sales", rollups._daily_sales_select().where(day_window),
+                  full_scan_ok={"products", "users"}, indexes={"order_items": {"ix_order_items_created_at"}}),
+        PlanCheck("refresh: daily totals", rollups._daily_totals_select().where(day_window),
+                  indexes={"order_items": {"ix_order_items_status_created_at"}}),
+        PlanCheck("refresh: product sales", rollups._product_sales_select(ids),
+                  indexes={"order_items": {"ix_order_items_product_id_status"}}),
+        PlanCheck("refresh: customer sales", rollups._customer_sales_select(ids),
+                  indexes={"order_items": {"ix_order_items_user_id_complete"}}),
+    ]
+
+
+def _nodes(node: dict):
+    """Yield every node in an EXPLAIN (FORMAT JSON) plan tree"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from _nodes(child)
+
+
+def leading_columns(conn) -> Dict[str, Tuple[str, str]]:
+    """Index name -> (table, first key column) for every index in the schema
+
+    A partition's index maps to its partitioned table (see app.partitions).
+    """
+    rows = conn.execute(text("""
+        SELECT i.relname, coalesce(parent.relname, t.relname), a.attname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = x.indkey[0]
+        LEFT JOIN pg_inherits h ON h.inhrelid = t.oid
+        LEFT JOIN pg_class parent ON parent.oid = h.inhparent
+        WHERE n.nspname = current_schema()
+    """))
+    return {index: (table, column) for index, table, column in rows}
+
+
+def parent_indexes(conn) -> Dict[str, str]:
+    """Partition index name -> name of the partitioned index it belongs to"""
+    rows = conn.execute(text("""
+        SELECT i.relname, parent.relname
+        FROM pg_inherits h
+        JOIN pg_class i ON i.oid = h.inhrelid AND i.relkind = 'i'
+        JOIN pg_class parent ON parent.oid = h.inhparent
+    """))
+    return dict(rows.all())
+
+
+def empty_partitions(conn) -> Set[str]:
+    """Partitions with no rows, such as future months and the default partition; and their indexes"""
+    rows = conn.execute(text("""
+        SELECT t.relname, i.relname
+        FROM pg_class t
+        LEFT JOIN pg_index x ON x.indrelid = t.oid
+        LEFT JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE t.relispartition AND t.relkind = 'r' AND t.reltuples <= 0
+    """))
+    return {name for row in rows for name in row if name}
+
+
+def full_scans(
+    plan: dict,
+    check: PlanCheck,
+    indexes: Dict[str, Tuple[str, str]],
+    parents: Dict[str, str],
+    empty: Set[str]
+) -> List[str]:
+    """Scan nodes that read a whole table or index without the query allowing it"""
+    problems = []
+    for node in _nodes(plan):
+        node_type = node["Node Type"]
+        # Any access path reads an empty partition for free
+        if node.get("Relation Name") in empty or node.get("Index Name") in empty:
+            continue
+        if node_type == "Seq Scan":
+            if node["Relation Name"] not in check.full_scan_ok:
+                problems.append(f"Seq Scan on {node['Relation Name']}")
+            continue
+        if node_type not in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+            continue
+        table, leading = indexes.get(node["Index Name"], (node.get("Relation Name"), None))
+        index_name = parents.get(node["Index Name"], node["Index Name"])
+        if table in check.full_scan_ok:
+            continue
+        if table in check.indexes:
+            if index_name not in check.indexes[table]:
+                problems.append(f"{node_type} on {table} using {index_name}, expected {', '.join(sorted(check.indexes[table]))}")
+            continue
+        # A condition only on later key columns still walks the whole index
+        condition = node.get("Index Cond", "")
+        if leading is None or re.search(rf"\b{re.escape(leading)}\b", condition):
+            continue
+        problems.append(f"full {node_type} on {table} using {node['Index Name']}")
+    return problems
+
+
+def explain(conn, statement) -> dict:
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    result = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return plan[0]["Plan"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail if an analytics query plan falls back to a full scan")
+    parser.add_argument("--verbose", action="store_true", help="print every scan node, not just failures")
+    args = parser.parse_args()
+
+    engine = create_engine(settings.database_url)
+    if engine.dialect.name != "postgresql":
+        print(f"Query plan checks need Postgres, not {engine.dialect.name}")
+        return 2
+
+    failures = 0
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        indexes = leading_columns(conn)
+        parents = parent_indexes(conn)
+        empty = empty_partitions(conn)
+        for check in plan_checks():
+            plan = explain(conn, check.statement)
+            problems = full_scans(plan, check, indexes, parents, empty)
+            print(f"{'FAIL' if problems else 'ok  '} {check.name}")
+            for problem in problems:
+                print(f"       {problem}")
+            if args.verbose:
+                for node in _nodes(plan):
+                    if "Scan" in node["Node Type"]:
+                        target = node.get("Relation Name") or indexes.get(node.get("Index Name"), ("?",))[0]
+                        print(f"       {node['Node Type']} on {target} {node.get('Index Name', '')} {node.get('Index Cond', '')}")
+            failures += bool(problems)
+
+    print(f"\n{failures} of {len(plan_checks())} queries fall back to full scans" if failures else "\nAll query plans use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
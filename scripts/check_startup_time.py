@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Check that the API starts listening within its startup budget.
+
+Starts `uvicorn app.main:app` in backend/ against the database in
+DATABASE_URL, waits for GET /health, then for GET /ready, and prints the
+process-start-to-listening time, the import-to-listening time the app
+measured itself, and how long the background warm-up took. Exits non-zero
+if import-to-listening exceeds STARTUP_BUDGET_SECONDS (or --budget), or if
+the worker doesn't become ready within --ready-timeout.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/check_startup_time.py [--budget 2.0] [--runs 3]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(port: int, path: str):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def wait_for(port: int, path: str, status: int, timeout: float, process: subprocess.Popen):
+    """Poll until `path` answers `status`; returns the body, or None on timeout or exit"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            code, body = get(port, path)
+            if code == status:
+                return body
+        except OSError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def measure(ready_timeout: float) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if wait_for(port, "/health", 200, 60, process) is None:
+            raise RuntimeError("the API never answered /health")
+        listening = time.perf_counter() - started
+        body = wait_for(port, "/ready", 200, ready_timeout, process)
+        if body is None:
+            _, body = get(port, "/ready")
+            report = json.loads(body)
+            raise RuntimeError(f"not ready after {ready_timeout:.0f}s: {report['steps']}")
+        report = json.loads(body)
+        return {
+            "process_to_listening": listening,
+            "import_to_listening": report["startup_seconds"],
+            "warmup": report["warmup_seconds"],
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail if API startup exceeds its time budget")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", "2.0")),
+                        help="import-to-listening budget in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="startups to measure (the slowest one counts)")
+    parser.add_argument("--ready-timeout", type=float, default=120.0, help="seconds to wait for /ready")
+    args = parser.parse_args()
+
+    worst = 0.0
+    for run in range(1, args.runs + 1):
+        try:
+            timings = measure(args.ready_timeout)
+        except RuntimeError as e:
+            print(f"FAIL run {run}: {e}")
+            return 1
+        worst = max(worst, timings["import_to_listening"])
+        print(
+            f"run {run}: import to listening {timings['import_to_listening']:.2f}s, "
+            f"process start to listening {timings['process_to_listening']:.2f}s, warm-up {timings['warmup']:.2f}s"
+        )
+
+    if worst > args.budget:
+        print(f"\nFAIL: import to listening took {worst:.2f}s, budget {args.budget:.2f}s")
+        return 1
+    print(f"\nImport to listening within budget ({worst:.2f}s of {args.budget:.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Generate TheLook-shaped CSVs at a chosen scale.
+
+Writes users.csv, products.csv, orders.csv and order_items.csv with the
+columns `app.etl.load_thelook_csvs` reads, for anything from 10k to 100M
+order items. Rows are generated and appended in chunks, so memory stays
+bounded by --chunk-rows, not by the scale.
+
+The shape follows TheLook: ~1.5 items per order, order items share their
+order's status, and popularity is skewed (Zipf-like) across brands,
+products and categories, with TheLook's country mix and a customer base
+that grows over time.
+
+Usage:
+    python scripts/generate_synthetic_data.py --order-items 1000000 [--out data/raw] [--seed 0]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# (department, category, weight, typical retail price)
+CATEGORIES = [
+    ("Women", "Intimates", 0.075, 30), ("Women", "Tops & Tees", 0.060, 35),
+    ("Women", "Fashion Hoodies & Sweatshirts", 0.040, 55), ("Women", "Sweaters", 0.045, 75),
+    ("Women", "Dresses", 0.050, 90), ("Women", "Jeans", 0.045, 80),
+    ("Women", "Swim", 0.040, 55), ("Women", "Sleep & Lounge", 0.040, 40),
+    ("Women", "Shorts", 0.030, 40), ("Women", "Accessories", 0.035, 45),
+    ("Women", "Pants & Capris", 0.025, 60), ("Women", "Outerwear & Coats", 0.020, 140),
+    ("Women", "Socks & Hosiery", 0.015, 15), ("Women", "Skirts", 0.010, 50),
+    ("Women", "Maternity", 0.015, 45), ("Women", "Plus", 0.010, 45),
+    ("Men", "Underwear", 0.040, 25), ("Men", "Tops & Tees", 0.055, 35),
+    ("Men", "Fashion Hoodies & Sweatshirts", 0.045, 60), ("Men", "Sweaters", 0.035, 80),
+    ("Men", "Jeans", 0.045, 85), ("Men", "Swim", 0.035, 40), ("Men", "Shorts", 0.040, 45),
+    ("Men", "Sleep & Lounge", 0.025, 45), ("Men", "Accessories", 0.030, 40),
+    ("Men", "Pants", 0.035, 65), ("Men", "Outerwear & Coats", 0.020, 160),
+    ("Men", "Active", 0.025, 50), ("Men", "Socks", 0.020, 15), ("Men", "Suits & Sport Coats", 0.010, 220),
+]
+
+# TheLook's customer country mix
+COUNTRIES = {
+    "China": 0.340, "United States": 0.225, "Brasil": 0.145, "South Korea": 0.053,
+    "France": 0.047, "United Kingdom": 0.045, "Germany": 0.042, "Spain": 0.040,
+    "Japan": 0.025, "Australia": 0.022, "Belgium": 0.012, "Poland": 0.002,
+    "Colombia": 0.001, "Austria": 0.001,
+}
+
+ORDER_STATUSES = {"Complete": 0.25, "Shipped": 0.30, "Processing": 0.20, "Cancelled": 0.15, "Returned": 0.10}
+ITEMS_PER_ORDER = {1: 0.65, 2: 0.25, 3: 0.07, 4: 0.03}
+N_BRANDS = 2750
+MAX_PRODUCTS = 29120
+
+
+def default_data_dir() -> Path:
+    """Where the ETL looks for CSVs: the Docker volume mount, else data/raw in the repo"""
+    if Path("/data/raw").exists():
+        return Path("/data/raw")
+    return Path(__file__).parent.parent / "data" / "raw"
+
+
+def zipf_weights(n: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    """Normalized 1/rank^exponent weights, assigned to the n items in random order"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def _choice(rng: np.random.Generator, options: dict, size: int) -> np.ndarray:
+    probabilities = np.array(list(options.values()))
+    return np.array(list(options))[rng.choice(len(options), size=size, p=probabilities / probabilities.sum())]
+
+
+def _timestamps(rng: np.random.Generator, size: int, end: pd.Timestamp, years: float) -> pd.DatetimeIndex:
+    # u ** 0.6 skews towards `end`: the business (and its order volume) grows over time
+    age_seconds = (1.0 - rng.random(size) ** 0.6) * years * 365.25 * 86400
+    return end - pd.to_timedelta(age_seconds.astype(np.int64), unit="s")
+
+
+def _format_times(times: pd.DatetimeIndex) -> np.ndarray:
+    """TheLook-style UTC timestamp strings ("" for NaT); several times faster than to_csv's formatting"""
+    text = np.datetime_as_string(times.tz_convert("UTC").tz_localize(None).to_numpy(), unit="s")
+    text = np.char.add(np.char.replace(text, "T", " "), "+00:00")
+    return np.where(times.isna(), "", text)
+
+
+def _write(df: pd.DataFrame, path: Path, first: bool):
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.DatetimeTZDtype):
+            df[column] = _format_times(pd.DatetimeIndex(df[column]))
+    df.to_csv(path, mode="w" if first else "a", header=first, index=False)
+
+
+def generate(order_items: int, out: Path, seed: int = 0, chunk_rows: int = 1_000_000, years: float = 4.0):
+    """Write the four CSVs for `order_items` order items into `out`"""
+    rng = np.random.default_rng(seed)
+    out.mkdir(parents=True, exist_ok=True)
+    end = pd.Timestamp.now(tz="UTC").floor("s")
+    n_users = max(100, int(order_items / 1.8))
+    n_products = int(np.clip(order_items // 6, 100, MAX_PRODUCTS))
+    started = time.perf_counter()
+
+    # Products: brand popularity and category mix are skewed, prices vary by category
+    category_weights = np.array([weight for _, _, weight, _ in CATEGORIES])
+    category_idx = rng.choice(len(CATEGORIES), size=n_products, p=category_weights / category_weights.sum())
+    brand_idx = rng.choice(N_BRANDS, size=n_products, p=zipf_weights(N_BRANDS, 1.1, rng))
+    base_price = np.array([CATEGORIES[i][3] for i in category_idx], dtype=np.float64)
+    retail_price = np.round(base_price * rng.lognormal(0.0, 0.45, n_products), 2)
+    products = pd.DataFrame({
+        "id": np.arange(1, n_products + 1),
+        "cost": np.round(retail_price * rng.uniform(0.35, 0.6, n_products), 2),
+        "category": [CATEGORIES[i][1] for i in category_idx],
+        "name": [f"Product {i}" for i in range(1, n_products + 1)],
+        "brand": [f"Brand {i + 1:04d}" for i in brand_idx],
+        "retail_price": retail_price,
+        "department": [CATEGORIES[i][0] for i in category_idx],
+        "created_at": _timestamps(rng, n_products, end, years),
+    })
+    _write(products, out / "products.csv", first=True)
+    product_popularity = zipf_weights(n_products, 0.9, rng)
+
+    # Users, in chunks; signups accumulate over time like orders do
+    users_path = out / "users.csv"
+    for start in range(0, n_users, chunk_rows):
+        size = min(chunk_rows, n_users - start)
+        ids = np.arange(start + 1, start + size + 1)
+        _write(pd.DataFrame({
+            "id": ids,
+            "first_name": "First",
+            "last_name": [f"Last{i}" for i in ids],
+            "email": [f"user{i}@example.com" for i in ids],
+            "age": rng.integers(12, 71, size),
+            "gender": rng.choice(["M", "F"], size),
+            "state": "",
+            "city": "",
+            "country": _choice(rng, COUNTRIES, size),
+            "created_at": _timestamps(rng, size, end, years),
+        }), users_path, first=start == 0)
+
+    # Orders and their items, in chunks of orders, until the item target is met
+    orders_path, items_path = out / "orders.csv", out / "order_items.csv"
+    items_per_order = np.array(list(ITEMS_PER_ORDER))
+    items_probabilities = np.array(list(ITEMS_PER_ORDER.values()))
+    mean_items = float((items_per_order * items_probabilities).sum())
+    order_id = item_id = 0
+    while item_id < order_items:
+        n_orders = max(1, min(chunk_rows, int((order_items - item_id) / mean_items) + 1))
+        counts = rng.choice(items_per_order, size=n_orders, p=items_probabilities)
+        # Trim the last chunk to hit the target exactly
+        overflow = item_id + counts.sum() - order_items
+        if overflow > 0:
+            cumulative = np.cumsum(counts)
+            keep = int(np.searchsorted(cumulative, order_items - item_id)) + 1
+            counts = counts[:keep]
+            counts[-1] -= cumulative[keep - 1] - (order_items - item_id)
+            n_orders = keep
+
+        ids = np.arange(order_id + 1, order_id + n_orders + 1)
+        status = _choice(rng, ORDER_STATUSES, n_orders)
+        created = _timestamps(rng, n_orders, end, years)
+        shipped = created + pd.to_timedelta(rng.integers(3600, 3 * 86400, n_orders), unit="s")
+        delivered = shipped + pd.to_timedelta(rng.integers(86400, 5 * 86400, n_orders), unit="s")
+        returned = delivered + pd.to_timedelta(rng.integers(86400, 14 * 86400, n_orders), unit="s")
+        # Recent orders can't have been shipped, delivered or returned in the future
+        shipped, delivered, returned = (times.where(times <= end, end) for times in (shipped, delivered, returned))
+        shipped = shipped.where(np.isin(status, ["Shipped", "Complete", "Returned"]))
+        delivered = delivered.where(np.isin(status, ["Complete", "Returned"]))
+        returned = returned.where(status == "Returned")
+        user_id = rng.integers(1, n_users + 1, n_orders)
+        orders = pd.DataFrame({
+            "order_id": ids,
+            "user_id": user_id,
+            "status": status,
+            "created_at": created,
+            "returned_at": returned,
+            "shipped_at": shipped,
+            "delivered_at": delivered,
+            "num_of_item": counts,
+        })
+        _write(orders, orders_path, first=order_id == 0)
+
+        # Items inherit their order's user, status and timestamps
+        n_items = int(counts.sum())
+        parent = np.repeat(np.arange(n_orders), counts)
+        product_id = rng.choice(n_products, size=n_items, p=product_popularity) + 1
+        price = retail_price[product_id - 1]
+        discounted = rng.random(n_items) < 0.2
+        discount = np.where(discounted, np.round(price * rng.uniform(0.1, 0.5, n_items), 2), 0.0)
+        _write(pd.DataFrame({
+            "id": np.arange(item_id + 1, item_id + n_items + 1),
+            "order_id": ids[parent],
+            "user_id": user_id[parent],
+            "product_id": product_id,
+            "inventory_item_id": np.arange(item_id + 1, item_id + n_items + 1),
+            "status": status[parent],
+            "created_at": created[parent],
+            "shipped_at": shipped[parent],
+            "delivered_at": delivered[parent],
+            "returned_at": returned[parent],
+            "sale_price": np.round(price - discount, 2),
+            "discount": discount,
+        }), items_path, first=item_id == 0)
+
+        order_id += n_orders
+        item_id += n_items
+        print(f"  {item_id:,} / {order_items:,} order items")
+
+    print(
+        f"Wrote {n_users:,} users, {n_products:,} products, {order_id:,} orders and "
+        f"{item_id:,} order items to {out} in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate TheLook-shaped CSVs")
+    parser.add_argument("--order-items", type=int, default=100_000, help="number of order items (10k to 100M)")
+    parser.add_argument("--out", type=Path, default=None, help="output directory (default: the ETL's data/raw)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--years", type=float, default=4.0, help="history length in years")
+    parser.add_argument("--chunk-rows", type=int, default=1_000_000, help="rows generated and written per chunk")
+    args = parser.parse_args()
+    generate(args.order_items, args.out or default_data_dir(), seed=args.seed, chunk_rows=args.chunk_rows, years=args.years)